@@ -1,34 +1,60 @@
-from typing import Optional, Union
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import heapq
 
 import numpy as np
+from scipy.sparse import csr_matrix
 from tqdm import tqdm
 import sparse
 
 import TMM.models.mdp as mdp_lib
 
 
+def _get_action_mask_layout(
+    action_mask: Union[np.ndarray, mdp_lib.ActionMaskLayout]
+) -> mdp_lib.ActionMaskLayout:
+  if isinstance(action_mask, mdp_lib.ActionMaskLayout):
+    return action_mask
+  return mdp_lib.ActionMaskLayout(action_mask)
+
+
 def value_iteration(
-    transition_model: Union[np.ndarray, sparse.COO],
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix,
+                            mdp_lib.DeterministicTransition],
     reward_model: np.ndarray,
     discount_factor: float = 0.95,
     max_iteration: int = 20,
     epsilon: float = 1e-6,
     v_value_initial: Optional[np.ndarray] = None,
+    action_mask: Optional[Union[np.ndarray, mdp_lib.ActionMaskLayout]] = None,
+    compact_q_value: bool = False,
 ) -> np.ndarray:
   """Implements the value iteration algorithm.
 
   Args:
-    transition_model: A transition model as a numpy 3-d array.
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array, a (S*A) x S csr matrix (see MDP.np_transition_csr) or a
+      DeterministicTransition (see MDP.backup_transition_model).
     reward_model: A reward model as a numpy 2-d array.
     discount_factor: MDP discount factor to be used for policy evaluation.
     max_iteration: Maximum number of iterations for policy evaluation.
     epsilon: Desired v-value threshold. Used for termination condition.
     v_value_initial: Optional. Initial guess for V value.
+    action_mask: Optional. A boolean numpy 2-d array of shape (S, A), e.g.,
+      MDP.get_backup_action_mask(), or its ActionMaskLayout. If given, Q
+      values are stored and backed up only for the allowed pairs and those
+      of the others are -inf. The result is the same as without the mask if
+      their rewards are -inf. If the rewards of the allowed pairs are
+      finite, V values stay finite and are not scrubbed of infinities.
+    compact_q_value: If True, q_value is returned in the compact layout of
+      action_mask instead of a (S, A) array.
 
   Returns:
     A tuple of policy, v_value, and q_value.
   """
-  num_states, num_actions, _ = transition_model.shape
+  num_states, num_actions = mdp_lib.get_num_states_actions(
+      transition_model, reward_model)
 
   if v_value_initial is not None:
     assert v_value_initial.shape == (num_states, ), (
@@ -37,50 +63,80 @@ def value_iteration(
   else:
     v_value = np.zeros((num_states))
 
+  if action_mask is not None:
+    layout = _get_action_mask_layout(action_mask)
+    masked_tx = layout.get_transition_rows(transition_model)
+    np_masked_reward = layout.compact(reward_model)
+    np_masked_q = np.empty(layout.num_pairs)
+    is_finite = (np.isfinite(np_masked_reward).all()
+                 and np.isfinite(v_value).all())
+
   iteration_idx = 0
   delta_v = epsilon + 1.
+  q_value = np.empty((num_states, num_actions))
   progress_bar = tqdm(total=max_iteration)
   while (iteration_idx < max_iteration) and (delta_v > epsilon):
-    q_value = mdp_lib.q_value_from_v_value(v_value, transition_model,
-                                           reward_model, discount_factor)
-    new_v_value = q_value.max(axis=-1)
-    delta_v = np.linalg.norm(
-        np.nan_to_num(new_v_value[:]) - np.nan_to_num(v_value[:]))
+    if action_mask is not None:
+      np_v = v_value if is_finite else np.nan_to_num(v_value)
+      np.multiply(masked_tx @ np_v, discount_factor, out=np_masked_q)
+      np.add(np_masked_q, np_masked_reward, out=np_masked_q)
+      new_v_value = layout.segment_max(np_masked_q)
+    else:
+      q_value = mdp_lib.q_value_from_v_value(v_value, transition_model,
+                                             reward_model, discount_factor,
+                                             q_value)
+      new_v_value = q_value.max(axis=-1)
+    if action_mask is not None and is_finite:
+      delta_v = np.linalg.norm(new_v_value - v_value)
+    else:
+      delta_v = np.linalg.norm(
+          np.nan_to_num(new_v_value[:]) - np.nan_to_num(v_value[:]))
     iteration_idx += 1
     v_value = new_v_value
     progress_bar.set_postfix({'delta': delta_v})
     progress_bar.update()
   progress_bar.close()
 
+  if action_mask is not None:
+    policy = layout.segment_argmax(np_masked_q)
+    if compact_q_value:
+      return (policy, v_value, np_masked_q)
+    return (policy, v_value, layout.expand(np_masked_q))
+
   policy = mdp_lib.deterministic_policy_from_q_value(q_value)
 
   return (policy, v_value, q_value)
 
 
 def policy_iteration(
-    transition_model: Union[np.ndarray, sparse.COO],
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
     reward_model: np.ndarray,
     discount_factor: float = 0.95,
     max_iteration: int = 20,
     epsilon: float = 1e-6,
     policy_initial: Optional[np.ndarray] = None,
     v_value_initial: Optional[np.ndarray] = None,
+    action_mask: Optional[Union[np.ndarray, mdp_lib.ActionMaskLayout]] = None,
 ):
   """Implements the policy iteration algorithm.
 
   Args:
-    transition_model: A transition model as a numpy 3-d array.
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr).
     reward_model: A reward model as a numpy 2-d array.
     discount_factor: MDP discount factor to be used for policy evaluation.
     max_iteration: Maximum number of iterations for policy evaluation.
     epsilon: Desired v-value threshold. Used for termination condition.
     policy_initial: Optional. A deterministic policy.
     v_value_initial: Optional. Initial guess for V value.
+    action_mask: Optional. Allowed (state, action) pairs used to evaluate
+      policies. See mdp_lib.v_value_from_policy.
 
   Returns:
     A tuple of policy, v_value, and q_value.
   """
-  num_states, num_actions, _ = transition_model.shape
+  num_states, num_actions = mdp_lib.get_num_states_actions(
+      transition_model, reward_model)
 
   if policy_initial is not None:
     policy = policy_initial
@@ -100,6 +156,7 @@ def policy_iteration(
         discount_factor=discount_factor,
         epsilon=epsilon,
         v_value_initial=v_value,
+        action_mask=action_mask,
     )
     q_value = mdp_lib.q_value_from_v_value(
         v_value=v_value,
@@ -116,3 +173,585 @@ def policy_iteration(
   progress_bar.close()
 
   return (policy, v_value, q_value)
+
+
+def value_iteration_batched(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix,
+                            mdp_lib.DeterministicTransition],
+    reward_model: np.ndarray,
+    discount_factor: float = 0.95,
+    max_iteration: int = 20,
+    epsilon: float = 1e-6,
+    v_value_initial: Optional[np.ndarray] = None,
+    action_mask: Optional[Union[np.ndarray, mdp_lib.ActionMaskLayout]] = None,
+    compact_q_value: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Implements the value iteration algorithm for multiple reward models.
+
+  All reward models share the transition model, so V values of all of them
+  are updated with a single product of the transition model and a V matrix.
+  Each reward model stops being updated once it converges, which makes the
+  results identical to those of running value_iteration separately.
+
+  Args:
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array, a (S*A) x S csr matrix (see MDP.np_transition_csr) or a
+      DeterministicTransition (see MDP.backup_transition_model).
+    reward_model: Reward models as a numpy 3-d array. The first dimension
+      should correspond to the latent state (or reward index).
+    discount_factor: MDP discount factor to be used for policy evaluation.
+    max_iteration: Maximum number of iterations for policy evaluation.
+    epsilon: Desired v-value threshold. Used for termination condition.
+    v_value_initial: Optional. Initial guess for V values as a numpy 2-d array
+      of shape (num_states, num_rewards).
+    action_mask: Optional. Allowed (state, action) pairs shared by all reward
+      models. See value_iteration.
+    compact_q_value: If True, q_value is returned in the compact layout of
+      action_mask, i.e., as a (num_rewards, P) array.
+
+  Returns:
+    A tuple of policy, v_value, and q_value. Each has the reward index as its
+    first dimension except v_value, which has the shape of
+    (num_states, num_rewards).
+  """
+  num_rewards = reward_model.shape[0]
+  num_states, num_actions = mdp_lib.get_num_states_actions(
+      transition_model, reward_model[0])
+
+  if v_value_initial is not None:
+    assert v_value_initial.shape == (num_states, num_rewards), (
+        "Initial V value has incorrect shape.")
+    v_value = np.array(v_value_initial, dtype=float)
+  else:
+    v_value = np.zeros((num_states, num_rewards))
+
+  # backups are computed over the pairs (columns) of the flattened Q values
+  if action_mask is not None:
+    layout = _get_action_mask_layout(action_mask)
+    transition_model = layout.get_transition_rows(transition_model)
+    num_pairs = layout.num_pairs
+    np_reward_active = layout.compact(reward_model)
+    is_finite = (np.isfinite(np_reward_active).all()
+                 and np.isfinite(v_value).all())
+  else:
+    num_pairs = num_states * num_actions
+    np_reward_active = reward_model.reshape(num_rewards, num_pairs)
+    is_finite = False
+  q_value = np.empty((num_rewards, num_pairs))
+
+  # working set of the rewards that have not converged yet.
+  # it shrinks only when some of them converge.
+  np_active_idx = np.arange(num_rewards)
+  np_q_active = np.empty((num_rewards, num_pairs))
+
+  iteration_idx = 0
+  progress_bar = tqdm(total=max_iteration)
+  while (iteration_idx < max_iteration) and len(np_active_idx) > 0:
+    num_active = len(np_active_idx)
+    np_v_active = v_value[:, np_active_idx]
+    if not is_finite:
+      np_v_active = np.nan_to_num(np_v_active)
+
+    # next V values of all active rewards with a single product
+    if isinstance(transition_model,
+                  (csr_matrix, mdp_lib.DeterministicTransition)):
+      np_next_v = transition_model @ np_v_active
+    elif isinstance(transition_model, sparse.COO):
+      np_next_v = sparse.tensordot(transition_model,
+                                   np_v_active,
+                                   axes=(2, 0),
+                                   return_type=np.ndarray)
+    else:
+      np_next_v = np.tensordot(transition_model, np_v_active, axes=(2, 0))
+    np_next_v = np_next_v.reshape(num_pairs, num_active)
+
+    np.multiply(np_next_v.T, discount_factor, out=np_q_active)
+    np.add(np_q_active, np_reward_active, out=np_q_active)
+
+    if action_mask is not None:
+      new_v_active = layout.segment_max(np_q_active).T
+    else:
+      new_v_active = np_q_active.reshape(num_active, num_states,
+                                         num_actions).max(axis=-1).T
+    if is_finite:
+      np_delta_v = np.linalg.norm(new_v_active - np_v_active, axis=0)
+    else:
+      np_delta_v = np.linalg.norm(np.nan_to_num(new_v_active) - np_v_active,
+                                  axis=0)
+    v_value[:, np_active_idx] = new_v_active
+
+    # freeze the rewards that have converged
+    np_converged = np_delta_v <= epsilon
+    if np_converged.any():
+      q_value[np_active_idx[np_converged]] = np_q_active[np_converged]
+      np_remain = ~np_converged
+      np_active_idx = np_active_idx[np_remain]
+      np_reward_active = np_reward_active[np_remain]
+      # keeps the rows of the others in case max_iteration is reached
+      np_q_active = np_q_active[np_remain]
+
+    iteration_idx += 1
+    progress_bar.set_postfix({
+        'delta': np_delta_v.max(),
+        'active': str(len(np_active_idx)) + '/' + str(num_rewards)
+    })
+    progress_bar.update()
+  progress_bar.close()
+
+  # rewards that have not converged within max_iteration
+  q_value[np_active_idx] = np_q_active
+
+  if action_mask is not None:
+    policy = layout.segment_argmax(q_value)
+    if compact_q_value:
+      return (policy, v_value, q_value)
+    return (policy, v_value, layout.expand(q_value))
+
+  q_value = q_value.reshape(num_rewards, num_states, num_actions)
+  policy = mdp_lib.deterministic_policy_from_q_value(q_value)
+
+  return (policy, v_value, q_value)
+
+
+# Transition and reward models shared with the worker processes of
+# value_iteration_parallel. They are set by _init_value_iteration_worker.
+_worker_shared_memory = []
+_worker_transition_model = None
+_worker_reward_model = None
+_worker_options = {}
+
+
+def _create_shared_array(
+    np_array: np.ndarray) -> Tuple[shared_memory.SharedMemory, tuple]:
+  """Copies an array to a new shared memory block.
+
+  Returns:
+    A tuple of the shared memory block and the specification of the array,
+    which can be passed to _attach_shared_array in other processes.
+  """
+  np_array = np.ascontiguousarray(np_array)
+  shm = shared_memory.SharedMemory(create=True, size=max(np_array.nbytes, 1))
+  np_shared = np.ndarray(np_array.shape, dtype=np_array.dtype, buffer=shm.buf)
+  np_shared[...] = np_array
+  return shm, (shm.name, np_array.shape, np_array.dtype.str)
+
+
+def _attach_shared_array(
+    spec: tuple) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+  """Attaches to an array created by _create_shared_array."""
+  name, shape, dtype = spec
+  shm = shared_memory.SharedMemory(name=name)
+  return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_value_iteration_worker(list_csr_specs: Sequence[tuple],
+                                 csr_shape: Tuple[int, int], reward_spec: tuple,
+                                 max_iteration: int, epsilon: float,
+                                 mask_spec: Optional[tuple] = None):
+  global _worker_transition_model, _worker_reward_model
+  list_arrays = []
+  for spec in list(list_csr_specs) + [reward_spec]:
+    shm, np_array = _attach_shared_array(spec)
+    _worker_shared_memory.append(shm)
+    list_arrays.append(np_array)
+
+  np_data, np_indices, np_indptr, np_reward = list_arrays
+  _worker_options["action_mask"] = None
+  if mask_spec is not None:
+    shm, _worker_options["action_mask"] = _attach_shared_array(mask_spec)
+    _worker_shared_memory.append(shm)
+  _worker_transition_model = csr_matrix((np_data, np_indices, np_indptr),
+                                        shape=csr_shape,
+                                        copy=False)
+  _worker_reward_model = np_reward
+  _worker_options["max_iteration"] = max_iteration
+  _worker_options["epsilon"] = epsilon
+
+
+def _value_iteration_worker(reward_idx: int, discount_factor: float):
+  _, _, q_value = value_iteration(
+      _worker_transition_model,
+      _worker_reward_model[reward_idx],
+      discount_factor=discount_factor,
+      max_iteration=_worker_options["max_iteration"],
+      epsilon=_worker_options["epsilon"],
+      action_mask=_worker_options["action_mask"])
+  return reward_idx, q_value
+
+
+def value_iteration_parallel(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
+    reward_model: np.ndarray,
+    discount_factor: Union[float, Sequence[float]] = 0.95,
+    max_iteration: int = 20,
+    epsilon: float = 1e-6,
+    num_workers: Optional[int] = None,
+    callback: Optional[Callable[[int, np.ndarray], None]] = None,
+    action_mask: Optional[np.ndarray] = None,
+) -> List[np.ndarray]:
+  """Runs value iteration for multiple reward models on a process pool.
+
+  The arrays of the transition model and the reward models are placed in
+  shared memory once, so that they are not pickled to every worker.
+
+  Args:
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr). Others
+      are converted into the csr matrix.
+    reward_model: Reward models as a numpy 3-d array. The first dimension
+      should correspond to the latent state (or reward index).
+    discount_factor: MDP discount factor to be used for policy evaluation.
+      Either a scalar or a sequence with one factor per reward model.
+    max_iteration: Maximum number of iterations for policy evaluation.
+    epsilon: Desired v-value threshold. Used for termination condition.
+    num_workers: Number of worker processes. If None, the number of
+      processors on the machine is used.
+    callback: Optional. Called as callback(reward_idx, q_value) in the calling
+      process as soon as each reward model is solved.
+    action_mask: Optional. A boolean numpy 2-d array of the allowed
+      (state, action) pairs shared by all reward models. See value_iteration.
+
+  Returns:
+    A list of q_value for each reward model.
+  """
+  transition_model = _as_transition_csr(transition_model)
+  num_rewards = reward_model.shape[0]
+  if np.ndim(discount_factor) == 0:
+    list_discount = [discount_factor] * num_rewards
+  else:
+    list_discount = list(discount_factor)
+    assert len(list_discount) == num_rewards, (
+        "Number of discount factors does not match the number of rewards.")
+
+  list_shm = []
+  list_q_value = [None] * num_rewards
+  try:
+    list_csr_specs = []
+    for np_array in (transition_model.data, transition_model.indices,
+                     transition_model.indptr):
+      shm, spec = _create_shared_array(np_array)
+      list_shm.append(shm)
+      list_csr_specs.append(spec)
+    shm, reward_spec = _create_shared_array(reward_model)
+    list_shm.append(shm)
+    mask_spec = None
+    if action_mask is not None:
+      shm, mask_spec = _create_shared_array(action_mask)
+      list_shm.append(shm)
+
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             initializer=_init_value_iteration_worker,
+                             initargs=(list_csr_specs, transition_model.shape,
+                                       reward_spec, max_iteration, epsilon,
+                                       mask_spec)) as executor:
+      list_futures = [
+          executor.submit(_value_iteration_worker, idx, list_discount[idx])
+          for idx in range(num_rewards)
+      ]
+      for future in as_completed(list_futures):
+        reward_idx, q_value = future.result()
+        list_q_value[reward_idx] = q_value
+        if callback is not None:
+          callback(reward_idx, q_value)
+  finally:
+    for shm in list_shm:
+      shm.close()
+      shm.unlink()
+
+  return list_q_value
+
+
+def _as_transition_csr(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix]
+) -> csr_matrix:
+  """Converts a transition model into a (S*A) x S csr matrix."""
+  if isinstance(transition_model, csr_matrix):
+    return transition_model
+  if isinstance(transition_model, mdp_lib.DeterministicTransition):
+    return transition_model.tocsr()
+
+  num_states, num_actions, _ = transition_model.shape
+  shape_2d = (num_states * num_actions, num_states)
+  if isinstance(transition_model, sparse.COO):
+    return transition_model.reshape(shape_2d).tocsr()
+  return csr_matrix(np.reshape(transition_model, shape_2d))
+
+
+def get_predecessor_index(transition_model: csr_matrix,
+                          num_actions: int) -> csr_matrix:
+  """Builds the predecessor index of a transition model.
+
+  Args:
+    transition_model: A (S*A) x S csr matrix (see MDP.np_transition_csr).
+    num_actions: Number of actions.
+
+  Returns:
+    A S x S csr matrix. Row s' has nonzero entries at the states s from which
+    s' can be reached, and each entry is max_a T(s, a, s').
+  """
+  num_states = transition_model.shape[1]
+  np_row = np.repeat(np.arange(transition_model.shape[0]),
+                     np.diff(transition_model.indptr))
+  np_next = transition_model.indices.astype(np.int64)
+  np_prev = np_row // num_actions
+  np_prob = transition_model.data
+
+  # take the maximum over actions of each (next state, state) pair
+  np_sort = np.lexsort((np_prev, np_next))
+  np_key = np_next[np_sort] * num_states + np_prev[np_sort]
+  np_first = np.concatenate([[True], np_key[1:] != np_key[:-1]])
+  np_seg_start = np.nonzero(np_first)[0]
+  np_max_prob = (np.maximum.reduceat(np_prob[np_sort], np_seg_start)
+                 if len(np_seg_start) > 0 else np.zeros(0))
+  return csr_matrix(
+      (np_max_prob, (np_next[np_sort][np_first], np_prev[np_sort][np_first])),
+      shape=(num_states, num_states))
+
+
+def get_backward_state_order(transition_model: csr_matrix, num_actions: int,
+                             np_predecessor: csr_matrix) -> np.ndarray:
+  """Orders states by a breadth-first search backward from terminal states.
+
+  Terminal states are the states that stay at themselves under every action.
+  States that cannot reach any terminal state are placed at the end.
+
+  Args:
+    transition_model: A (S*A) x S csr matrix (see MDP.np_transition_csr).
+    num_actions: Number of actions.
+    np_predecessor: Predecessor index built by get_predecessor_index.
+
+  Returns:
+    A numpy 1-d array of state indices.
+  """
+  num_states = transition_model.shape[1]
+  np_row = np.repeat(np.arange(transition_model.shape[0]),
+                     np.diff(transition_model.indptr))
+  np_state = np_row // num_actions
+  np_self_loop = ((transition_model.indices == np_state) &
+                  (transition_model.data >= 1. - 1e-6))
+  np_num_self_loops = np.bincount(np_state[np_self_loop],
+                                  minlength=num_states)
+
+  np_visited = np.zeros(num_states, dtype=bool)
+  np_frontier = np.nonzero(np_num_self_loops == num_actions)[0]
+  np_visited[np_frontier] = True
+  list_order = []
+  while len(np_frontier) > 0:
+    list_order.append(np_frontier)
+    np_next = np.unique(np_predecessor[np_frontier].indices)
+    np_frontier = np_next[~np_visited[np_next]]
+    np_visited[np_frontier] = True
+
+  list_order.append(np.nonzero(~np_visited)[0])
+  return np.concatenate(list_order)
+
+
+def value_iteration_gauss_seidel(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
+    reward_model: np.ndarray,
+    discount_factor: float = 0.95,
+    max_iteration: int = 20,
+    epsilon: float = 1e-6,
+    v_value_initial: Optional[np.ndarray] = None,
+    state_order: Optional[np.ndarray] = None,
+    block_size: int = 256,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Implements the value iteration algorithm with Gauss-Seidel sweeps.
+
+  States are updated block by block in place, so that each block already uses
+  the new V values of the preceding blocks in the same sweep. By default,
+  states are ordered backward from terminal states, along which the value
+  propagates in goal-directed domains.
+
+  Args:
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr).
+    reward_model: A reward model as a numpy 2-d array.
+    discount_factor: MDP discount factor to be used for policy evaluation.
+    max_iteration: Maximum number of sweeps.
+    epsilon: Desired v-value threshold. Used for termination condition.
+    v_value_initial: Optional. Initial guess for V value.
+    state_order: Optional. Order of states to update in each sweep.
+    block_size: Number of states updated at once.
+
+  Returns:
+    A tuple of policy, v_value, and q_value.
+  """
+  transition_model = _as_transition_csr(transition_model)
+  num_states, num_actions = reward_model.shape
+
+  if v_value_initial is not None:
+    assert v_value_initial.shape == (num_states, ), (
+        "Initial V value has incorrect shape.")
+    v_value = np.array(v_value_initial, dtype=float)
+  else:
+    v_value = np.zeros((num_states))
+  v_finite = np.nan_to_num(v_value)
+
+  if state_order is None:
+    np_predecessor = get_predecessor_index(transition_model, num_actions)
+    state_order = get_backward_state_order(transition_model, num_actions,
+                                           np_predecessor)
+
+  # split the transition model into the rows of each block once.
+  # the transition of a state to itself is solved in closed form:
+  #   Q(s,a) = (R(s,a) + gamma * sum_{s' != s} T(s,a,s') V(s'))
+  #            / (1 - gamma * T(s,a,s))
+  # so that states which stay put with high probability converge at once.
+  list_blocks = []
+  for idx_start in range(0, num_states, block_size):
+    np_states = state_order[idx_start:idx_start + block_size]
+    np_rows = (np_states[:, None] * num_actions +
+               np.arange(num_actions)[None, :]).ravel()
+    np_block_tx = transition_model[np_rows]
+    np_row_states = np.repeat(np_states, num_actions)
+    np_entry_states = np.repeat(np_row_states, np.diff(np_block_tx.indptr))
+    np_entry_rows = np.repeat(np.arange(len(np_rows)),
+                              np.diff(np_block_tx.indptr))
+    np_is_self = np_block_tx.indices == np_entry_states
+    np_self_prob = np.bincount(np_entry_rows[np_is_self],
+                               weights=np_block_tx.data[np_is_self],
+                               minlength=len(np_rows))
+    np_denom = 1. - discount_factor * np_self_prob
+    np_solvable = np.repeat(np_denom > 0, np.diff(np_block_tx.indptr))
+    np_block_tx.data[np_is_self & np_solvable] = 0.
+    np_block_tx.eliminate_zeros()
+    np_denom[np_denom <= 0] = 1.
+    list_blocks.append(
+        (np_states, np_block_tx, reward_model[np_states],
+         np_denom.reshape(len(np_states), num_actions)))
+
+  iteration_idx = 0
+  delta_v = epsilon + 1.
+  progress_bar = tqdm(total=max_iteration)
+  while (iteration_idx < max_iteration) and (delta_v > epsilon):
+    sum_sq_delta = 0.
+    for np_states, np_block_tx, np_block_reward, np_denom in list_blocks:
+      np_q_block = (np_block_reward + discount_factor *
+                    (np_block_tx @ v_finite).reshape(len(np_states),
+                                                     num_actions)) / np_denom
+      new_v_block = np_q_block.max(axis=-1)
+      new_v_finite = np.nan_to_num(new_v_block)
+      sum_sq_delta += np.sum(np.square(new_v_finite - v_finite[np_states]))
+      v_value[np_states] = new_v_block
+      v_finite[np_states] = new_v_finite
+
+    delta_v = np.sqrt(sum_sq_delta)
+    iteration_idx += 1
+    progress_bar.set_postfix({'delta': delta_v})
+    progress_bar.update()
+  progress_bar.close()
+
+  q_value = mdp_lib.q_value_from_v_value(v_value, transition_model,
+                                         reward_model, discount_factor)
+  policy = mdp_lib.deterministic_policy_from_q_value(q_value)
+
+  return (policy, v_value, q_value)
+
+
+def value_iteration_prioritized(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
+    reward_model: np.ndarray,
+    discount_factor: float = 0.95,
+    max_backups: Optional[int] = None,
+    epsilon: float = 1e-6,
+    v_value_initial: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Implements the value iteration algorithm with prioritized sweeping.
+
+  States are backed up one at a time in the order of their Bellman residuals.
+  After a state is backed up, the residual bounds of its predecessors are
+  raised by the change of its value, weighted by the transition probability.
+  The algorithm stops when every residual is at most epsilon / sqrt(S), which
+  bounds the norm of the residuals by epsilon as in value_iteration.
+
+  Args:
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr).
+    reward_model: A reward model as a numpy 2-d array.
+    discount_factor: MDP discount factor to be used for policy evaluation.
+    max_backups: Optional. Maximum number of single-state backups.
+    epsilon: Desired v-value threshold. Used for termination condition.
+    v_value_initial: Optional. Initial guess for V value.
+
+  Returns:
+    A tuple of policy, v_value, and q_value.
+  """
+  transition_model = _as_transition_csr(transition_model)
+  num_states, num_actions = reward_model.shape
+  np_indptr = transition_model.indptr
+  np_indices = transition_model.indices
+  np_data = transition_model.data
+  np_entry_row = np.repeat(np.arange(transition_model.shape[0]),
+                           np.diff(np_indptr))
+
+  # the transition of a state to itself is solved in closed form
+  # as in value_iteration_gauss_seidel.
+  np_is_self = np_indices == np_entry_row // num_actions
+  np_self_prob = np.bincount(np_entry_row[np_is_self],
+                             weights=np_data[np_is_self],
+                             minlength=transition_model.shape[0]).reshape(
+                                 num_states, num_actions)
+  np_denom = 1. - discount_factor * np_self_prob
+  np_self_prob[np_denom <= 0] = 0.
+  np_denom[np_denom <= 0] = 1.
+
+  if v_value_initial is not None:
+    assert v_value_initial.shape == (num_states, ), (
+        "Initial V value has incorrect shape.")
+    v_value = np.array(v_value_initial, dtype=float)
+  else:
+    v_value = np.zeros((num_states))
+  v_finite = np.nan_to_num(v_value)
+
+  np_predecessor = get_predecessor_index(transition_model, num_actions)
+  threshold = epsilon / np.sqrt(num_states)
+
+  # initial residuals of all states with a single synchronous backup
+  q_value = mdp_lib.q_value_from_v_value(v_value, transition_model,
+                                         reward_model, discount_factor)
+  np_priority = np.abs(np.nan_to_num(q_value.max(axis=-1)) - v_finite)
+  heap = [(-np_priority[state], state)
+          for state in np.nonzero(np_priority > threshold)[0]]
+  heapq.heapify(heap)
+
+  num_backups = 0
+  progress_bar = tqdm(total=max_backups)
+  while len(heap) > 0 and (max_backups is None or num_backups < max_backups):
+    neg_priority, state = heapq.heappop(heap)
+    if -neg_priority != np_priority[state]:
+      continue  # outdated entry
+
+    idx_start = np_indptr[state * num_actions]
+    idx_end = np_indptr[(state + 1) * num_actions]
+    np_next_v = np.bincount(np_entry_row[idx_start:idx_end] -
+                            state * num_actions,
+                            weights=np_data[idx_start:idx_end] *
+                            v_finite[np_indices[idx_start:idx_end]],
+                            minlength=num_actions)
+    np_next_v -= np_self_prob[state] * v_finite[state]
+    new_v = np.max((reward_model[state] + discount_factor * np_next_v) /
+                   np_denom[state])
+    delta_v = abs(np.nan_to_num(new_v) - v_finite[state])
+    v_value[state] = new_v
+    v_finite[state] = np.nan_to_num(new_v)
+    np_priority[state] = 0.
+    num_backups += 1
+    progress_bar.update()
+
+    # the residual of a predecessor can increase at most by
+    # discount_factor * max_a T(pred, a, state) * delta_v
+    idx_start = np_predecessor.indptr[state]
+    idx_end = np_predecessor.indptr[state + 1]
+    np_preds = np_predecessor.indices[idx_start:idx_end]
+    np_priority[np_preds] += (discount_factor * delta_v *
+                              np_predecessor.data[idx_start:idx_end])
+    for pred in np_preds[np_priority[np_preds] > threshold]:
+      heapq.heappush(heap, (-np_priority[pred], pred))
+  progress_bar.close()
+
+  q_value = mdp_lib.q_value_from_v_value(v_value, transition_model,
+                                         reward_model, discount_factor)
+  policy = mdp_lib.deterministic_policy_from_q_value(q_value)
+
+  return (policy, v_value, q_value)
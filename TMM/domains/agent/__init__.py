@@ -1,3 +1,4 @@
 from .agent import SimulatorAgent, InteractiveAgent, AIAgent_Abstract  # noqa: F401, E501
 from .partial_obs_agent import AIAgent_PartialObs  # noqa: F401
-from .cached_agent import BTILCachedPolicy, BTILCachedAgentModel  # noqa: F401
+from .cached_agent import (BTILCachedPolicy, BTILCachedAgentModel,  # noqa: F401
+                           SparseLatentTransition, compile_agent_model)
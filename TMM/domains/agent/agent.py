@@ -1,7 +1,9 @@
 import abc
+from typing import Optional, Sequence
 from TMM.models.policy import CachedPolicyInterface
 from TMM.models.agent_model import AgentModel
 from TMM.models.mdp import LatentMDP
+from .cached_agent import compile_agent_model
 
 
 class SimulatorAgent:
@@ -136,6 +138,15 @@ class AIAgent_Abstract(SimulatorAgent):
     xidx = self.conv_latent_to_idx(latent)
     self.agent_model.set_init_mental_state_idx(None, xidx)
 
+  def compile_agent_model(self, mask_sas: Optional[Sequence[bool]] = None):
+    '''
+    replaces the agent model with an equivalent table lookup model.
+    see cached_agent.compile_agent_model
+    '''
+    current_latent = self.agent_model.current_latent
+    self.agent_model = compile_agent_model(self.agent_model, mask_sas)
+    self.agent_model.current_latent = current_latent
+
   def set_action(self, action):
     self.manual_action = action
 
@@ -149,7 +160,7 @@ class AIAgent_Abstract(SimulatorAgent):
                                                     next_state_idx)
 
   def get_initial_latent_distribution(self, state_idx):
-    return self.agent_model.initial_mental_distribution(state_idx)
+    return self.agent_model.get_initial_mental_distribution(state_idx)
 
   def conv_idx_to_latent(self, latent_idx):
     return self.agent_model.policy_model.conv_idx_to_latent(latent_idx)
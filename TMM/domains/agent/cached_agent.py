@@ -75,6 +75,146 @@ class BTILCachedAgentModel(AgentModel):
     return self.cb_bx(obstate_idx)
 
 
+def _get_key_radix(input_dims: Sequence[int]) -> np.ndarray:
+  'multipliers that map a tuple of inputs to a single integer key'
+  return np.cumprod((1, ) + tuple(input_dims)[:0:-1])[::-1].astype(np.int64)
+
+
+class SparseLatentTransition:
+  '''
+  sparse version of the np_tx tensor of BTILCachedAgentModel.
+  indexing with (x, *inputs), where inputs are the elements of
+  (s, a_1, ..., a_n, s') selected by mask_sas, returns the distribution of the
+  next latent state. only the distinct (X, X) matrices of the inputs in the
+  support are stored. inputs outside the support are evaluated with cb_tx,
+  if given, and then cached.
+  '''
+
+  def __init__(self,
+               input_dims: Sequence[int],
+               np_input_keys: np.ndarray,
+               np_input_mat: np.ndarray,
+               np_tx_mats: np.ndarray,
+               cb_tx: Optional[Callable] = None) -> None:
+    '''
+    input_dims: number of values of each masked input
+    np_input_keys: (K, ) keys of the inputs in the support (see conv_key)
+    np_input_mat: (K, ) index of the matrix of each key in np_tx_mats
+    np_tx_mats: (U, X, X) distinct latent transition matrices
+    cb_tx: a function that maps masked inputs to a (X, X) matrix
+    '''
+    self.input_dims = tuple(input_dims)
+    self.np_radix = _get_key_radix(self.input_dims)
+    self.list_tx_mats = list(np_tx_mats)
+    self.dict_key_mat = dict(zip(np_input_keys.tolist(),
+                                 np_input_mat.tolist()))
+    self.cb_tx = cb_tx
+    num_latents = np_tx_mats.shape[1]
+    self.shape = (num_latents, ) + self.input_dims + (num_latents, )
+
+  def conv_key(self, tuple_inputs: Sequence[int]) -> int:
+    key = 0
+    for value, dim in zip(tuple_inputs, self.input_dims):
+      key = key * dim + value
+    return key
+
+  def conv_key_batch(self, np_inputs: np.ndarray) -> np.ndarray:
+    'np_inputs: (N, num_inputs) integer array'
+    return np.asarray(np_inputs, dtype=np.int64) @ self.np_radix
+
+  def get_matrix(self, tuple_inputs: Sequence[int]) -> np.ndarray:
+    key = self.conv_key(tuple_inputs)
+    mat_idx = self.dict_key_mat.get(key)
+    if mat_idx is None:
+      if self.cb_tx is None:
+        raise KeyError("Inputs out of the compiled support: " +
+                       str(tuple_inputs))
+      mat_idx = len(self.list_tx_mats)
+      self.list_tx_mats.append(
+          np.asarray(self.cb_tx(*tuple_inputs), dtype=np.float64))
+      self.dict_key_mat[key] = mat_idx
+    return self.list_tx_mats[mat_idx]
+
+  def __getitem__(self, tuple_idx):
+    return self.get_matrix(tuple(tuple_idx[1:]))[tuple_idx[0]]
+
+
+def compile_agent_model(agent_model: AgentModel,
+                        mask_sas: Optional[Sequence[bool]] = None
+                        ) -> BTILCachedAgentModel:
+  '''
+  evaluates the latent transition of a (rule-based) agent model once over the
+  support of its reference MDP, i.e., every x and every (s, a, s') with a
+  nonzero transition probability, and returns an equivalent
+  BTILCachedAgentModel that looks up a SparseLatentTransition.
+  the initial latent distributions of all states are tabulated as well.
+  mask_sas: tuple of bools that tells on which arguments among
+            (s, a_1, ..., a_n, s') the latent transition depends.
+            the latent transition should not depend on the other arguments.
+            if None, (s, s') is assumed.
+  '''
+  mdp = agent_model.get_reference_mdp()
+  num_latents = agent_model.policy_model.get_num_latent_states()
+  if mask_sas is None:
+    mask_sas = (True, ) + (False, ) * mdp.num_action_factors + (True, )
+  mask_sas = np.array(mask_sas, dtype=bool)
+  input_dims = np.array([mdp.num_states] + list(mdp.list_num_actions) +
+                        [mdp.num_states])[mask_sas]
+
+  # (s, a_1, ..., a_n, s') of every nonzero transition
+  np_csr = mdp.np_transition_csr.tocoo()
+  np_sas = np.concatenate([
+      (np_csr.row // mdp.num_actions)[:, None],
+      mdp.np_idx_to_action[np_csr.row % mdp.num_actions],
+      np_csr.col[:, None]
+  ],
+                          axis=1)
+  np_keys, np_first = np.unique(np_sas[:, mask_sas] @
+                                _get_key_radix(input_dims),
+                                return_index=True)
+  np_sas = np_sas[np_first]
+
+  def get_tx_mat(sidx, tuple_aidx, sidx_n):
+    return [
+        agent_model.transition_mental_state(xidx, sidx, tuple_aidx, sidx_n)
+        for xidx in range(num_latents)
+    ]
+
+  list_mats = []
+  dict_mat = {}
+  np_input_mat = np.zeros(len(np_keys), dtype=np.int64)
+  for idx, row in enumerate(np_sas.tolist()):
+    np_mat = np.asarray(get_tx_mat(row[0], tuple(row[1:-1]), row[-1]),
+                        dtype=np.float64)
+    # many inputs share the same matrix, e.g., the identity
+    mat_key = np_mat.tobytes()
+    mat_idx = dict_mat.get(mat_key)
+    if mat_idx is None:
+      mat_idx = len(list_mats)
+      list_mats.append(np_mat)
+      dict_mat[mat_key] = mat_idx
+    np_input_mat[idx] = mat_idx
+
+  def cb_tx(*masked_inputs):
+    # any value of the unmasked arguments gives the same matrix
+    list_sas = [0] * len(mask_sas)
+    for pos, value in zip(np.flatnonzero(mask_sas), masked_inputs):
+      list_sas[pos] = value
+    return get_tx_mat(list_sas[0], tuple(list_sas[1:-1]), list_sas[-1])
+
+  np_tx = SparseLatentTransition(
+      input_dims, np_keys, np_input_mat,
+      np.array(list_mats).reshape(-1, num_latents, num_latents), cb_tx)
+
+  np_bx = agent_model.precompute_initial_mental_distribution()
+
+  def cb_bx(obstate_idx):
+    return np_bx[obstate_idx]
+
+  return BTILCachedAgentModel(cb_bx, np_tx, tuple(mask_sas.tolist()),
+                              agent_model.policy_model)
+
+
 class NoMindCachedPolicy(BTILCachedPolicy):
 
   def __init__(self,
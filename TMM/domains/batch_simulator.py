@@ -0,0 +1,483 @@
+from typing import Callable, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import random
+import numpy as np
+from tqdm import tqdm
+from TMM.models.mdp import LatentMDP, sample_from_rows
+from TMM.models.agent_model import AgentModel
+from TMM.domains.agent import AIAgent_Abstract, AIAgent_PartialObs
+
+
+class BatchTrajectories:
+  '''
+  preallocated buffers of N trajectories with at most T steps.
+    np_states: (N, T + 1) state indices of the task MDP
+    np_actions: (N, T, num_agents) indices of each agent's action factor
+                of the task MDP
+    np_latents: (N, T + 1, num_agents) latent state indices of each agent
+    np_lengths: (N, ) number of steps of each trajectory
+  entries after the end of each trajectory are -1.
+  '''
+
+  def __init__(self, num_envs: int, max_steps: int, num_agents: int) -> None:
+    self.np_states = np.full((num_envs, max_steps + 1), -1, dtype=np.int64)
+    self.np_actions = np.full((num_envs, max_steps, num_agents),
+                              -1,
+                              dtype=np.int64)
+    self.np_latents = np.full((num_envs, max_steps + 1, num_agents),
+                              -1,
+                              dtype=np.int64)
+    self.np_lengths = np.zeros(num_envs, dtype=np.int64)
+
+  @classmethod
+  def merge(cls, list_trajs: Sequence["BatchTrajectories"]):
+    'concatenates trajectories in the given order'
+    if len(list_trajs) == 0:
+      return cls(0, 0, 0)
+
+    trajs = cls(0, list_trajs[0].np_actions.shape[1],
+                list_trajs[0].np_actions.shape[2])
+    for name in ("np_states", "np_actions", "np_latents", "np_lengths"):
+      setattr(trajs, name,
+              np.concatenate([getattr(item, name) for item in list_trajs]))
+    return trajs
+
+  @classmethod
+  def from_episodes(cls, episodes: Sequence, task_mdp: LatentMDP):
+    '''
+    packs episodes of (state indices, joint action indices, latent indices)
+    as returned by TrajectoryStore.get_episode
+    '''
+    episodes = list(episodes)
+    max_steps = max([len(np_actions) for _, np_actions, _ in episodes] + [0])
+    trajs = cls(len(episodes), max_steps, task_mdp.num_action_factors)
+    for idx, (np_states, np_actions, np_latents) in enumerate(episodes):
+      length = len(np_actions)
+      trajs.np_states[idx, :length + 1] = np_states
+      trajs.np_actions[idx, :length] = task_mdp.np_idx_to_action[np_actions]
+      trajs.np_latents[idx, :length + 1] = np_latents
+      trajs.np_lengths[idx] = length
+    return trajs
+
+  def get_num_trajectories(self):
+    return len(self.np_lengths)
+
+  def get_trajectory(self, env_idx: int):
+    '''
+    returns a list of (state, joint action, latents) of a trajectory.
+    the joint action of the last state is None.
+    '''
+    length = self.np_lengths[env_idx]
+    list_sax = []
+    for t in range(length + 1):
+      tup_actions = (tuple(self.np_actions[env_idx, t].tolist())
+                     if t < length else None)
+      list_sax.append((int(self.np_states[env_idx, t]), tup_actions,
+                       tuple(self.np_latents[env_idx, t].tolist())))
+    return list_sax
+
+
+class BatchAgentModel:
+  '''
+  index-level view of an agent model over the indices of a task MDP.
+  rows of the policy, the latent transition and the initial latent
+  distribution are computed only once per distinct input and then gathered
+  in a vectorized manner.
+  '''
+
+  def __init__(self,
+               agent_model: AgentModel,
+               agent_idx: int,
+               task_mdp: LatentMDP,
+               fixed_latent: Optional[int] = None) -> None:
+    '''
+    agent_idx: index of the action factor of the agent in task_mdp
+    fixed_latent: if not None, the latent state never changes from this value
+    '''
+    self.agent_model = agent_model
+    self.policy_model = self.agent_model.policy_model
+    self.fixed_latent = fixed_latent
+    mdp = self.agent_model.get_reference_mdp()  # type: LatentMDP
+
+    # state indices of the agent's own MDP
+    if mdp is task_mdp:
+      self.np_task_to_agent_sidx = None
+    else:
+      np_task_sidx = np.arange(task_mdp.num_states)
+      try:
+        self.np_task_to_agent_sidx = mdp.conv_sim_states_to_mdp_sidx_batch(
+            task_mdp.conv_mdp_sidx_to_sim_states_batch(np_task_sidx))
+      except NotImplementedError:
+        self.np_task_to_agent_sidx = np.array([
+            mdp.conv_sim_states_to_mdp_sidx(
+                task_mdp.conv_mdp_sidx_to_sim_states(sidx))
+            for sidx in np_task_sidx
+        ])
+
+    # action indices of the agent's own MDP for each action factor of the
+    # task MDP. -1 for actions the agent's MDP does not define.
+    if mdp is task_mdp:
+      self.list_task_to_agent_aidx = None
+    else:
+      self.list_task_to_agent_aidx = []
+      for fidx in range(task_mdp.num_action_factors):
+        task_space = task_mdp.dict_factored_actionspace[fidx]
+        agent_space = mdp.dict_factored_actionspace.get(fidx)
+        np_aidx = np.full(task_space.num_actions, -1, dtype=np.int64)
+        if agent_space is not None:
+          for aidx in range(task_space.num_actions):
+            np_aidx[aidx] = agent_space.action_to_idx.get(
+                task_space.idx_to_action[aidx], -1)
+        self.list_task_to_agent_aidx.append(np_aidx)
+
+    num_actions = self.policy_model.get_num_actions()
+    if not np.isscalar(num_actions):
+      raise ValueError("The policy of each agent should have one action factor")
+    task_act_space = task_mdp.dict_factored_actionspace[agent_idx]
+    self.np_action_to_task_aidx = np.array([
+        task_act_space.action_to_idx[self.policy_model.conv_idx_to_action(
+            (aidx, ))[0]] for aidx in range(num_actions)
+    ])
+    # -1 for task actions the policy never takes
+    self.np_task_aidx_to_action = np.full(task_act_space.num_actions, -1)
+    self.np_task_aidx_to_action[self.np_action_to_task_aidx] = np.arange(
+        num_actions)
+
+    self.num_latents = self.policy_model.get_num_latent_states()
+    self.np_policy = np.zeros((self.num_latents, mdp.num_states, num_actions))
+    self.np_policy_ready = np.zeros((self.num_latents, mdp.num_states),
+                                    dtype=bool)
+    self.dict_tx_row = {}
+    self.list_tx = []
+    self.dict_bx_row = {}
+    self.list_bx = []
+    self.dict_tx_mat = {}
+    self.list_tx_mat = []
+
+  @classmethod
+  def from_agent(cls, agent: AIAgent_Abstract, agent_idx: int,
+                 task_mdp: LatentMDP):
+    '''
+    index-level view of an AI agent for BatchRolloutRunner.
+    the latent state of an agent without mind is fixed to its current latent.
+    '''
+    if (not isinstance(agent, AIAgent_Abstract)
+        or isinstance(agent, AIAgent_PartialObs)):
+      raise ValueError("Only fully observing AI agents can be run in batch")
+
+    fixed_latent = None
+    if not agent.has_mind():
+      if not agent.agent_model.is_current_latent_valid():
+        raise ValueError("The latent state of an agent without mind "
+                         "should be set in advance")
+      fixed_latent = agent.agent_model.current_latent
+    return cls(agent.agent_model, agent_idx, task_mdp, fixed_latent)
+
+  def conv_task_sidx(self, np_sidx: np.ndarray) -> np.ndarray:
+    if self.np_task_to_agent_sidx is None:
+      return np_sidx
+    return self.np_task_to_agent_sidx[np_sidx]
+
+  def conv_task_aidx(self, np_task_aidx: np.ndarray) -> np.ndarray:
+    '''
+    np_task_aidx: (N, num_agents) action indices of the task MDP factors
+    returns the action indices of the agent's own MDP factors
+    '''
+    if self.list_task_to_agent_aidx is None:
+      return np_task_aidx
+    np_aidx = np.stack([
+        np_table[np_task_aidx[:, fidx]]
+        for fidx, np_table in enumerate(self.list_task_to_agent_aidx)
+    ],
+                       axis=1)
+    if np.any(np_aidx < 0):
+      raise ValueError("The agent's MDP does not define some of the actions")
+    return np_aidx
+
+  def _lookup_rows(self, np_keys: np.ndarray, dict_row, list_rows, cb_row):
+    '''
+    np_keys: (N, K) integer array.
+    returns the indices in list_rows of the distinct keys and the inverse
+    indices that map each key to its distinct key.
+    '''
+    np_uniq, np_inv = np.unique(np_keys, axis=0, return_inverse=True)
+    list_idx = []
+    for key in map(tuple, np_uniq.tolist()):
+      row_idx = dict_row.get(key)
+      if row_idx is None:
+        row_idx = len(list_rows)
+        list_rows.append(np.asarray(cb_row(*key), dtype=np.float64))
+        dict_row[key] = row_idx
+      list_idx.append(row_idx)
+
+    return list_idx, np_inv.reshape(-1)
+
+  def _gather_rows(self, np_keys: np.ndarray, dict_row, list_rows, cb_row):
+    'np_keys: (N, K) integer array. returns (N, dim) rows'
+    list_idx, np_inv = self._lookup_rows(np_keys, dict_row, list_rows, cb_row)
+    np_rows = np.array([list_rows[row_idx] for row_idx in list_idx])
+    return np_rows[np_inv]
+
+  def _prepare_policy(self, np_latent: np.ndarray, np_sidx: np.ndarray):
+    np_missing = ~self.np_policy_ready[np_latent, np_sidx]
+    if np.any(np_missing):
+      np_xs = np.unique(np.stack(
+          [np_latent[np_missing], np_sidx[np_missing]], axis=1),
+                        axis=0)
+      for xidx, sidx in np_xs.tolist():
+        self.np_policy[xidx, sidx] = self.policy_model.policy(sidx, xidx)
+        self.np_policy_ready[xidx, sidx] = True
+
+  def get_initial_distributions(self, np_sidx: np.ndarray) -> np.ndarray:
+    'np_sidx: (N, ) state indices of the agent MDP. returns (N, X) rows'
+    if self.agent_model.np_init_dist_table is not None:
+      return self.agent_model.np_init_dist_table[np_sidx]
+
+    return self._gather_rows(
+        np_sidx[:, None], self.dict_bx_row, self.list_bx,
+        lambda sidx: self.agent_model.get_initial_mental_distribution(sidx))
+
+  def get_action_likelihoods(self, np_sidx: np.ndarray,
+                             np_task_aidx: np.ndarray) -> np.ndarray:
+    '''
+    np_sidx: (N, ) state indices of the agent MDP
+    np_task_aidx: (N, ) indices of the agent's action factor of the task MDP
+    returns (N, X) probabilities of the actions under each latent state
+    '''
+    np_sidx_all = np.repeat(np_sidx[None, :], self.num_latents, axis=0)
+    np_latent_all = np.repeat(np.arange(self.num_latents)[:, None],
+                              len(np_sidx),
+                              axis=1)
+    self._prepare_policy(np_latent_all.reshape(-1), np_sidx_all.reshape(-1))
+
+    np_aidx = self.np_task_aidx_to_action[np_task_aidx]
+    np_prob = self.np_policy[:, np_sidx, np.maximum(np_aidx, 0)].T
+    np_prob[np_aidx < 0] = 0.
+    return np_prob
+
+  def get_transition_matrix_indices(self, np_sidx: np.ndarray,
+                                    np_task_aidx: np.ndarray,
+                                    np_sidx_n: np.ndarray) -> np.ndarray:
+    '''
+    np_sidx, np_sidx_n: (N, ) state indices of the agent MDP
+    np_task_aidx: (N, num_agents) action indices of the task MDP factors
+    returns (N, ) indices of the (X, X) latent transition matrices in
+    self.list_tx_mat
+    '''
+    num_agents = np_task_aidx.shape[1]
+
+    def get_tx_mat(sidx, *args):
+      tuple_aidx, sidx_n = tuple(args[:num_agents]), args[num_agents]
+      return [
+          self.agent_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                                   sidx_n)
+          for xidx in range(self.num_latents)
+      ]
+
+    np_keys = np.concatenate(
+        [np_sidx[:, None],
+         self.conv_task_aidx(np_task_aidx), np_sidx_n[:, None]],
+        axis=1)
+    list_idx, np_inv = self._lookup_rows(np_keys, self.dict_tx_mat,
+                                         self.list_tx_mat, get_tx_mat)
+    return np.array(list_idx, dtype=np.int64)[np_inv]
+
+  def sample_initial_latents(self, np_sidx: np.ndarray, rng) -> np.ndarray:
+    if self.fixed_latent is not None:
+      return np.full(len(np_sidx), self.fixed_latent, dtype=np.int64)
+
+    return sample_from_rows(self.get_initial_distributions(np_sidx), rng)
+
+  def sample_actions(self, np_latent: np.ndarray, np_sidx: np.ndarray,
+                     rng) -> np.ndarray:
+    'returns action indices of the agent factor of the task MDP'
+    self._prepare_policy(np_latent, np_sidx)
+    np_aidx = sample_from_rows(self.np_policy[np_latent, np_sidx], rng)
+    return self.np_action_to_task_aidx[np_aidx]
+
+  def sample_next_latents(self, np_latent: np.ndarray, np_sidx: np.ndarray,
+                          np_task_aidx: np.ndarray, np_sidx_n: np.ndarray,
+                          rng) -> np.ndarray:
+    'np_task_aidx: (N, num_agents) action indices of the task MDP factors'
+    if self.fixed_latent is not None:
+      return np_latent
+
+    num_agents = np_task_aidx.shape[1]
+
+    def get_tx_row(xidx, sidx, *args):
+      tuple_aidx, sidx_n = tuple(args[:num_agents]), args[num_agents]
+      return self.agent_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                                      sidx_n)
+
+    np_keys = np.concatenate([
+        np_latent[:, None], np_sidx[:, None],
+        self.conv_task_aidx(np_task_aidx), np_sidx_n[:, None]
+    ],
+                             axis=1)
+    np_tx = self._gather_rows(np_keys, self.dict_tx_row, self.list_tx,
+                              get_tx_row)
+    return sample_from_rows(np_tx, rng)
+
+
+class BatchRolloutRunner:
+  '''
+  runs many games in lockstep over the state and action indices of the task
+  MDP. next states are sampled from the transition table precompiled from the
+  task MDP (see MDP.transition_sampler), and actions and latent states of all
+  games are sampled together from the cached rows of the agents' models.
+
+  agents are ordered as in the simulator, i.e., the i-th agent takes the i-th
+  action factor of the task MDP. only the decisions defined by the agent
+  models (AgentModel) are reproduced. thus, agents that override how they
+  observe states or update latents in the simulator are not supported.
+  '''
+
+  def __init__(self,
+               task_mdp: LatentMDP,
+               agents: Sequence[AIAgent_Abstract],
+               max_steps: int = 150) -> None:
+    self.task_mdp = task_mdp
+    self.max_steps = max_steps
+    self.list_agent_models = [
+        BatchAgentModel.from_agent(agent, idx, task_mdp)
+        for idx, agent in enumerate(agents)
+    ]
+    self.np_terminal = task_mdp.np_terminal_mask
+
+  def run(self,
+          np_init_sidx: np.ndarray,
+          rng: Optional[np.random.Generator] = None,
+          verbose: bool = True) -> BatchTrajectories:
+    '''
+    np_init_sidx: initial state indices of the task MDP, one per game
+    rng: random generator. if None, the global numpy random state is used.
+    '''
+    np_sidx = np.array(np_init_sidx, dtype=np.int64).reshape(-1)
+    num_envs = len(np_sidx)
+    num_agents = len(self.list_agent_models)
+    sampler = self.task_mdp.transition_sampler
+
+    trajs = BatchTrajectories(num_envs, self.max_steps, num_agents)
+    trajs.np_states[:, 0] = np_sidx
+    np_latents = np.zeros((num_envs, num_agents), dtype=np.int64)
+    for idx, agent_model in enumerate(self.list_agent_models):
+      np_latents[:, idx] = agent_model.sample_initial_latents(
+          agent_model.conv_task_sidx(np_sidx), rng)
+    trajs.np_latents[:, 0] = np_latents
+
+    np_env = np.arange(num_envs)
+    for t in tqdm(range(self.max_steps), disable=not verbose):
+      np_env = np_env[~self.np_terminal[np_sidx]]
+      if len(np_env) == 0:
+        break
+
+      np_sidx = np_sidx[~self.np_terminal[np_sidx]]
+      np_latents = trajs.np_latents[np_env, t]
+      list_agent_sidx = [
+          agent_model.conv_task_sidx(np_sidx)
+          for agent_model in self.list_agent_models
+      ]
+
+      np_actions = np.zeros((len(np_env), num_agents), dtype=np.int64)
+      for idx, agent_model in enumerate(self.list_agent_models):
+        np_actions[:, idx] = agent_model.sample_actions(
+            np_latents[:, idx], list_agent_sidx[idx], rng)
+      np_joint_aidx = self.task_mdp.np_action_to_idx[tuple(np_actions.T)]
+      np_sidx_n = sampler.sample_batch(np_sidx, np_joint_aidx, rng)
+
+      np_latents_n = np.zeros_like(np_latents)
+      for idx, agent_model in enumerate(self.list_agent_models):
+        np_latents_n[:, idx] = agent_model.sample_next_latents(
+            np_latents[:, idx], list_agent_sidx[idx], np_actions,
+            agent_model.conv_task_sidx(np_sidx_n), rng)
+
+      trajs.np_actions[np_env, t] = np_actions
+      trajs.np_states[np_env, t + 1] = np_sidx_n
+      trajs.np_latents[np_env, t + 1] = np_latents_n
+      trajs.np_lengths[np_env] += 1
+      np_sidx = np_sidx_n
+
+    return trajs
+
+
+# simulator and rollout runner of the worker processes of
+# run_simulation_parallel. they are created once per worker by
+# _init_simulation_worker so that policies and models are loaded only once.
+_worker_simulator = None
+_worker_runner = None
+
+
+def _run_simulation_shard(simulator, runner: BatchRolloutRunner, num_iter: int,
+                          seed_seq: np.random.SeedSequence):
+  seed_reset, seed_rollout = seed_seq.spawn(2)
+  # reset_game may draw initial states from the global random states
+  np_seed = seed_reset.generate_state(2)
+  random.seed(int(np_seed[0]))
+  np.random.seed(int(np_seed[1]))
+  init_states = simulator.get_initial_states(num_iter)
+
+  np_init_sidx = np.array([
+      runner.task_mdp.conv_sim_states_to_mdp_sidx(tup_states)
+      for tup_states in init_states
+  ])
+  return runner.run(np_init_sidx, np.random.default_rng(seed_rollout), False)
+
+
+def _init_simulation_worker(cb_create_simulator: Callable):
+  global _worker_simulator, _worker_runner
+  _worker_simulator, task_mdp = cb_create_simulator()
+  _worker_runner = BatchRolloutRunner(task_mdp, _worker_simulator.agents,
+                                      _worker_simulator.max_steps)
+
+
+def _simulation_worker(shard_idx: int, num_iter: int,
+                       seed_seq: np.random.SeedSequence):
+  return shard_idx, _run_simulation_shard(_worker_simulator, _worker_runner,
+                                          num_iter, seed_seq)
+
+
+def run_simulation_parallel(cb_create_simulator: Callable[[], Tuple],
+                            num_iter: int,
+                            seed: int,
+                            num_workers: Optional[int] = None,
+                            shard_size: int = 1000) -> BatchTrajectories:
+  '''
+  generates num_iter games with BatchRolloutRunner on a process pool.
+    cb_create_simulator: a picklable function (e.g., a module-level function
+                         or functools.partial) that returns a tuple of a
+                         simulator whose agents are set and its task MDP.
+                         called once per worker.
+    seed: master seed. games are split into shards of shard_size games and
+          each shard draws from its own stream spawned from the seed.
+          thus, the result only depends on seed, num_iter and shard_size,
+          not on num_workers or the order in which shards finish.
+    num_workers: number of processes. if 1, shards run in this process.
+  '''
+  list_shard_size = [shard_size] * (num_iter // shard_size)
+  if num_iter % shard_size > 0:
+    list_shard_size.append(num_iter % shard_size)
+  list_seed_seq = np.random.SeedSequence(seed).spawn(len(list_shard_size))
+
+  list_trajs = [None] * len(list_shard_size)
+  if num_workers == 1:
+    simulator, task_mdp = cb_create_simulator()
+    runner = BatchRolloutRunner(task_mdp, simulator.agents, simulator.max_steps)
+    for idx in tqdm(range(len(list_shard_size))):
+      list_trajs[idx] = _run_simulation_shard(simulator, runner,
+                                              list_shard_size[idx],
+                                              list_seed_seq[idx])
+    return BatchTrajectories.merge(list_trajs)
+
+  with ProcessPoolExecutor(max_workers=num_workers,
+                           initializer=_init_simulation_worker,
+                           initargs=(cb_create_simulator, )) as executor:
+    list_futures = [
+        executor.submit(_simulation_worker, idx, list_shard_size[idx],
+                        list_seed_seq[idx])
+        for idx in range(len(list_shard_size))
+    ]
+    for future in tqdm(as_completed(list_futures), total=len(list_futures)):
+      shard_idx, trajs = future.result()
+      list_trajs[shard_idx] = trajs
+
+  return BatchTrajectories.merge(list_trajs)
@@ -1,6 +1,6 @@
 from typing import Tuple
 from enum import Enum
-from TMM.models.mdp import ActionSpace
+from TMM.models.mdp import DenseActionSpace
 
 
 class EventType(Enum):
@@ -26,7 +26,7 @@ class BoxState(Enum):
   WithTeammate = WithAgent2
 
 
-AGENT_ACTIONSPACE = ActionSpace([EventType(idx) for idx in range(6)])
+AGENT_ACTIONSPACE = DenseActionSpace([EventType(idx) for idx in range(6)])
 
 
 def get_possible_latent_states(num_boxes, num_drops, num_goals):
@@ -3,6 +3,7 @@ from TMM.domains.box_push import (BoxState, EventType, conv_box_state_2_idx,
                                   conv_box_idx_2_state, AGENT_ACTIONSPACE)
 from TMM.domains.box_push.transition import transition_always_alone
 from TMM.domains.box_push.mdp import BoxPushMDP
+from TMM.domains.box_push.mdp.team_mdp import BoxPushTeamMDP_AlwaysAlone
 
 
 class BoxPushAgentMDP(BoxPushMDP):
@@ -23,8 +24,9 @@ class BoxPushAgentMDP(BoxPushMDP):
     # assume a2 has the same possible actions as a1
     list_p_next_env = []
     for teammate_act in self.my_act_space.actionspace:
-      list_p_next_env = list_p_next_env + self._transition_impl(
-          box_states, my_pos, teammate_pos, my_act, teammate_act)
+      list_p_next_env.extend(
+          self._transition_impl(box_states, my_pos, teammate_pos, my_act,
+                                teammate_act))
 
     list_next_p_state = []
     map_next_state = {}
@@ -111,6 +113,16 @@ class BoxPushAgentMDP(BoxPushMDP):
 
 class BoxPushAgentMDP_AlwaysAlone(BoxPushAgentMDP):
 
+  def create_task_mdp(self):
+    'transitions are derived from the team MDP with a uniform teammate'
+    return BoxPushTeamMDP_AlwaysAlone(self.x_grid,
+                                      self.y_grid,
+                                      self.boxes,
+                                      self.goals,
+                                      self.walls,
+                                      self.drops,
+                                      cache_file_path=self.cache_file_path)
+
   def _transition_impl(self, box_states, a1_pos, a2_pos, a1_action, a2_action):
     return transition_always_alone(box_states, a1_pos, a2_pos, a1_action,
                                    a2_action, self.boxes, self.goals,
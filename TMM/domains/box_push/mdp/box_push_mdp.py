@@ -1,22 +1,32 @@
-from typing import Sequence, Tuple, Union
+from typing import Optional, Sequence, Tuple, Union
 import abc
 import numpy as np
-from TMM.models.mdp import StateSpace, LatentMDP
+from TMM.models.mdp import StateSpace, DenseStateSpace, LatentMDP
 from TMM.domains.box_push import (BoxState, conv_box_state_2_idx,
-                                  conv_box_idx_2_state,
                                   get_possible_latent_states)
 
 
 class BoxPushMDP(LatentMDP):
 
-  def __init__(self, x_grid, y_grid, boxes, goals, walls, drops, **kwargs):
+  def __init__(self,
+               x_grid,
+               y_grid,
+               boxes,
+               goals,
+               walls,
+               drops,
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None,
+               **kwargs):
     self.x_grid = x_grid
     self.y_grid = y_grid
     self.boxes = boxes
     self.goals = goals
     self.walls = walls
     self.drops = drops
-    super().__init__(use_sparse=True)
+    super().__init__(use_sparse=True,
+                     cache_file_path=cache_file_path,
+                     initial_sim_states=initial_sim_states)
 
   @abc.abstractmethod
   def _transition_impl(self, box_states, a1_pos, a2_pos, a1_action, a2_action):
@@ -60,15 +70,19 @@ class BoxPushMDP(LatentMDP):
         state = (i, j)
         if state not in self.walls:
           list_grid.append(state)
-    self.pos1_space = StateSpace(statespace=list_grid)
-    self.pos2_space = StateSpace(statespace=list_grid)
+    self.pos1_space = DenseStateSpace(statespace=list_grid)
+    self.pos2_space = DenseStateSpace(statespace=list_grid)
     self.dict_factored_statespace = {0: self.pos1_space, 1: self.pos2_space}
 
+    # box states are keyed by their indices defined by conv_box_state_2_idx
     box_states = self.get_possible_box_states()
+    self.box_space = DenseStateSpace(
+        statespace=box_states,
+        keys=[conv_box_state_2_idx(bstate, len(self.drops))
+              for bstate in box_states])
 
     for dummy_i in range(len(self.boxes)):
-      self.dict_factored_statespace[dummy_i +
-                                    2] = StateSpace(statespace=box_states)
+      self.dict_factored_statespace[dummy_i + 2] = self.box_space
 
     self.dummy_states = None
 
@@ -114,6 +128,24 @@ class BoxPushMDP(LatentMDP):
 
     return super().legal_actions(state_idx)
 
+  def _decode_box_states_batch(self, np_state_idx):
+    'returns agent position indices (N, 2) and box state codes (N, num_boxes)'
+    np_states = self.conv_idx_to_state_batch(np_state_idx)
+    np_box_states = self.box_space.decode_keys(np_states[:, 2:])[..., 0]
+    return np_states[:, :2], np_box_states
+
+  def is_terminal_batch(self, np_state_idx):
+    _, np_box_states = self._decode_box_states_batch(np_state_idx)
+    goal_code = conv_box_state_2_idx((BoxState.OnGoalLoc, 0), len(self.drops))
+    return np.all(np_box_states >= goal_code, axis=1)
+
+  def legal_action_mask_batch(self, np_state_idx):
+    np_pos, np_box_states = self._decode_box_states_batch(np_state_idx)
+    np_holding = np.any(np_box_states == BoxState.WithBoth.value, axis=1)
+    np_no_action = (self.is_terminal_batch(np_state_idx) |
+                    (np_holding & (np_pos[:, 0] != np_pos[:, 1])))
+    return np.repeat(~np_no_action[:, None], self.num_actions, axis=1)
+
   @abc.abstractmethod
   def get_possible_box_states(
       self) -> Sequence[Tuple[BoxState, Union[int, None]]]:
@@ -121,34 +153,43 @@ class BoxPushMDP(LatentMDP):
 
   def conv_sim_states_to_mdp_sidx(self, tup_states):
     box_states, pos1, pos2 = tup_states
-    len_s_space = len(self.dict_factored_statespace)
     pos1_idx = self.pos1_space.state_to_idx[pos1]
     pos2_idx = self.pos2_space.state_to_idx[pos2]
     list_states = [int(pos1_idx), int(pos2_idx)]
-    for idx in range(2, len_s_space):
-      box_sidx_n = box_states[idx - 2]
-      box_state_n = conv_box_idx_2_state(box_sidx_n, len(self.drops),
-                                         len(self.goals))
-      box_sidx = self.dict_factored_statespace[idx].state_to_idx[box_state_n]
-      list_states.append(int(box_sidx))
+    list_states.extend(self.box_space.encode_key(bidx) for bidx in box_states)
 
     return self.conv_state_to_idx(tuple(list_states))
 
   def conv_mdp_sidx_to_sim_states(self, state_idx):
-    len_s_space = len(self.dict_factored_statespace)
     state_vec = self.conv_idx_to_state(state_idx)
 
     pos1 = self.pos1_space.idx_to_state[state_vec[0]]
     pos2 = self.pos2_space.idx_to_state[state_vec[1]]
-
-    box_states = []
-    for idx in range(2, len_s_space):
-      box_sidx = state_vec[idx]
-      box_state = self.dict_factored_statespace[idx].idx_to_state[box_sidx]
-      box_states.append(conv_box_state_2_idx(box_state, len(self.drops)))
+    box_states = self.box_space.np_keys[state_vec[2:], 0].tolist()
 
     return box_states, pos1, pos2
 
+  def conv_sim_states_to_mdp_sidx_batch(self, tup_states):
+    '''
+    tup_states: a tuple of box states (N x num_boxes),
+                agent1 positions (N x 2) and agent2 positions (N x 2)
+    '''
+    np_box_states, np_pos1, np_pos2 = map(np.asarray, tup_states)
+    np_pos1_idx = self.pos1_space.encode_keys(np_pos1)
+    np_pos2_idx = self.pos2_space.encode_keys(np_pos2)
+    np_box_idx = self.box_space.encode_keys(
+        np_box_states.reshape(len(np_pos1), len(self.boxes)))
+    np_states = np.concatenate(
+        [np_pos1_idx[:, None], np_pos2_idx[:, None], np_box_idx], axis=1)
+    return self.conv_state_to_idx_batch(np_states)
+
+  def conv_mdp_sidx_to_sim_states_batch(self, np_state_idx):
+    np_states = self.conv_idx_to_state_batch(np_state_idx)
+    np_pos1 = self.pos1_space.decode_keys(np_states[:, 0])
+    np_pos2 = self.pos2_space.decode_keys(np_states[:, 1])
+    np_box_states = self.box_space.decode_keys(np_states[:, 2:])[..., 0]
+    return np_box_states, np_pos1, np_pos2
+
   def conv_mdp_aidx_to_sim_actions(self, action_idx):
     vector_aidx = self.conv_idx_to_action(action_idx)
     list_actions = []
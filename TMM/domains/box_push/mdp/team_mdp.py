@@ -36,6 +36,49 @@ class BoxPushTeamMDP(BoxPushMDP):
 
     return np.array(list_next_p_state)
 
+  def transition_model_batch(self, np_state_idx: np.ndarray,
+                             np_action_idx: np.ndarray):
+    '''
+    same as transition_model but decodes each state and action only once
+    and converts all next states at once.
+    '''
+    np_terminal = self.is_terminal_batch(np_state_idx)
+    dict_sim_states = {}
+    dict_sim_actions = {}
+    list_pair_pos = []
+    list_next_p = []
+    list_box_states = []
+    list_pos1 = []
+    list_pos2 = []
+    for pos, (state, action) in enumerate(
+        zip(np_state_idx.tolist(), np_action_idx.tolist())):
+      if np_terminal[pos]:
+        continue
+      if state not in dict_sim_states:
+        dict_sim_states[state] = self.conv_mdp_sidx_to_sim_states(state)
+      if action not in dict_sim_actions:
+        dict_sim_actions[action] = self.conv_mdp_aidx_to_sim_actions(action)
+      box_states, a1_pos, a2_pos = dict_sim_states[state]
+      act1, act2 = dict_sim_actions[action]
+      for p, box_states_n, a1_pos_n, a2_pos_n in self._transition_impl(
+          box_states, a1_pos, a2_pos, act1, act2):
+        list_pair_pos.append(pos)
+        list_next_p.append(p)
+        list_box_states.append(box_states_n)
+        list_pos1.append(a1_pos_n)
+        list_pos2.append(a2_pos_n)
+
+    np_terminal_pos = np.flatnonzero(np_terminal)
+    np_next_sidx = np.zeros(0, dtype=np.int64)
+    if len(list_pair_pos) > 0:
+      np_next_sidx = self.conv_sim_states_to_mdp_sidx_batch(
+          (list_box_states, list_pos1, list_pos2)).astype(np.int64)
+    return (np.concatenate([np.array(list_pair_pos, dtype=np.int64),
+                            np_terminal_pos]),
+            np.concatenate([np_next_sidx, np_state_idx[np_terminal_pos]]),
+            np.concatenate([np.array(list_next_p, dtype=np.float64),
+                            np.ones(len(np_terminal_pos))]))
+
 
 class BoxPushTeamMDP_AlwaysTogether(BoxPushTeamMDP):
 
@@ -122,6 +165,49 @@ class BoxPushTeamMDP_AlwaysTogether(BoxPushTeamMDP):
 
     return panelty
 
+  def reward_batch(self, latent_idx: int, np_state_idx: np.ndarray,
+                   np_action_idx: np.ndarray) -> np.ndarray:
+    'vectorized version of reward'
+    np_box_states, np_pos1, np_pos2 = self.conv_mdp_sidx_to_sim_states_batch(
+        np.asarray(np_state_idx))
+    np_aidx = self.np_idx_to_action[np.asarray(np_action_idx)]
+    stay = AGENT_ACTIONSPACE.action_to_idx[EventType.STAY]
+    hold = AGENT_ACTIONSPACE.action_to_idx[EventType.HOLD]
+    np_both_stay = np.all(np_aidx == stay, axis=1)
+    np_both_hold = np.all(np_aidx == hold, axis=1)
+    np_same_pos = np.all(np_pos1 == np_pos2, axis=1)
+
+    # the last box held by both agents, as in reward
+    num_boxes = np_box_states.shape[1]
+    np_with_both = np_box_states == BoxState.WithBoth.value
+    np_holding = np_with_both.any(axis=1)
+    np_holding_box = num_boxes - 1 - np.argmax(np_with_both[:, ::-1], axis=1)
+
+    latent = self.latent_space.idx_to_state[latent_idx]
+    np_stay_only = np.where(np_both_stay, 0., -np.inf)
+    if latent[0] == "pickup":
+      box_pos = np.array(self.boxes[latent[1]])
+      np_at_box = np_same_pos & np.all(np_pos1 == box_pos, axis=1)
+      np_dist = (np.abs(np_pos1 - box_pos).sum(axis=1) +
+                 np.abs(np_pos2 - box_pos).sum(axis=1))
+      np_reward = np.where(np_at_box & np_both_hold, 100.,
+                           -1 + 1 / (np_dist + 1))
+      np_reward = np.where(np_holding, np_stay_only, np_reward)
+    else:
+      if latent[0] == "origin":
+        np_desired = np.array(self.boxes)[np_holding_box]
+      elif latent[0] == "drop":
+        np_desired = np.array(self.drops[latent[1]])
+      else:  # latent[0] == "goal"
+        np_desired = np.array(self.goals[latent[1]])
+      np_at_loc = np_same_pos & np.all(np_pos1 == np_desired, axis=1)
+      np_reward = np.where(np_at_loc & np_both_hold, 100., -1.)
+      np_reward = np.where(np_holding, np_reward, np_stay_only)
+
+    np_terminal = np.all(np_box_states >= 4 + len(self.drops), axis=1)
+    np_reward[np_terminal] = 0
+    return np_reward
+
 
 class BoxPushTeamMDP_AlwaysAlone(BoxPushTeamMDP):
 
@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import Sequence
+from typing import Optional, Sequence
 import os
 import numpy as np
 from TMM.models.policy import CachedPolicyInterface, PolicyInterface
@@ -50,11 +50,14 @@ class PolicyFromIdenticalAgentMDP(PolicyInterface):
     # all agents are assumed to have identical actions and latent states
     return self.agent_policy.policy(agent_obstate, latstate_idx)
 
-  def get_action(self, obstate_idx: int, latstate_idx: int) -> Sequence[int]:
+  def get_action(self,
+                 obstate_idx: int,
+                 latstate_idx: int,
+                 rng: Optional[np.random.Generator] = None) -> Sequence[int]:
     agent_obstate = self._convert_task_state_2_agent_state(obstate_idx)
 
     # all agents are assumed to have identical actions and latent states
-    return self.agent_policy.get_action(agent_obstate, latstate_idx)
+    return self.agent_policy.get_action(agent_obstate, latstate_idx, rng)
 
   def conv_idx_to_action(self, tuple_aidx: Sequence[int]) -> Sequence:
     return self.agent_policy.conv_idx_to_action(tuple_aidx)
@@ -1,7 +1,8 @@
-from typing import Hashable, Mapping, Tuple, Sequence
+from typing import Hashable, Mapping, Optional, Tuple, Sequence
 import abc
 import os
 import numpy as np
+from TMM.models.mdp import LatentMDP
 from TMM.domains.simulator import Simulator
 from TMM.domains.agent import SimulatorAgent, InteractiveAgent
 from TMM.domains.box_push import EventType, AGENT_ACTIONSPACE
@@ -25,6 +26,8 @@ class BoxPushSimulator(Simulator):
     self.agent_1 = None
     self.agent_2 = None
     self.tuple_action_when_none = tuple_action_when_none
+    self.compiled_mdp = None
+    self.transition_sampler = None
 
   def init_game(self,
                 x_grid: int,
@@ -58,6 +61,27 @@ class BoxPushSimulator(Simulator):
     step, bstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat = history_item
     return (bstt, a1pos, a2pos), (a1act, a2act)
 
+  @classmethod
+  def get_state_action_latent_from_file_item(cls, file_item):
+    bstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat = file_item
+    tup_actions = None
+    if a1act is not None:
+      tup_actions = (AGENT_ACTIONSPACE.idx_to_action[a1act],
+                     AGENT_ACTIONSPACE.idx_to_action[a2act])
+    return (bstt, a1pos, a2pos), tup_actions, (a1lat, a2lat)
+
+  def set_history(self, list_states, list_actions, list_latents):
+    self.history = []
+    for step, (a1act, a2act) in enumerate(list_actions):
+      bstt, a1pos, a2pos = list_states[step]
+      a1lat, a2lat = list_latents[step]
+      self.history.append(
+          [step, bstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat])
+
+    self.current_step = len(list_actions)
+    bstt, self.a1_pos, self.a2_pos = list_states[-1]
+    self.box_states = list(bstt)
+
   def set_autonomous_agent(self,
                            agent1: SimulatorAgent = InteractiveAgent(),
                            agent2: SimulatorAgent = InteractiveAgent()):
@@ -126,7 +150,24 @@ class BoxPushSimulator(Simulator):
     self.agent_2.update_mental_state(a2_cur_state, tuple_actions,
                                      self.get_current_state())
 
+  def set_compiled_transition(self, mdp: Optional[LatentMDP] = None):
+    '''
+    mdp: the MDP of the same game with the joint action space
+         (e.g., BoxPushTeamMDP_AlwaysTogether for
+         BoxPushSimulator_AlwaysTogether). if given, steps are sampled from
+         the transition table precompiled from the MDP instead of evaluating
+         the transition function. set None to switch back.
+    '''
+    self.compiled_mdp = mdp
+    self.transition_sampler = None
+    if mdp is not None:
+      self.transition_sampler = mdp.transition_sampler
+
   def _transition(self, a1_action, a2_action):
+    if self.compiled_mdp is not None:
+      self._transition_compiled(a1_action, a2_action)
+      return
+
     list_next_env = self._get_transition_distribution(a1_action, a2_action)
 
     list_prop = []
@@ -139,6 +180,17 @@ class BoxPushSimulator(Simulator):
     self.a2_pos = a2_pos
     self.box_states = box_states
 
+  def _transition_compiled(self, a1_action, a2_action):
+    mdp = self.compiled_mdp
+    sidx = mdp.conv_sim_states_to_mdp_sidx(self.get_current_state())
+    aidx = mdp.conv_sim_actions_to_mdp_aidx((a1_action, a2_action))
+    sidx_n = self.transition_sampler.sample(sidx, aidx)
+
+    box_states, a1_pos, a2_pos = mdp.conv_mdp_sidx_to_sim_states(sidx_n)
+    self.a1_pos = a1_pos
+    self.a2_pos = a2_pos
+    self.box_states = box_states
+
   @abc.abstractmethod
   def _get_transition_distribution(self, a1_action, a2_action):
     pass
@@ -1,15 +1,24 @@
+from typing import Optional, Sequence
 import numpy as np
-from TMM.models.mdp import StateSpace, LatentMDP
+from TMM.models.mdp import StateSpace, DenseStateSpace, LatentMDP
 from TMM.domains.box_push import (BoxState, conv_box_state_2_idx,
-                                  AGENT_ACTIONSPACE, EventType,
-                                  conv_box_idx_2_state)
+                                  AGENT_ACTIONSPACE, EventType)
 from TMM.domains.cleanup_single.transition import transition_single_agent
 from .define import get_possible_latent_states
 
 
 class MDPCleanupSingle(LatentMDP):
 
-  def __init__(self, x_grid, y_grid, boxes, goals, walls, drops, init_pos,
+  def __init__(self,
+               x_grid,
+               y_grid,
+               boxes,
+               goals,
+               walls,
+               drops,
+               init_pos,
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None,
                **kwargs):
     self.x_grid = x_grid
     self.y_grid = y_grid
@@ -18,7 +27,9 @@ class MDPCleanupSingle(LatentMDP):
     self.walls = walls
     self.drops = drops
     self.init_pos = init_pos
-    super().__init__(use_sparse=True)
+    super().__init__(use_sparse=True,
+                     cache_file_path=cache_file_path,
+                     initial_sim_states=initial_sim_states)
 
   def transition_model(self, state_idx: int, action_idx: int) -> np.ndarray:
     if self.is_terminal(state_idx):
@@ -84,13 +95,18 @@ class MDPCleanupSingle(LatentMDP):
         state = (i, j)
         if state not in self.walls:
           list_grid.append(state)
-    self.pos_space = StateSpace(statespace=list_grid)
+    self.pos_space = DenseStateSpace(statespace=list_grid)
     self.dict_factored_statespace = {0: self.pos_space}
 
+    # box states are keyed by their indices defined by conv_box_state_2_idx
     box_states = self.get_possible_box_states()
+    self.box_space = DenseStateSpace(
+        statespace=box_states,
+        keys=[conv_box_state_2_idx(bstate, len(self.drops))
+              for bstate in box_states])
 
     for idx in range(len(self.boxes)):
-      self.dict_factored_statespace[idx + 1] = StateSpace(statespace=box_states)
+      self.dict_factored_statespace[idx + 1] = self.box_space
 
     self.dummy_states = None
 
@@ -134,32 +150,38 @@ class MDPCleanupSingle(LatentMDP):
 
   def conv_sim_states_to_mdp_sidx(self, tup_states):
     box_states, agent_pos = tup_states
-    len_s_space = len(self.dict_factored_statespace)
     pos_idx = self.pos_space.state_to_idx[agent_pos]
     list_states = [int(pos_idx)]
-    for idx in range(1, len_s_space):
-      box_sidx_n = box_states[idx - 1]
-      box_state_n = conv_box_idx_2_state(box_sidx_n, len(self.drops),
-                                         len(self.goals))
-      box_sidx = self.dict_factored_statespace[idx].state_to_idx[box_state_n]
-      list_states.append(int(box_sidx))
+    list_states.extend(self.box_space.encode_key(bidx) for bidx in box_states)
 
     return self.conv_state_to_idx(tuple(list_states))
 
   def conv_mdp_sidx_to_sim_states(self, state_idx):
-    len_s_space = len(self.dict_factored_statespace)
     state_vec = self.conv_idx_to_state(state_idx)
 
     agent_pos = self.pos_space.idx_to_state[state_vec[0]]
-
-    box_states = []
-    for idx in range(1, len_s_space):
-      box_sidx = state_vec[idx]
-      box_state = self.dict_factored_statespace[idx].idx_to_state[box_sidx]
-      box_states.append(conv_box_state_2_idx(box_state, len(self.drops)))
+    box_states = self.box_space.np_keys[state_vec[1:], 0].tolist()
 
     return box_states, agent_pos
 
+  def conv_sim_states_to_mdp_sidx_batch(self, tup_states):
+    '''
+    tup_states: a tuple of box states (N x num_boxes)
+                and agent positions (N x 2)
+    '''
+    np_box_states, np_pos = map(np.asarray, tup_states)
+    np_pos_idx = self.pos_space.encode_keys(np_pos)
+    np_box_idx = self.box_space.encode_keys(
+        np_box_states.reshape(len(np_pos), len(self.boxes)))
+    np_states = np.concatenate([np_pos_idx[:, None], np_box_idx], axis=1)
+    return self.conv_state_to_idx_batch(np_states)
+
+  def conv_mdp_sidx_to_sim_states_batch(self, np_state_idx):
+    np_states = self.conv_idx_to_state_batch(np_state_idx)
+    np_pos = self.pos_space.decode_keys(np_states[:, 0])
+    np_box_states = self.box_space.decode_keys(np_states[:, 1:])[..., 0]
+    return np_box_states, np_pos
+
   def conv_mdp_aidx_to_sim_actions(self, action_idx):
     vector_aidx = self.conv_idx_to_action(action_idx)
     list_actions = []
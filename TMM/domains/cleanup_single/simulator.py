@@ -51,8 +51,31 @@ class CleanupSingleSimulator(Simulator):
   def get_state(self):
     return [self.box_states, self.agent_pos]
 
+  def get_current_state(self):
+    return self.get_state()
+
+  @classmethod
+  def get_state_action_latent_from_file_item(cls, file_item):
+    bstt, a_pos, a_act, a_lat = file_item
+    tup_actions = None
+    if a_act is not None:
+      tup_actions = (AGENT_ACTIONSPACE.idx_to_action[a_act], )
+    return (bstt, a_pos), tup_actions, (a_lat, )
+
+  def set_history(self, list_states, list_actions, list_latents):
+    self.history = []
+    for step, (a_act, ) in enumerate(list_actions):
+      bstt, a_pos = list_states[step]
+      self.history.append(
+          [step, bstt, a_pos, a_act, list_latents[step][0], -(step + 1)])
+
+    self.current_step = len(list_actions)
+    bstt, self.agent_pos = list_states[-1]
+    self.box_states = list(bstt)
+
   def set_autonomous_agent(self, agent: SimulatorAgent = InteractiveAgent()):
     self.agent = agent
+    self.agents = [agent]
     self.agent.init_latent(self.get_state())
 
   def reset_game(self):
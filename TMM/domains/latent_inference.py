@@ -0,0 +1,165 @@
+from typing import Sequence
+import numpy as np
+from scipy.special import logsumexp
+from TMM.models.mdp import LatentMDP
+from TMM.models.agent_model import AgentModel
+from TMM.domains.batch_simulator import BatchAgentModel, BatchTrajectories
+
+
+class LatentInference:
+  '''
+  posterior inference of the latent states of each agent over recorded
+  trajectories of the task MDP. the latent states of an agent form a hidden
+  Markov chain whose
+    initial distribution is AgentModel.initial_mental_distribution,
+    transition at each step is AgentModel.transition_mental_state and
+    observation is the agent's own action with PolicyInterface.policy.
+  each agent is inferred independently given the observed states and joint
+  actions. all terms are gathered as arrays for a batch of trajectories
+  and the forward-backward and Viterbi passes run in log space over the batch.
+  '''
+
+  def __init__(self, task_mdp: LatentMDP,
+               agent_models: Sequence[AgentModel]) -> None:
+    '''
+    agent_models: the model of each agent. the i-th agent takes the i-th
+                  action factor of task_mdp.
+    '''
+    self.task_mdp = task_mdp
+    self.list_agent_models = [
+        BatchAgentModel(agent_model, idx, task_mdp)
+        for idx, agent_model in enumerate(agent_models)
+    ]
+
+  def compute_log_terms(self, trajs: BatchTrajectories, agent_idx: int):
+    '''
+    returns
+      np_log_init: (N, X) log initial latent distributions
+      np_log_obs: (N, T + 1, X) log likelihoods of the agent's action at each
+                  step. zero at and after the last state.
+      np_tx_idx: (N, T) indices of the latent transition matrix of each step
+                 in np_log_tx. -1 after the end of each trajectory.
+      np_log_tx: (U, X, X) distinct log latent transition matrices
+    '''
+    model = self.list_agent_models[agent_idx]
+    num_envs, num_steps = trajs.np_actions.shape[:2]
+    np_steps = np.arange(num_steps)
+    np_valid = np_steps[None, :] < trajs.np_lengths[:, None]
+    np_env, np_t = np.nonzero(np_valid)
+
+    np_sidx = model.conv_task_sidx(trajs.np_states[np_env, np_t])
+    np_sidx_n = model.conv_task_sidx(trajs.np_states[np_env, np_t + 1])
+    np_task_aidx = trajs.np_actions[np_env, np_t]
+
+    with np.errstate(divide="ignore"):
+      np_log_init = np.log(
+          model.get_initial_distributions(
+              model.conv_task_sidx(trajs.np_states[:, 0])))
+
+      np_log_obs = np.zeros((num_envs, num_steps + 1, model.num_latents))
+      np_log_obs[np_env, np_t] = np.log(
+          model.get_action_likelihoods(np_sidx, np_task_aidx[:, agent_idx]))
+
+      np_tx_idx = np.full((num_envs, num_steps), -1, dtype=np.int64)
+      np_tx_idx[np_env, np_t] = model.get_transition_matrix_indices(
+          np_sidx, np_task_aidx, np_sidx_n)
+      np_log_tx = np.log(
+          np.array(model.list_tx_mat).reshape(-1, model.num_latents,
+                                              model.num_latents))
+
+    return np_log_init, np_log_obs, np_tx_idx, np_log_tx
+
+  def forward_backward(self, trajs: BatchTrajectories, agent_idx: int):
+    '''
+    returns
+      np_posterior: (N, T + 1, X) posterior latent marginals of the agent at
+                    each step. zero after the end of each trajectory.
+      np_log_lik: (N, ) log likelihoods of the agent's actions
+    '''
+    np_log_init, np_log_obs, np_tx_idx, np_log_tx = self.compute_log_terms(
+        trajs, agent_idx)
+    num_envs, num_steps = np_tx_idx.shape
+    np_lengths = trajs.np_lengths
+
+    np_log_alpha = np.full(np_log_obs.shape, -np.inf)
+    np_log_alpha[:, 0] = np_log_init + np_log_obs[:, 0]
+    for t in range(num_steps):
+      np_env = np.flatnonzero(np_lengths > t)
+      if len(np_env) == 0:
+        break
+      np_log_alpha[np_env, t + 1] = logsumexp(
+          np_log_alpha[np_env, t][:, :, None] +
+          np_log_tx[np_tx_idx[np_env, t]],
+          axis=1) + np_log_obs[np_env, t + 1]
+
+    np_log_beta = np.full(np_log_obs.shape, -np.inf)
+    np_log_beta[np.arange(num_envs), np_lengths] = 0.
+    for t in reversed(range(num_steps)):
+      np_env = np.flatnonzero(np_lengths > t)
+      if len(np_env) == 0:
+        continue
+      np_log_beta[np_env, t] = logsumexp(
+          np_log_tx[np_tx_idx[np_env, t]] +
+          (np_log_obs[np_env, t + 1] + np_log_beta[np_env, t + 1])[:, None, :],
+          axis=2)
+
+    np_log_lik = logsumexp(np_log_alpha[:, 0] + np_log_beta[:, 0], axis=1)
+    with np.errstate(invalid="ignore"):
+      np_posterior = np.exp(np_log_alpha + np_log_beta -
+                            np_log_lik[:, None, None])
+    return np_posterior, np_log_lik
+
+  def viterbi(self, trajs: BatchTrajectories, agent_idx: int):
+    '''
+    returns
+      np_latents: (N, T + 1) the most likely latent sequences of the agent.
+                  -1 after the end of each trajectory.
+      np_log_prob: (N, ) log joint probabilities of the sequences and the
+                   agent's actions
+    '''
+    np_log_init, np_log_obs, np_tx_idx, np_log_tx = self.compute_log_terms(
+        trajs, agent_idx)
+    num_envs, num_steps = np_tx_idx.shape
+    np_lengths = trajs.np_lengths
+
+    np_log_delta = np.full(np_log_obs.shape, -np.inf)
+    np_log_delta[:, 0] = np_log_init + np_log_obs[:, 0]
+    np_backptr = np.zeros(np_log_obs.shape, dtype=np.int64)
+    for t in range(num_steps):
+      np_env = np.flatnonzero(np_lengths > t)
+      if len(np_env) == 0:
+        break
+      np_score = (np_log_delta[np_env, t][:, :, None] +
+                  np_log_tx[np_tx_idx[np_env, t]])
+      np_backptr[np_env, t + 1] = np.argmax(np_score, axis=1)
+      np_log_delta[np_env, t + 1] = (np.max(np_score, axis=1) +
+                                     np_log_obs[np_env, t + 1])
+
+    np_all_env = np.arange(num_envs)
+    np_latents = np.full((num_envs, num_steps + 1), -1, dtype=np.int64)
+    np_last = np.argmax(np_log_delta[np_all_env, np_lengths], axis=1)
+    np_log_prob = np_log_delta[np_all_env, np_lengths, np_last]
+    np_latents[np_all_env, np_lengths] = np_last
+    for t in reversed(range(num_steps)):
+      np_env = np.flatnonzero(np_lengths > t)
+      np_latents[np_env, t] = np_backptr[np_env, t + 1,
+                                         np_latents[np_env, t + 1]]
+    return np_latents, np_log_prob
+
+  def infer_posteriors(self, trajs: BatchTrajectories):
+    'returns a list of forward_backward outputs of each agent'
+    return [
+        self.forward_backward(trajs, agent_idx)
+        for agent_idx in range(len(self.list_agent_models))
+    ]
+
+  def infer_most_likely_latents(self, trajs: BatchTrajectories):
+    '''
+    returns (N, T + 1, num_agents) the most likely latent sequences of
+    each agent. see viterbi.
+    '''
+    return np.stack([
+        self.viterbi(trajs, agent_idx)[0]
+        for agent_idx in range(len(self.list_agent_models))
+    ],
+                    axis=2)
@@ -1,7 +1,8 @@
-from typing import Sequence, Mapping, Tuple
+from typing import Optional, Sequence, Mapping, Tuple
 import itertools
 import numpy as np
 from TMM.models.mdp.latent_mdp import LatentMDP, StateSpace
+from TMM.models.mdp.spaces import DenseStateSpace
 from TMM.domains.rescue import (Route, E_EventType, E_Type, Location, Work,
                                 Place, T_Connections, AGENT_ACTIONSPACE,
                                 is_work_done)
@@ -12,14 +13,19 @@ class MDP_Rescue(LatentMDP):
 
   def __init__(self, routes: Sequence[Route], places: Sequence[Place],
                connections: Mapping[int, T_Connections],
-               work_locations: Sequence[Location], work_info: Sequence[Work],
+               work_locations: Sequence[Location],
+               work_info: Sequence[Work],
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None,
                **kwarg):
     self.routes = routes
     self.places = places
     self.connections = connections
     self.work_locations = work_locations
     self.work_info = work_info
-    super().__init__(use_sparse=True)
+    super().__init__(use_sparse=True,
+                     cache_file_path=cache_file_path,
+                     initial_sim_states=initial_sim_states)
 
   def _transition_impl(self, work_states, a1_pos, a2_pos, a1_action, a2_action):
     return transition(work_states, a1_pos, a2_pos, a1_action, a2_action,
@@ -69,11 +75,11 @@ class MDP_Rescue(LatentMDP):
       for idx in range(route.length):
         list_locations.append(Location(E_Type.Route, route_id, idx))
 
-    self.pos1_space = StateSpace(statespace=list_locations)
-    self.pos2_space = StateSpace(statespace=list_locations)
+    self.pos1_space = DenseStateSpace(statespace=list_locations)
+    self.pos2_space = DenseStateSpace(statespace=list_locations)
 
     num_works = len(self.work_locations)
-    self.work_states_space = StateSpace(
+    self.work_states_space = DenseStateSpace(
         statespace=list(itertools.product([0, 1], repeat=num_works)))
 
     self.dict_factored_statespace = {
@@ -118,6 +124,35 @@ class MDP_Rescue(LatentMDP):
 
     return work_states, pos1, pos2
 
+  def conv_sim_states_to_mdp_sidx_batch(self, tup_states):
+    '''
+    tup_states: a tuple of work states (N x num_works) and
+                position codes (N, ) of agent1, agent2
+    position codes are the indices of locations in pos1_space.
+    see conv_locations_to_pos_codes
+    '''
+    np_work_states, np_pos1, np_pos2 = tup_states
+    np_work_states_idx = self.work_states_space.encode_keys(
+        np.asarray(np_work_states).reshape(-1, len(self.work_locations)))
+    np_pos1 = np.asarray(np_pos1, dtype=np.int64)
+    np_pos2 = np.asarray(np_pos2, dtype=np.int64)
+    np_states = np.stack([np_pos1, np_pos2, np_work_states_idx], axis=1)
+    return self.conv_state_to_idx_batch(np_states)
+
+  def conv_mdp_sidx_to_sim_states_batch(self, np_state_idx):
+    np_states = self.conv_idx_to_state_batch(np_state_idx)
+    np_pos1 = np_states[:, 0]
+    np_pos2 = np_states[:, 1]
+    np_work_states = self.work_states_space.decode_keys(np_states[:, 2])
+    return (np_work_states, np_pos1, np_pos2)
+
+  def conv_locations_to_pos_codes(self,
+                                  list_locations: Sequence[Location]):
+    return self.pos1_space.encode_batch(list_locations)
+
+  def conv_pos_codes_to_locations(self, np_pos_codes: np.ndarray):
+    return self.pos1_space.decode_batch(np_pos_codes).tolist()
+
   def conv_mdp_aidx_to_sim_actions(self, action_idx):
     vector_aidx = self.conv_idx_to_action(action_idx)
     list_actions = []
@@ -42,6 +42,29 @@ class RescueSimulator(Simulator):
     step, score, wstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat = history_item
     return (wstt, a1pos, a2pos), (a1act, a2act)
 
+  @classmethod
+  def get_state_action_latent_from_file_item(cls, file_item):
+    score, wstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat = file_item
+    tup_actions = None
+    if a1act is not None:
+      tup_actions = (a1act, a2act)
+    return (wstt, a1pos, a2pos), tup_actions, (a1lat, a2lat)
+
+  def set_history(self, list_states, list_actions, list_latents):
+    self.history = []
+    for step, (a1act, a2act) in enumerate(list_actions):
+      wstt, a1pos, a2pos = list_states[step]
+      a1lat, a2lat = list_latents[step]
+      self.work_states = list(wstt)
+      self.update_score()
+      self.history.append(
+          [step, self.score, wstt, a1pos, a2pos, a1act, a2act, a1lat, a2lat])
+
+    self.current_step = len(list_actions)
+    wstt, self.a1_pos, self.a2_pos = list_states[-1]
+    self.work_states = list(wstt)
+    self.update_score()
+
   def set_autonomous_agent(self,
                            agent1: SimulatorAgent = InteractiveAgent(),
                            agent2: SimulatorAgent = InteractiveAgent()):
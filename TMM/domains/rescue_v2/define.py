@@ -1,7 +1,7 @@
 from typing import Union, Sequence, Tuple
 from enum import Enum
 from dataclasses import dataclass, field
-from TMM.models.mdp import ActionSpace
+from TMM.models.mdp import DenseActionSpace
 
 T_RouteId = int
 T_PlaceId = int
@@ -33,7 +33,7 @@ class E_EventType(Enum):
   Set_Latent = 100
 
 
-AGENT_ACTIONSPACE = ActionSpace([E_EventType(idx) for idx in range(6)])
+AGENT_ACTIONSPACE = DenseActionSpace([E_EventType(idx) for idx in range(6)])
 
 
 class E_Type(Enum):
@@ -61,7 +61,11 @@ class Location:
       return (self.type == other.type and self.id == other.id)
 
   def __hash__(self) -> int:
-    return hash(repr(self))
+    # consistent with __eq__ and cheaper than hashing repr(self)
+    if self.type == E_Type.Route:
+      return hash((self.type.value, self.id, self.index))
+    else:
+      return hash((self.type.value, self.id))
 
   @classmethod
   def from_str(cls, str_loc: str):
@@ -1,25 +1,33 @@
-from typing import Sequence, Mapping, Tuple
+from typing import Optional, Sequence, Mapping, Tuple
 import itertools
 import numpy as np
-from TMM.models.mdp import LatentMDP, StateSpace
+from TMM.models.mdp import (LatentMDP, StateSpace, DenseStateSpace,
+                             compose_joint_next_states)
 from TMM.domains.rescue_v2 import (Route, E_EventType, E_Type, Location, Work,
                                    Place, T_Connections, AGENT_ACTIONSPACE,
                                    is_work_done)
-from TMM.domains.rescue_v2.transition import transition
+from TMM.domains.rescue_v2.transition import transition, find_location_index
 
 
 class MDP_Rescue(LatentMDP):
 
   def __init__(self, routes: Sequence[Route], places: Sequence[Place],
                connections: Mapping[int, T_Connections],
-               work_locations: Sequence[Location], work_info: Sequence[Work],
+               work_locations: Sequence[Location],
+               work_info: Sequence[Work],
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None,
                **kwarg):
     self.routes = routes
     self.places = places
     self.connections = connections
     self.work_locations = work_locations
     self.work_info = work_info
-    super().__init__(use_sparse=True)
+    # lookup tables for batched transitions. computed when first needed.
+    self._np_next_loc = None
+    super().__init__(use_sparse=True,
+                     cache_file_path=cache_file_path,
+                     initial_sim_states=initial_sim_states)
 
   def _transition_impl(self, work_states, a1_pos, a2_pos, a3_pos, a1_action,
                        a2_action, a3_action):
@@ -27,6 +35,106 @@ class MDP_Rescue(LatentMDP):
                       a3_action, self.routes, self.connections,
                       self.work_locations, self.work_info)
 
+  def _init_transition_tables(self):
+    'precomputes per-factor lookup tables for _transition_batch_impl'
+    num_locs = self.pos1_space.num_states
+    num_acts = AGENT_ACTIONSPACE.num_actions
+    num_works = len(self.work_locations)
+    no_work = [0] * num_works
+
+    # movements of an agent do not depend on the other agents or work states
+    self._np_next_loc = np.zeros((num_locs, num_acts), dtype=np.int64)
+    self._np_loc_work = np.full(num_locs, -1, dtype=np.int64)
+    self._np_loc_legal = np.zeros((num_locs, num_acts), dtype=bool)
+    for lidx in range(num_locs):
+      loc = self.pos1_space.idx_to_state[lidx]
+      num_moves = (2 if loc.type == E_Type.Route else len(
+          self.connections[loc.id]))
+      self._np_loc_legal[lidx, :num_moves] = True
+      self._np_loc_legal[lidx, [
+          AGENT_ACTIONSPACE.action_to_idx[E_EventType.Stay],
+          AGENT_ACTIONSPACE.action_to_idx[E_EventType.Rescue]
+      ]] = True
+      for aidx in range(num_acts):
+        act = AGENT_ACTIONSPACE.idx_to_action[aidx]
+        _, _, loc_n, _, _ = transition(no_work, loc, loc, loc, act,
+                                       E_EventType.Stay, E_EventType.Stay,
+                                       self.routes, self.connections,
+                                       self.work_locations, self.work_info)[0]
+        self._np_next_loc[lidx, aidx] = self.pos1_space.state_to_idx[loc_n]
+
+      widx = find_location_index(self.work_locations, loc)
+      if widx is not None:
+        self._np_loc_work[lidx] = widx
+
+    self._np_workload = np.array([info.workload for info in self.work_info])
+
+    num_wstates = self.work_states_space.num_states
+    self._np_work_done = np.zeros(num_wstates, dtype=bool)
+    for widx in range(num_wstates):
+      work_states = self.work_states_space.idx_to_state[widx]
+      self._np_work_done[widx] = all(
+          is_work_done(idx, work_states, self.work_info[idx].coupled_works)
+          for idx in range(num_works))
+
+    self._rescue_aidx = AGENT_ACTIONSPACE.action_to_idx[E_EventType.Rescue]
+
+  def _transition_batch_impl(self, np_state_vec: np.ndarray,
+                             np_indv_aidx: np.ndarray) -> np.ndarray:
+    '''
+    vectorized version of _transition_impl.
+      np_state_vec: (N, 4) array of factored state indices
+      np_indv_aidx: (N, 3) array of individual action indices
+      returns: (N, 4) array of factored indices of the next states
+    '''
+    if self._np_next_loc is None:
+      self._init_transition_tables()
+
+    num_agents = 3
+    np_next_vec = np.empty_like(np_state_vec)
+    for idx in range(num_agents):
+      np_next_vec[:, idx] = self._np_next_loc[np_state_vec[:, idx],
+                                              np_indv_aidx[:, idx]]
+    np_next_vec[:, num_agents] = self._next_work_batch(
+        np_state_vec, np_indv_aidx == self._rescue_aidx)
+    return np_next_vec
+
+  def _next_work_batch(self, np_state_vec: np.ndarray,
+                       np_rescue: np.ndarray) -> np.ndarray:
+    '''
+    returns the work state indices of the next states.
+      np_state_vec: (N, 4) array of factored state indices
+      np_rescue: (N, 3) boolean array of whether each agent takes Rescue
+    '''
+    num_agents = 3
+    np_locs = np_state_vec[:, :num_agents]
+    np_work = self.work_states_space.decode_keys(np_state_vec[:, num_agents])
+    np_loc_work = self._np_loc_work[np_locs]
+    np_has_work = np_loc_work >= 0
+    np_workload = self._np_workload[np.maximum(np_loc_work, 0)]
+    np_row = np.arange(len(np_state_vec))
+
+    # works are either 0 (done) or 1 (not done), so the order of updates
+    # in transition() does not matter.
+    for idx1, idx2 in ((0, 1), (0, 2), (1, 2)):
+      np_done = (np_has_work[:, idx1] & (np_locs[:, idx1] == np_locs[:, idx2])
+                 & np_rescue[:, idx1] & np_rescue[:, idx2]
+                 & (np_workload[:, idx1] <= 2))
+      np_work[np_row[np_done], np_loc_work[np_done, idx1]] = 0
+
+    for idx in range(num_agents):
+      np_done = np_has_work[:, idx] & np_rescue[:, idx] & (np_workload[:, idx]
+                                                           <= 1)
+      np_work[np_row[np_done], np_loc_work[np_done, idx]] = 0
+
+    return self.work_states_space.encode_keys(np_work)
+
+  def _is_terminal_batch(self, np_state_vec: np.ndarray) -> np.ndarray:
+    if self._np_next_loc is None:
+      self._init_transition_tables()
+
+    return self._np_work_done[np_state_vec[:, -1]]
+
   def map_to_str(self):
     BASE36 = 36
     num_place = len(self.places)
@@ -70,12 +178,12 @@ class MDP_Rescue(LatentMDP):
       for idx in range(route.length):
         list_locations.append(Location(E_Type.Route, route_id, idx))
 
-    self.pos1_space = StateSpace(statespace=list_locations)
-    self.pos2_space = StateSpace(statespace=list_locations)
-    self.pos3_space = StateSpace(statespace=list_locations)
+    self.pos1_space = DenseStateSpace(statespace=list_locations)
+    self.pos2_space = DenseStateSpace(statespace=list_locations)
+    self.pos3_space = DenseStateSpace(statespace=list_locations)
 
     num_works = len(self.work_locations)
-    self.work_states_space = StateSpace(
+    self.work_states_space = DenseStateSpace(
         statespace=list(itertools.product([0, 1], repeat=num_works)))
 
     self.dict_factored_statespace = {
@@ -103,6 +211,9 @@ class MDP_Rescue(LatentMDP):
 
     return super().legal_actions(state_idx)
 
+  def is_terminal_batch(self, np_state_idx):
+    return self._is_terminal_batch(self.conv_idx_to_state_batch(np_state_idx))
+
   def conv_sim_states_to_mdp_sidx(self, tup_states) -> int:
     work_states, pos1, pos2, pos3 = tup_states
 
@@ -124,6 +235,38 @@ class MDP_Rescue(LatentMDP):
 
     return work_states, pos1, pos2, pos3
 
+  def conv_sim_states_to_mdp_sidx_batch(self, tup_states):
+    '''
+    tup_states: a tuple of work states (N x num_works) and
+                position codes (N, ) of agent1, agent2, agent3
+    position codes are the indices of locations in pos1_space.
+    see conv_locations_to_pos_codes
+    '''
+    np_work_states, np_pos1, np_pos2, np_pos3 = tup_states
+    np_work_states_idx = self.work_states_space.encode_keys(
+        np.asarray(np_work_states).reshape(-1, len(self.work_locations)))
+    np_pos1 = np.asarray(np_pos1, dtype=np.int64)
+    np_pos2 = np.asarray(np_pos2, dtype=np.int64)
+    np_pos3 = np.asarray(np_pos3, dtype=np.int64)
+    np_states = np.stack([np_pos1, np_pos2, np_pos3, np_work_states_idx],
+                         axis=1)
+    return self.conv_state_to_idx_batch(np_states)
+
+  def conv_mdp_sidx_to_sim_states_batch(self, np_state_idx):
+    np_states = self.conv_idx_to_state_batch(np_state_idx)
+    np_pos1 = np_states[:, 0]
+    np_pos2 = np_states[:, 1]
+    np_pos3 = np_states[:, 2]
+    np_work_states = self.work_states_space.decode_keys(np_states[:, 3])
+    return (np_work_states, np_pos1, np_pos2, np_pos3)
+
+  def conv_locations_to_pos_codes(self,
+                                  list_locations: Sequence[Location]):
+    return self.pos1_space.encode_batch(list_locations)
+
+  def conv_pos_codes_to_locations(self, np_pos_codes: np.ndarray):
+    return self.pos1_space.decode_batch(np_pos_codes).tolist()
+
   def conv_mdp_aidx_to_sim_actions(self, action_idx):
     vector_aidx = self.conv_idx_to_action(action_idx)
     list_actions = []
@@ -174,6 +317,15 @@ class MDP_Rescue_Agent(MDP_Rescue):
       ]
       return move_actions + stay_actions
 
+  def create_task_mdp(self):
+    'transitions are derived from the task MDP with uniform teammates'
+    return MDP_Rescue_Task(self.routes,
+                           self.places,
+                           self.connections,
+                           self.work_locations,
+                           self.work_info,
+                           cache_file_path=self.cache_file_path)
+
   def init_latentspace(self):
     num_works = len(self.work_locations)
     latent_states = list(range(num_works))
@@ -191,9 +343,9 @@ class MDP_Rescue_Agent(MDP_Rescue):
     list_p_next_env = []
     for teammate_act1 in AGENT_ACTIONSPACE.actionspace:
       for teammate_act2 in AGENT_ACTIONSPACE.actionspace:
-        list_p_next_env = list_p_next_env + self._transition_impl(
-            work_states, my_pos, mate_pos1, mate_pos2, my_act, teammate_act1,
-            teammate_act2)
+        list_p_next_env.extend(
+            self._transition_impl(work_states, my_pos, mate_pos1, mate_pos2,
+                                  my_act, teammate_act1, teammate_act2))
 
     list_next_p_state = []
     map_next_state = {}
@@ -209,6 +361,29 @@ class MDP_Rescue_Agent(MDP_Rescue):
 
     return np.array(list_next_p_state)
 
+  def transition_model_batch(self, np_state_idx: np.ndarray,
+                             np_action_idx: np.ndarray):
+    num_indv_actions = AGENT_ACTIONSPACE.num_actions
+    np_mate_aidx = np.array(
+        list(itertools.product(range(num_indv_actions), repeat=2)))
+    num_mate_combos = len(np_mate_aidx)
+    num_pairs = len(np_state_idx)
+
+    # assume teammates choose an action uniformly
+    np_pair_pos = np.repeat(np.arange(num_pairs), num_mate_combos)
+    np_state_vec = self.np_idx_to_state[np_state_idx[np_pair_pos]]
+    np_my_aidx = self.np_idx_to_action[np_action_idx[np_pair_pos]]
+    np_indv_aidx = np.column_stack(
+        [np_my_aidx[:, 0], np.tile(np_mate_aidx, (num_pairs, 1))])
+
+    np_next_vec = self._transition_batch_impl(np_state_vec, np_indv_aidx)
+    np_next_sidx = self.np_state_to_idx[tuple(np_next_vec.T)].astype(np.int64)
+    np_terminal = self._is_terminal_batch(np_state_vec)
+    np_next_sidx[np_terminal] = np_state_idx[np_pair_pos[np_terminal]]
+
+    np_next_p = np.full(len(np_pair_pos), 1 / num_mate_combos)
+    return np_pair_pos, np_next_sidx, np_next_p
+
   def reward(self, latent_idx: int, state_idx: int, action_idx: int) -> float:
     if self.is_terminal(state_idx):
       return 0
@@ -262,6 +437,79 @@ class MDP_Rescue_Task(MDP_Rescue):
 
     return np.array(list_next_p_state)
 
+  def transition_model_batch(self, np_state_idx: np.ndarray,
+                             np_action_idx: np.ndarray):
+    np_state_vec = self.np_idx_to_state[np_state_idx]
+    np_indv_aidx = self.np_idx_to_action[np_action_idx]
+
+    np_next_vec = self._transition_batch_impl(np_state_vec, np_indv_aidx)
+    np_next_sidx = self.np_state_to_idx[tuple(np_next_vec.T)].astype(np.int64)
+    np_terminal = self._is_terminal_batch(np_state_vec)
+    np_next_sidx[np_terminal] = np_state_idx[np_terminal]
+
+    num_pairs = len(np_state_idx)
+    return np.arange(num_pairs), np_next_sidx, np.ones(num_pairs)
+
+  def legal_action_mask_batch(self, np_state_idx):
+    if self._np_next_loc is None:
+      self._init_transition_tables()
+
+    # legal actions of each agent depend only on its own location
+    np_state_vec = self.conv_idx_to_state_batch(np_state_idx)
+    np_legal = self._np_loc_legal
+    np_mask = (np_legal[np_state_vec[:, 0], :, None, None]
+               & np_legal[np_state_vec[:, 1], None, :, None]
+               & np_legal[np_state_vec[:, 2], None, None, :])
+    np_mask = np_mask.reshape(len(np_state_idx), -1)
+    np_mask[self._is_terminal_batch(np_state_vec)] = False
+    return np_mask
+
+  def compute_deterministic_next_states(self):
+    '''
+    composes the next states of all joint actions from per-agent factors.
+    each agent's action affects its own next location and whether it rescues,
+    tabulated as the code next_loc * 2 + rescue for each (state, action).
+    work states are updated only for the joint actions in which some agent
+    rescues at a work location.
+    '''
+    if self._np_next_loc is None:
+      self._init_transition_tables()
+
+    num_agents = 3
+    np_loc_code = (self._np_next_loc * 2 +
+                   (np.arange(AGENT_ACTIONSPACE.num_actions)
+                    == self._rescue_aidx))
+    list_local_codes = [
+        np_loc_code[self.np_idx_to_state[:, idx]] for idx in range(num_agents)
+    ]
+
+    def combine(np_sidx, *list_codes):
+      shape = np.broadcast_shapes(np_sidx.shape,
+                                  *[np_code.shape for np_code in list_codes])
+      np_state_vec = self.np_idx_to_state[np.broadcast_to(np_sidx,
+                                                          shape).reshape(-1)]
+      np_codes = np.stack([
+          np.broadcast_to(np_code, shape).reshape(-1) for np_code in list_codes
+      ],
+                          axis=1)
+      np_next_vec = np.column_stack(
+          [np_codes // 2, np_state_vec[:, num_agents]])
+
+      # coupling correction: work states can change only if some agent
+      # rescues at a work location
+      np_rescue = np_codes % 2 == 1
+      np_at_work = self._np_loc_work[np_state_vec[:, :num_agents]] >= 0
+      np_pos = np.flatnonzero((np_rescue & np_at_work).any(axis=1))
+      np_next_vec[np_pos, num_agents] = self._next_work_batch(
+          np_state_vec[np_pos], np_rescue[np_pos])
+      return self.np_state_to_idx[tuple(np_next_vec.T)].reshape(shape)
+
+    np_next_sidx = compose_joint_next_states(list_local_codes, combine)
+
+    # illegal actions and terminal states stay at the same state
+    return np.where(self.np_legal_action_mask, np_next_sidx,
+                    np.arange(self.num_states)[:, None])
+
   def legal_actions(self, state_idx):
     if self.is_terminal(state_idx):
       return []
@@ -49,6 +49,31 @@ class RescueSimulatorV2(Simulator):
      a3lat) = history_item
     return (wstt, a1pos, a2pos, a3pos), (a1act, a2act, a3act)
 
+  @classmethod
+  def get_state_action_latent_from_file_item(cls, file_item):
+    (score, wstt, a1pos, a2pos, a3pos, a1act, a2act, a3act, a1lat, a2lat,
+     a3lat) = file_item
+    tup_actions = None
+    if a1act is not None:
+      tup_actions = (a1act, a2act, a3act)
+    return (wstt, a1pos, a2pos, a3pos), tup_actions, (a1lat, a2lat, a3lat)
+
+  def set_history(self, list_states, list_actions, list_latents):
+    self.history = []
+    for step, tup_actions in enumerate(list_actions):
+      wstt, a1pos, a2pos, a3pos = list_states[step]
+      self.work_states = list(wstt)
+      self.update_score()
+      self.history.append([
+          step, self.score, wstt, a1pos, a2pos, a3pos, *tup_actions,
+          *list_latents[step]
+      ])
+
+    self.current_step = len(list_actions)
+    wstt, self.a1_pos, self.a2_pos, self.a3_pos = list_states[-1]
+    self.work_states = list(wstt)
+    self.update_score()
+
   def set_autonomous_agent(self,
                            agent1: SimulatorAgent = InteractiveAgent(),
                            agent2: SimulatorAgent = InteractiveAgent(),
@@ -348,15 +373,15 @@ class RescueSimulatorV2(Simulator):
           a3_act = None
         else:
           a3_act = E_EventType[a3act]
-        if a1lat is None:
+        if a1lat is None or a1lat == "None":
           a1_lat = None
         else:
           a1_lat = int(a1lat)
-        if a2lat is None:
+        if a2lat is None or a2lat == "None":
           a2_lat = None
         else:
           a2_lat = int(a2lat)
-        if a3lat is None:
+        if a3lat is None or a3lat == "None":
           a3_lat = None
         else:
           a3_lat = int(a3lat)
@@ -1,6 +1,9 @@
 import abc
+import numpy as np
 from tqdm import tqdm
-from typing import Mapping, Hashable, Callable
+from typing import Mapping, Hashable, Callable, Optional, Sequence
+from TMM.models.mdp import LatentMDP
+from TMM.domains.batch_simulator import BatchRolloutRunner, BatchTrajectories
 
 
 class Simulator():
@@ -59,6 +62,36 @@ class Simulator():
       self.save_history(file_name, *args, **kwargs)
       self.reset_game()
 
+  def get_initial_states(self, num_iter: int):
+    'returns initial states of num_iter games drawn by reset_game'
+    init_states = []
+    for _ in range(num_iter):
+      self.reset_game()
+      init_states.append(self.get_current_state())
+    return init_states
+
+  def run_simulation_batch(
+      self,
+      num_iter: int,
+      task_mdp: LatentMDP,
+      init_states: Optional[Sequence] = None,
+      rng: Optional[np.random.Generator] = None) -> BatchTrajectories:
+    '''
+    runs num_iter games of self.agents in lockstep over the indices of
+    task_mdp and returns them as index arrays. see BatchRolloutRunner.
+    init_states: initial states of the games in the simulator representation.
+                 if None, each game starts from the state set by reset_game.
+    '''
+    if init_states is None:
+      init_states = self.get_initial_states(num_iter)
+
+    np_init_sidx = np.array([
+        task_mdp.conv_sim_states_to_mdp_sidx(tup_states)
+        for tup_states in init_states
+    ])
+    runner = BatchRolloutRunner(task_mdp, self.agents, self.max_steps)
+    return runner.run(np_init_sidx, rng)
+
   @classmethod
   def read_file(cls, file_name):
     pass
@@ -72,6 +105,25 @@ class Simulator():
     'return state and a tuple of joint action'
     pass
 
+  @classmethod
+  def get_state_action_latent_from_file_item(cls, file_item):
+    '''
+    return state, a tuple of joint action and a tuple of latents of an item
+    returned by read_file. the joint action of the last state is None.
+    '''
+    raise NotImplementedError
+
+  def set_history(self, list_states: Sequence, list_actions: Sequence,
+                  list_latents: Sequence):
+    '''
+    rebuilds the history and the current state from a trajectory so that it
+    can be written by save_history.
+    list_states: states of each step including the last state
+    list_actions: joint actions of each step (one less than list_states)
+    list_latents: tuples of agent latents of each step
+    '''
+    raise NotImplementedError
+
   @abc.abstractmethod
   def save_history(self, file_name, *args, **kwargs):
     raise NotImplementedError
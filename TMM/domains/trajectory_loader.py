@@ -0,0 +1,207 @@
+import os
+import queue
+import re
+import threading
+from typing import Iterable, Iterator, Optional, Sequence, Type
+import numpy as np
+from TMM.models.mdp import LatentMDP
+from TMM.domains.simulator import Simulator
+from TMM.domains.trajectory_store import (OFFSETS, TrajectoryStore,
+                                          read_text_episode)
+
+
+def _episode_sort_key(file_name: str):
+  'orders numbers in file names by value, e.g., prefix2.txt < prefix10.txt'
+  return [
+      int(chunk) if idx % 2 == 1 else chunk
+      for idx, chunk in enumerate(re.split(r"(\d+)", file_name))
+  ]
+
+
+def get_episode_file_names(dir_path: str, extension: str = ".txt"):
+  '''
+  returns the paths of the episode files in a directory sorted by the
+  episode index in their names
+  '''
+  return [
+      os.path.join(dir_path, file_name)
+      for file_name in sorted(os.listdir(dir_path), key=_episode_sort_key)
+      if file_name.endswith(extension)
+  ]
+
+
+def iter_text_episodes(list_file_names: Sequence[str],
+                       simulator_class: Type[Simulator],
+                       task_mdp: LatentMDP,
+                       list_latent_spaces: Optional[Sequence] = None):
+  '''
+  yields the index arrays of each history file one at a time.
+  see read_text_episode.
+  '''
+  for file_name in list_file_names:
+    yield read_text_episode(file_name, simulator_class, task_mdp,
+                            list_latent_spaces)
+
+
+def iter_store_episodes(store: TrajectoryStore,
+                        episode_indices: Optional[Sequence[int]] = None):
+  'yields the index arrays of the episodes of a store in the given order'
+  if episode_indices is None:
+    episode_indices = range(store.get_num_episodes())
+  for idx in episode_indices:
+    yield store.get_episode(idx)
+
+
+def _rebatch(chunks: Iterable, batch_size: int, drop_last: bool):
+  'splits and merges chunks of transition columns into minibatches'
+  list_pending = []
+  num_pending = 0
+  for chunk in chunks:
+    list_pending.append(chunk)
+    num_pending += len(chunk[0])
+    if num_pending < batch_size:
+      continue
+
+    list_cols = [np.concatenate(cols) for cols in zip(*list_pending)]
+    num_full = num_pending - num_pending % batch_size
+    for start in range(0, num_full, batch_size):
+      yield tuple(np_col[start:start + batch_size] for np_col in list_cols)
+    num_pending -= num_full
+    list_pending = ([tuple(np_col[num_full:] for np_col in list_cols)]
+                    if num_pending > 0 else [])
+
+  if num_pending > 0 and not drop_last:
+    yield tuple(np.concatenate(cols) for cols in zip(*list_pending))
+
+
+def iter_minibatches(episodes: Iterable, batch_size: int,
+                     drop_last: bool = False):
+  '''
+  converts episodes into minibatches of transitions (s, a, s', x), where
+  s, a and s' are (B, ) arrays of state, joint action and next state indices
+  and x is a (B, num_agents) array of latent indices at s.
+  episodes: an iterable of (states, joint actions, latents) of each episode
+            as returned by TrajectoryStore.get_episode
+  drop_last: if True, the last minibatch smaller than batch_size is dropped.
+  only the episodes of the current minibatch are kept in memory.
+  '''
+
+  def iter_chunks():
+    for np_states, np_actions, np_latents in episodes:
+      if len(np_actions) == 0:
+        continue
+      yield (np.asarray(np_states[:-1]), np.asarray(np_actions),
+             np.asarray(np_states[1:]), np.asarray(np_latents[:-1]))
+
+  return _rebatch(iter_chunks(), batch_size, drop_last)
+
+
+def iter_store_minibatches(store: TrajectoryStore,
+                           batch_size: int,
+                           drop_last: bool = False,
+                           chunk_size: int = 1 << 20):
+  '''
+  same as iter_minibatches(iter_store_episodes(store), ...) but reads the
+  columns of the store in contiguous chunks of chunk_size rows.
+  '''
+  total = len(store.np_states)
+
+  def iter_chunks():
+    for start in range(0, total, chunk_size):
+      end = min(start + chunk_size, total)
+      # one more state is read for the next state of the last row
+      np_states = np.asarray(store.np_states[start:min(end + 1, total)])
+      np_actions = np.asarray(store.np_actions[start:end])
+      np_latents = np.asarray(store.np_latents[start:end])
+
+      # the last state of each episode has no action
+      np_pos = np.flatnonzero(np_actions >= 0)
+      if len(np_pos) == 0:
+        continue
+      yield (np_states[np_pos], np_actions[np_pos], np_states[np_pos + 1],
+             np_latents[np_pos])
+
+  return _rebatch(iter_chunks(), batch_size, drop_last)
+
+
+def prefetch(iterator: Iterable, num_prefetch: int = 2) -> Iterator:
+  '''
+  runs an iterator in a background thread and keeps up to num_prefetch items
+  ready. exceptions raised by the iterator are re-raised to the consumer.
+  '''
+  if num_prefetch <= 0:
+    yield from iterator
+    return
+
+  END = object()
+  buffer = queue.Queue(maxsize=num_prefetch)
+  stop = threading.Event()
+
+  def put(item):
+    while not stop.is_set():
+      try:
+        buffer.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in iterator:
+        if not put((item, None)):
+          return
+    except BaseException as e:  # noqa: B902
+      put((END, e))
+      return
+    put((END, None))
+
+  thread = threading.Thread(target=produce, daemon=True)
+  thread.start()
+  try:
+    while True:
+      item, error = buffer.get()
+      if item is END:
+        if error is not None:
+          raise error
+        return
+      yield item
+  finally:
+    # lets the producer exit if the consumer stops early
+    stop.set()
+    thread.join()
+
+
+def load_minibatches(source,
+                     batch_size: int,
+                     simulator_class: Optional[Type[Simulator]] = None,
+                     task_mdp: Optional[LatentMDP] = None,
+                     list_latent_spaces: Optional[Sequence] = None,
+                     drop_last: bool = False,
+                     num_prefetch: int = 0):
+  '''
+  yields minibatches of index-encoded transitions (s, a, s', x) from a dataset
+  with bounded memory. see iter_minibatches.
+  source: a TrajectoryStore, the directory of a store, a directory of history
+          files or a list of history files. simulator_class and task_mdp are
+          required for history files.
+  num_prefetch: if positive, minibatches are prepared in a background thread
+                and up to this number of them are kept ready.
+  '''
+  if isinstance(source, str) and os.path.exists(
+      os.path.join(source, OFFSETS + ".npy")):
+    source = TrajectoryStore(source)
+
+  if isinstance(source, TrajectoryStore):
+    batches = iter_store_minibatches(source, batch_size, drop_last)
+  else:
+    if simulator_class is None or task_mdp is None:
+      raise ValueError("simulator_class and task_mdp are required "
+                       "to read history files")
+    if isinstance(source, str):
+      source = get_episode_file_names(source)
+    batches = iter_minibatches(
+        iter_text_episodes(source, simulator_class, task_mdp,
+                           list_latent_spaces), batch_size, drop_last)
+
+  return prefetch(batches, num_prefetch)
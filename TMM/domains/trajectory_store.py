@@ -0,0 +1,227 @@
+import os
+import shutil
+from typing import Optional, Sequence, Type
+import numpy as np
+from tqdm import tqdm
+from TMM.models.mdp import LatentMDP
+from TMM.domains.simulator import Simulator
+from TMM.domains.batch_simulator import BatchTrajectories
+
+STATES = "states"
+ACTIONS = "actions"
+LATENTS = "latents"
+OFFSETS = "offsets"
+
+
+class TrajectoryStore:
+  '''
+  columnar trajectory store. a store is a directory of .npy files:
+    states: (total, ) state indices of the task MDP
+    actions: (total, ) joint action indices of the task MDP.
+             -1 at the last state of each episode
+    latents: (total, num_agents) latent state indices of each agent.
+             -1 if the latent is unknown
+    offsets: (num_episodes + 1, ) start of each episode in the columns
+  columns are memory-mapped so that episodes can be accessed at random
+  without loading the whole store.
+  '''
+
+  def __init__(self, dir_path: str, mmap_mode: Optional[str] = "r") -> None:
+    self.dir_path = dir_path
+
+    def load(name):
+      return np.load(os.path.join(dir_path, name + ".npy"), mmap_mode=mmap_mode)
+
+    self.np_states = load(STATES)
+    self.np_actions = load(ACTIONS)
+    self.np_latents = load(LATENTS)
+    self.np_offsets = np.asarray(load(OFFSETS))
+
+  def get_num_episodes(self):
+    return len(self.np_offsets) - 1
+
+  def get_num_agents(self):
+    return self.np_latents.shape[1]
+
+  def get_lengths(self):
+    'returns the number of steps of each episode'
+    return np.diff(self.np_offsets) - 1
+
+  def get_episode(self, episode_idx: int):
+    '''
+    returns the states (L + 1, ), joint actions (L, ) and latents
+    (L + 1, num_agents) of an episode with L steps
+    '''
+    start = self.np_offsets[episode_idx]
+    end = self.np_offsets[episode_idx + 1]
+    return (self.np_states[start:end], self.np_actions[start:end - 1],
+            self.np_latents[start:end])
+
+
+def write_trajectory_store(dir_path: str, np_states: np.ndarray,
+                           np_actions: np.ndarray, np_latents: np.ndarray,
+                           np_offsets: np.ndarray):
+  '''
+  writes flat columns to a store directory (see TrajectoryStore).
+  an existing store at dir_path is replaced only after all columns are written.
+  '''
+  dir_path = os.path.normpath(dir_path)
+  parent = os.path.dirname(dir_path)
+  if parent != '' and not os.path.exists(parent):
+    os.makedirs(parent, exist_ok=True)
+
+  tmp_path = dir_path + ".%d.tmp" % (os.getpid(), )
+  os.makedirs(tmp_path, exist_ok=True)
+  for name, np_col in ((STATES, np_states), (ACTIONS, np_actions),
+                       (LATENTS, np_latents), (OFFSETS, np_offsets)):
+    np.save(os.path.join(tmp_path, name + ".npy"),
+            np.ascontiguousarray(np_col, dtype=np.int64))
+
+  if os.path.exists(dir_path):
+    old_path = dir_path + ".%d.old" % (os.getpid(), )
+    os.rename(dir_path, old_path)
+    os.rename(tmp_path, dir_path)
+    shutil.rmtree(old_path)
+  else:
+    os.rename(tmp_path, dir_path)
+
+
+def save_episodes(dir_path: str, list_states: Sequence[Sequence[int]],
+                  list_actions: Sequence[Sequence[int]],
+                  list_latents: Sequence[Sequence[Sequence[int]]]):
+  '''
+  list_states: state indices of each episode including the last state
+  list_actions: joint action indices of each episode
+  list_latents: latent indices (one tuple per state) of each episode
+  '''
+  np_lengths = np.array([len(states) for states in list_states], dtype=np.int64)
+  np_offsets = np.concatenate(([0], np.cumsum(np_lengths)))
+  total = np_offsets[-1]
+  num_agents = len(list_latents[0][0]) if total > 0 else 0
+
+  np_states = np.empty(total, dtype=np.int64)
+  np_actions = np.full(total, -1, dtype=np.int64)
+  np_latents = np.empty((total, num_agents), dtype=np.int64)
+  for idx in range(len(list_states)):
+    start, end = np_offsets[idx], np_offsets[idx + 1]
+    np_states[start:end] = list_states[idx]
+    np_actions[start:end - 1] = list_actions[idx]
+    np_latents[start:end] = list_latents[idx]
+
+  write_trajectory_store(dir_path, np_states, np_actions, np_latents,
+                         np_offsets)
+
+
+def save_batch_trajectories(dir_path: str, trajs: BatchTrajectories,
+                            task_mdp: LatentMDP):
+  'writes trajectories generated with task_mdp by BatchRolloutRunner'
+  num_steps = trajs.np_states.shape[1]
+  np_valid = np.arange(num_steps)[None, :] <= trajs.np_lengths[:, None]
+
+  # factored actions -> joint action indices. padding is masked out below
+  np_joint = np.full(trajs.np_states.shape, -1, dtype=np.int64)
+  np_joint[:, :-1] = task_mdp.np_action_to_idx[tuple(
+      np.moveaxis(trajs.np_actions, -1, 0))]
+  np_joint[np.arange(num_steps)[None, :] >= trajs.np_lengths[:, None]] = -1
+
+  np_offsets = np.concatenate(([0], np.cumsum(trajs.np_lengths + 1)))
+  write_trajectory_store(dir_path, trajs.np_states[np_valid],
+                         np_joint[np_valid], trajs.np_latents[np_valid],
+                         np_offsets)
+
+
+def read_text_episode(file_name: str,
+                      simulator_class: Type[Simulator],
+                      task_mdp: LatentMDP,
+                      list_latent_spaces: Optional[Sequence] = None):
+  '''
+  reads a history file written by simulator_class.save_history and returns
+  its state indices (L + 1, ), joint action indices (L, ) and latent indices
+  (L + 1, num_agents) as in TrajectoryStore.get_episode.
+  list_latent_spaces: latent state space of each agent used to index latents.
+                      if None, task_mdp.latent_space is used for all agents.
+  history files do not record the latents of the last state, so they are -1.
+  '''
+  states = []
+  actions = []
+  latents = []
+  for file_item in simulator_class.read_file(file_name):
+    tup_states, tup_actions, tup_latents = (
+        simulator_class.get_state_action_latent_from_file_item(file_item))
+    if list_latent_spaces is None:
+      list_latent_spaces = [task_mdp.latent_space] * len(tup_latents)
+
+    states.append(task_mdp.conv_sim_states_to_mdp_sidx(tup_states))
+    if tup_actions is not None:
+      actions.append(task_mdp.conv_sim_actions_to_mdp_aidx(tup_actions))
+    latents.append([
+        -1 if lat is None else list_latent_spaces[idx].state_to_idx[lat]
+        for idx, lat in enumerate(tup_latents)
+    ])
+
+  # the last line of a history file has no action
+  return (np.array(states, dtype=np.int64),
+          np.array(actions[:len(states) - 1], dtype=np.int64),
+          np.array(latents, dtype=np.int64).reshape(len(states), -1))
+
+
+def conv_text_files_to_store(list_file_names: Sequence[str],
+                             simulator_class: Type[Simulator],
+                             task_mdp: LatentMDP,
+                             dir_path: str,
+                             list_latent_spaces: Optional[Sequence] = None):
+  '''
+  converts history files written by simulator_class.save_history to a store.
+  see read_text_episode for list_latent_spaces.
+  the latents of the last state of each episode are -1 in the store.
+  '''
+  list_states = []
+  list_actions = []
+  list_latents = []
+  for file_name in tqdm(list_file_names):
+    np_states, np_actions, np_latents = read_text_episode(
+        file_name, simulator_class, task_mdp, list_latent_spaces)
+    list_states.append(np_states)
+    list_actions.append(np_actions)
+    list_latents.append(np_latents)
+
+  save_episodes(dir_path, list_states, list_actions, list_latents)
+
+
+def conv_store_to_text_files(store: TrajectoryStore,
+                             simulator: Simulator,
+                             task_mdp: LatentMDP,
+                             file_name_prefix: str,
+                             *args,
+                             list_latent_spaces: Optional[Sequence] = None,
+                             **kwargs):
+  '''
+  writes each episode of a store as a history file of the simulator.
+  the simulator should be initialized with the game the store is made from.
+  args and kwargs are passed to simulator.save_history
+  the text format is lossy: save_history does not write the latents of the
+  last state of each episode, so converting the files back to a store gives
+  -1 for them (see read_text_episode).
+  '''
+  if list_latent_spaces is None:
+    list_latent_spaces = [task_mdp.latent_space] * store.get_num_agents()
+
+  for idx in tqdm(range(store.get_num_episodes())):
+    np_states, np_actions, np_latents = store.get_episode(idx)
+    list_states = [
+        task_mdp.conv_mdp_sidx_to_sim_states(sidx)
+        for sidx in np_states.tolist()
+    ]
+    list_actions = [
+        task_mdp.conv_mdp_aidx_to_sim_actions(aidx)
+        for aidx in np_actions.tolist()
+    ]
+    list_latents = [
+        tuple(None if lat < 0 else list_latent_spaces[i_a].idx_to_state[lat]
+              for i_a, lat in enumerate(tup_lat))
+        for tup_lat in np_latents.tolist()
+    ]
+    simulator.set_history(list_states, list_actions, list_latents)
+    simulator.save_history(file_name_prefix + "%d.txt" % (idx, ), *args,
+                           **kwargs)
+    simulator.reset_game()
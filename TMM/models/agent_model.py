@@ -1,18 +1,27 @@
 import abc
+from collections import OrderedDict
 from typing import Optional, Sequence
 import numpy as np
 from TMM.models.policy import PolicyInterface
+from TMM.models.mdp import sample_from_dist
 
 
 class AgentModel:
   __metaclass__ = abc.ABCMeta
 
+  # max number of initial latent distributions kept by
+  # get_initial_mental_distribution
+  INIT_DIST_CACHE_SIZE = 4096
+
   def __init__(self, policy_model: Optional[PolicyInterface] = None) -> None:
     self.policy_model = policy_model
     self.current_latent = -1  # type: int
+    self._init_dist_cache = OrderedDict()
+    self._np_init_dist_table = None
 
   def set_policy(self, policy_model):
     self.policy_model = policy_model
+    self.clear_initial_mental_distribution_cache()
 
   def is_current_latent_valid(self):
     return self.current_latent >= 0
@@ -29,22 +38,81 @@ class AgentModel:
     'return: 1-D array'
     raise NotImplementedError
 
+  def get_initial_mental_distribution(self, obstate_idx: int) -> np.ndarray:
+    '''
+    memoized version of initial_mental_distribution.
+    the distributions of recently used states are kept in an LRU cache of
+    this model (i.e., keyed by the agent and the state) unless the full table
+    has been computed by precompute_initial_mental_distribution.
+    return: read-only 1-D array
+    '''
+    if self._np_init_dist_table is not None:
+      return self._np_init_dist_table[obstate_idx]
+
+    np_init_dist = self._init_dist_cache.get(obstate_idx)
+    if np_init_dist is not None:
+      self._init_dist_cache.move_to_end(obstate_idx)
+      return np_init_dist
+
+    np_init_dist = np.array(self.initial_mental_distribution(obstate_idx),
+                            dtype=np.float64)
+    np_init_dist.flags.writeable = False
+    self._init_dist_cache[obstate_idx] = np_init_dist
+    if len(self._init_dist_cache) > self.INIT_DIST_CACHE_SIZE:
+      self._init_dist_cache.popitem(last=False)
+    return np_init_dist
+
+  def precompute_initial_mental_distribution(self) -> np.ndarray:
+    '''
+    computes the initial latent distributions of all states of the reference
+    MDP at once. they are used by get_initial_mental_distribution afterward.
+    return: read-only (S, X) array
+    '''
+    if self._np_init_dist_table is None:
+      mdp = self.get_reference_mdp()
+      np_table = np.array([
+          self.initial_mental_distribution(sidx)
+          for sidx in range(mdp.num_states)
+      ],
+                          dtype=np.float64)
+      np_table.flags.writeable = False
+      self._np_init_dist_table = np_table
+      self._init_dist_cache.clear()
+    return self._np_init_dist_table
+
+  @property
+  def np_init_dist_table(self) -> Optional[np.ndarray]:
+    'the table computed by precompute_initial_mental_distribution or None'
+    return self._np_init_dist_table
+
+  def clear_initial_mental_distribution_cache(self):
+    self._init_dist_cache.clear()
+    self._np_init_dist_table = None
+
   def get_reference_mdp(self):
     return self.policy_model.mdp
 
-  def sample_initial_mental_state(self, obstate_idx: int) -> int:
-    np_init_dist = self.initial_mental_distribution(obstate_idx)
-    return np.random.choice(range(len(np_init_dist)), p=np_init_dist)
+  def sample_initial_mental_state(
+      self,
+      obstate_idx: int,
+      rng: Optional[np.random.Generator] = None) -> int:
+    'rng: if None, the global numpy random state is used'
+    np_init_dist = self.get_initial_mental_distribution(obstate_idx)
+    return sample_from_dist(np_init_dist, rng)
 
-  def sample_next_mental_state(self, latstate_idx: int, obstate_idx: int,
-                               tuple_action_idx: Sequence[int],
-                               obstate_next_idx: int) -> int:
+  def sample_next_mental_state(
+      self,
+      latstate_idx: int,
+      obstate_idx: int,
+      tuple_action_idx: Sequence[int],
+      obstate_next_idx: int,
+      rng: Optional[np.random.Generator] = None) -> int:
+    'rng: if None, the global numpy random state is used'
     np_next_latent_dist = self.transition_mental_state(latstate_idx,
                                                        obstate_idx,
                                                        tuple_action_idx,
                                                        obstate_next_idx)
-    return np.random.choice(range(len(np_next_latent_dist)),
-                            p=np_next_latent_dist)
+    return sample_from_dist(np_next_latent_dist, rng)
 
   def set_init_mental_state_idx(self,
                                 obstate_idx: int,
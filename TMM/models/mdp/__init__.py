@@ -4,8 +4,15 @@ All rights reserved.
 '''
 
 from .mdp import (  # noqa: F401
-    MDP, v_value_from_q_value, q_value_from_v_value, v_value_from_policy,
-    q_value_from_policy, deterministic_policy_from_q_value,
-    softmax_policy_from_q_value)
+    MDP, get_num_states_actions, v_value_from_q_value, q_value_from_v_value,
+    v_value_from_policy, q_value_from_policy, deterministic_policy_from_q_value,
+    softmax_policy_from_q_value, softmax_rows_from_q_value, SoftmaxPolicyView,
+    ActionMaskLayout)
+from .factored import (  # noqa: F401
+    DeterministicTransition, compose_joint_next_states)
 from .latent_mdp import LatentMDP  # noqa: F401
-from .spaces import StateSpace, ActionSpace  # noqa: F401
+from .sampler import (  # noqa: F401
+    TransitionSampler, AliasSampler, build_alias_table, sample_from_rows,
+    sample_from_dist)
+from .spaces import (  # noqa: F401
+    StateSpace, ActionSpace, DenseSpace, DenseStateSpace, DenseActionSpace)
@@ -0,0 +1,85 @@
+"""Utilities for caching MDP model arrays on disk."""
+
+from typing import Dict, Optional
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+
+
+def save_npz_artifact(file_path: str, **arrays: np.ndarray) -> None:
+  """Saves arrays into a compressed npz file.
+
+  The file is written to a temporary path first and then moved, so that
+  processes reading the cache never see a partially written file.
+
+  Args:
+    file_path: Path of the npz file.
+    arrays: Arrays to save. Keyword names are used as the array names.
+  """
+  dir_name = os.path.dirname(file_path)
+  if dir_name != '' and not os.path.exists(dir_name):
+    os.makedirs(dir_name, exist_ok=True)
+
+  fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+  with os.fdopen(fd, "wb") as f:
+    np.savez_compressed(f, **arrays)
+  os.replace(tmp_path, file_path)
+
+
+def load_npz_artifact(file_path: str,
+                      mmap_mode: Optional[str] = 'r'
+                      ) -> Optional[Dict[str, np.ndarray]]:
+  """Loads arrays saved with save_npz_artifact.
+
+  Members of a compressed npz file cannot be memory-mapped. Thus, the npz file
+  is unpacked into a directory of npy files next to it when it is loaded for
+  the first time, and the npy files are memory-mapped afterwards. Note that
+  every artifact is then stored twice on disk, compressed and unpacked.
+
+  The directory is named after the modification time and the size of the npz
+  file, so that a replaced npz file is unpacked again. Directories unpacked
+  from previous versions of the file are removed.
+
+  Args:
+    file_path: Path of the npz file.
+    mmap_mode: Memory-map mode passed to numpy.load. Use None to load arrays
+      into memory.
+
+  Returns:
+    A dictionary from array names to arrays. None if the file does not exist.
+  """
+  try:
+    file_stat = os.stat(file_path)
+  except FileNotFoundError:
+    return None
+
+  prefix_unpacked = os.path.splitext(file_path)[0] + ".unpacked_"
+  dir_unpacked = prefix_unpacked + "%d_%d" % (file_stat.st_mtime_ns,
+                                              file_stat.st_size)
+  if not os.path.isdir(dir_unpacked):
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(file_path))
+    with zipfile.ZipFile(file_path) as zip_file:
+      zip_file.extractall(tmp_dir)
+    try:
+      os.rename(tmp_dir, dir_unpacked)
+    except OSError:
+      # another process has unpacked the same file in the meantime
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # arrays already memory-mapped from the removed files stay valid
+    dir_name = os.path.dirname(prefix_unpacked)
+    base_name = os.path.basename(prefix_unpacked)
+    for name in os.listdir(dir_name if dir_name != '' else '.'):
+      path = os.path.join(dir_name, name)
+      if name.startswith(base_name) and path != dir_unpacked:
+        shutil.rmtree(path, ignore_errors=True)
+
+  dict_arrays = {}
+  for file_name in os.listdir(dir_unpacked):
+    name, ext = os.path.splitext(file_name)
+    if ext == ".npy":
+      dict_arrays[name] = np.load(os.path.join(dir_unpacked, file_name),
+                                  mmap_mode=mmap_mode)
+  return dict_arrays
@@ -0,0 +1,89 @@
+"""Deterministic next-state tables of MDPs."""
+
+from typing import Callable, Sequence
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class DeterministicTransition:
+  """A deterministic transition model stored as a next-state table.
+
+  Row r (state_idx * num_actions + action_idx, as in MDP.np_transition_csr)
+  moves to np_next_sidx[r] with probability 1. The table behaves like the
+  csr matrix in Bellman backups: (table @ v)[r] = v[np_next_sidx[r]] is a
+  gather instead of a sparse matrix product, and rows can be selected with
+  table[np_rows].
+  """
+
+  def __init__(self, np_next_sidx: np.ndarray, num_states: int):
+    """Initializes the table.
+
+    Args:
+      np_next_sidx: A numpy 1-d array of the next state index of each row.
+      num_states: the number of states, i.e., the number of columns.
+    """
+    self.np_next_sidx = np.asarray(np_next_sidx)
+    self.num_states = num_states
+    self.shape = (len(self.np_next_sidx), num_states)
+
+  def __matmul__(self, np_v_value: np.ndarray) -> np.ndarray:
+    return np.asarray(np_v_value).take(self.np_next_sidx, axis=0)
+
+  def __getitem__(self, np_rows) -> "DeterministicTransition":
+    return DeterministicTransition(self.np_next_sidx[np_rows],
+                                   self.num_states)
+
+  def tocsr(self) -> csr_matrix:
+    num_rows = len(self.np_next_sidx)
+    return csr_matrix((np.ones(num_rows), self.np_next_sidx,
+                       np.arange(num_rows + 1)),
+                      shape=self.shape)
+
+
+def compose_joint_next_states(
+    list_local_codes: Sequence[np.ndarray],
+    fn_combine: Callable[..., np.ndarray],
+    batch_size: int = 4096) -> np.ndarray:
+  """Composes the next states of joint actions from per-agent factors.
+
+  Each agent's action affects the next state only through a local code,
+  e.g., its next location and whether it works, which is tabulated per
+  (state, individual action). Interactions between agents are left to
+  fn_combine, which receives the codes of all agents broadcast over the
+  joint action space. Thus, only the per-agent tables are built by the
+  domain, with A_1 + ... + A_n entries per state instead of A_1 * ... * A_n.
+
+  Args:
+    list_local_codes: A list of numpy 2-d arrays of shape (S, A_i), the local
+      codes of each agent i.
+    fn_combine: Called as fn_combine(np_state_idx, np_code_1, ..., np_code_n)
+      with np_state_idx of shape (n, 1, ..., 1) and np_code_i broadcastable
+      to (n, A_1, ..., A_n). Returns the next state indices of that shape.
+    batch_size: Number of states processed at once.
+
+  Returns:
+    A numpy 2-d array of shape (S, A_1 * ... * A_n) of next state indices
+    ordered by the joint action index (see MDP.np_action_to_idx).
+  """
+  num_agents = len(list_local_codes)
+  num_states = list_local_codes[0].shape[0]
+  list_num_actions = [np_codes.shape[1] for np_codes in list_local_codes]
+  num_joint_actions = int(np.prod(list_num_actions))
+
+  np_next_sidx = np.empty((num_states, num_joint_actions), dtype=np.int64)
+  for idx_start in range(0, num_states, batch_size):
+    np_states = np.arange(idx_start, min(idx_start + batch_size, num_states))
+    list_codes = []
+    for i_a, np_codes in enumerate(list_local_codes):
+      # agent i_a's actions lie along axis 1 + i_a
+      shape = [len(np_states)] + [1] * num_agents
+      shape[1 + i_a] = list_num_actions[i_a]
+      list_codes.append(np_codes[np_states].reshape(shape))
+    np_batch_next = fn_combine(
+        np_states.reshape([-1] + [1] * num_agents), *list_codes)
+    np_next_sidx[np_states] = np.broadcast_to(
+        np_batch_next, [len(np_states)] + list_num_actions).reshape(
+            len(np_states), -1)
+
+  return np_next_sidx
@@ -1,5 +1,7 @@
 import abc
+from typing import Optional, Sequence
 import numpy as np
+import numpy.testing as npt
 from tqdm import tqdm
 import logging
 
@@ -13,8 +15,10 @@ class LatentMDP(MDP):
   def __init__(self,
                fast_cache_mode: bool = False,
                use_sparse: bool = False,
-               cache_file_path: str = ""):
-    super().__init__(fast_cache_mode, use_sparse, cache_file_path)
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None):
+    super().__init__(fast_cache_mode, use_sparse, cache_file_path,
+                     initial_sim_states)
 
     # Define latent state space.
     self.init_latentspace()
@@ -45,6 +49,86 @@ class LatentMDP(MDP):
     """
     raise NotImplementedError
 
+  def reward_batch(self, latent_idx: int, np_state_idx: np.ndarray,
+                   np_action_idx: np.ndarray) -> np.ndarray:
+    """Defines MDP reward function for a batch of state-action pairs.
+
+      Domains can override this method to compute the rewards of many pairs
+      at once from the factored states, e.g., with np_idx_to_state and
+      np_idx_to_action. By default, it falls back to reward.
+      Use validate_reward_batch to check an override against reward.
+
+      Args:
+        latent_idx: Index of an MDP latent.
+        np_state_idx: A numpy 1-d array of MDP state indices.
+        np_action_idx: A numpy 1-d array of MDP action indices.
+          Should have the same length as np_state_idx.
+
+      Returns:
+        A numpy 1-d array of rewards of each (state, action) pair.
+    """
+    return np.array([
+        self.reward(latent_idx, int(state), int(action))
+        for state, action in zip(np_state_idx, np_action_idx)
+    ],
+                    dtype=np.float64)
+
+  def _get_legal_pairs(self):
+    """Returns the legal (state, action) pairs and the states without any.
+
+      Returns:
+        A tuple of the state and action indices of the legal pairs as numpy
+        1-d arrays, and a boolean mask of terminal states and states without
+        legal actions.
+    """
+    np_legal = self.np_legal_action_mask & ~self.np_terminal_mask[:, None]
+    np_no_action = ~np_legal.any(axis=1)
+    np_legal_s, np_legal_a = np.nonzero(np_legal)
+    return np_legal_s, np_legal_a, np_no_action
+
+  def get_backup_action_mask(self) -> np.ndarray:
+    """Returns the (state, action) pairs that can have finite rewards.
+
+    See MDP.get_backup_action_mask. Terminal states and states without any
+    legal action keep only the first action, as in np_reward_model.
+    """
+    np_mask = self.np_legal_action_mask & ~self.np_terminal_mask[:, None]
+    np_mask[~np_mask.any(axis=1), 0] = True
+    return np_mask
+
+  def validate_reward_batch(self,
+                            num_samples: int = 1000,
+                            rng: Optional[np.random.Generator] = None):
+    """Checks reward_batch against reward at random legal pairs.
+
+      Args:
+        num_samples: Number of (latent, state, action) triples to check.
+        rng: Optional; a numpy random generator.
+
+      Raises:
+        AssertionError: if any reward differs.
+    """
+    if rng is None:
+      rng = np.random.default_rng()
+    np_legal_s, np_legal_a, _ = self._get_legal_pairs()
+    if len(np_legal_s) == 0:
+      return
+
+    np_pos = rng.integers(len(np_legal_s), size=num_samples)
+    np_latent = rng.integers(self.num_latents, size=num_samples)
+    for latent in np.unique(np_latent).tolist():
+      np_s = np_legal_s[np_pos[np_latent == latent]]
+      np_a = np_legal_a[np_pos[np_latent == latent]]
+      np_expected = np.array([
+          self.reward(latent, int(state), int(action))
+          for state, action in zip(np_s, np_a)
+      ],
+                             dtype=np.float64)
+      npt.assert_allclose(actual=self.reward_batch(latent, np_s, np_a),
+                          desired=np_expected,
+                          err_msg="reward_batch differs from reward "
+                          "at latent %d" % (latent, ))
+
   @property
   def np_reward_model(self):
     """Returns reward model as a np ndarray."""
@@ -55,20 +139,27 @@ class LatentMDP(MDP):
     if self._np_reward_model is not None:
       return self._np_reward_model
 
+    dict_cached = self._load_model_artifact("reward")
+    if (dict_cached is not None and dict_cached["reward"].shape
+        == (self.num_latents, self.num_states, self.num_actions)):
+      self._np_reward_model = dict_cached["reward"]
+      return self._np_reward_model
+
     # Else: Compute using the reward method.
     # Set -inf to unreachable states to prevent an action from falling in them
     self._np_reward_model = np.full(
         (self.num_latents, self.num_states, self.num_actions), -np.inf)
 
-    for latent in range(self.num_latents):
-      pbar = tqdm(range(self.num_states))
-      for state in pbar:
-        pbar.set_postfix(
-            {'Latent Count': str(latent + 1) + '/' + str(self.num_latents)})
-        if self.is_terminal(state) or len(self.legal_actions(state)) == 0:
-          self._np_reward_model[latent, state, 0] = 0
-        else:
-          for action in self.legal_actions(state):
-            self._np_reward_model[latent, state,
-                                  action] = self.reward(latent, state, action)
+    np_legal_s, np_legal_a, np_no_action = self._get_legal_pairs()
+    self._np_reward_model[:, np_no_action, 0] = 0
+
+    batch_size = 1 << 16
+    for latent in tqdm(range(self.num_latents)):
+      for idx_start in range(0, len(np_legal_s), batch_size):
+        np_s = np_legal_s[idx_start:idx_start + batch_size]
+        np_a = np_legal_a[idx_start:idx_start + batch_size]
+        self._np_reward_model[latent, np_s,
+                              np_a] = self.reward_batch(latent, np_s, np_a)
+
+    self._save_model_artifact("reward", reward=self._np_reward_model)
     return self._np_reward_model
@@ -1,17 +1,24 @@
 """Defines an abstract MDP class using numpy."""
 
 import abc
+import hashlib
 import os
-from typing import Optional, Tuple, Union
+import sys
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple, Union
 
 import logging
 import numpy as np
 import numpy.testing as npt
 import scipy.special as sc
+from scipy.sparse import csr_matrix
 from tqdm import tqdm
 import sparse
 
 from TMM.models.mdp.spaces import StateSpace, ActionSpace
+from TMM.models.mdp.cache import save_npz_artifact, load_npz_artifact
+from TMM.models.mdp.sampler import TransitionSampler
+from TMM.models.mdp.factored import DeterministicTransition
 
 
 class MDP:
@@ -22,14 +29,28 @@ class MDP:
   def __init__(self,
                fast_cache_mode: bool = False,
                use_sparse: bool = False,
-               cache_file_path: str = ""):
+               cache_file_path: str = "",
+               initial_sim_states: Optional[Sequence] = None):
     """Initializes MDP class.
 
       Args:
         fast_cache_mode: Enables fast caching by avoiding assertions. Note
           this should be true only after verifying the implementation is
           correct.
+        use_sparse: Stores the transition model as a sparse array.
+        cache_file_path: Directory to cache the state index table and the
+          transition and reward models. Empty string disables caching.
+        initial_sim_states: Optional. A list of initial states in the
+          simulator representation (see conv_sim_states_to_mdp_sidx).
+          If given, the state space is pruned to the states reachable from
+          them (see prune_unreachable_states).
     """
+    # Domain parameters (e.g., the map and initial positions) are set by
+    # subclasses before calling this constructor. All of them are part of
+    # the model fingerprint, as map_to_str may not cover every one of them.
+    with np.printoptions(threshold=sys.maxsize):
+      self._domain_config = repr(sorted(vars(self).items()))
+
     self.fast_cache_mode = fast_cache_mode
     self.use_sparse = use_sparse
     self.cache_file_path = cache_file_path
@@ -47,6 +68,28 @@ class MDP:
     # Users can compute them by calling the respective properties.
     self._np_transition_model = None
     self._np_reward_model = None
+    self._np_transition_csr = None
+    self._transition_sampler = None
+    self._deterministic_transition = None
+    self._model_fingerprint = None
+    self._np_terminal_mask = None
+    self._np_legal_action_mask = None
+
+    # Task MDP and teammate policy to derive the transition model from.
+    # See set_teammate_model.
+    self._task_mdp = None
+    self._np_teammate_policy = None
+    self._teammate_agent_idx = 0
+
+    # Maps between the pruned state indices and the indices over the full
+    # Cartesian product of the factored state spaces. None if not pruned.
+    self.np_sidx_to_full_sidx = None
+    self.np_full_sidx_to_sidx = None
+    if initial_sim_states is not None:
+      self.prune_unreachable_states([
+          self.conv_sim_states_to_mdp_sidx(tup_states)
+          for tup_states in initial_sim_states
+      ])
 
   @abc.abstractmethod
   def init_statespace(self):
@@ -93,9 +136,16 @@ class MDP:
     if self.cache_file_path != "":
       file_i2s = os.path.join(self.cache_file_path, "idx_to_state.npy")
       if os.path.exists(file_i2s):
-        self.np_idx_to_state = np.load(file_i2s)
-        logging.info("Loaded np_idx_to_state from file")
-        return
+        np_idx_to_state = np.load(file_i2s)
+        # the table is shared by all MDPs with the same cache directory.
+        # the shape and the last row determine the factored state space.
+        if (np_idx_to_state.shape == (self.num_actual_states,
+                                      self.num_state_factors)
+            and np.array_equal(np_idx_to_state[-1],
+                               np.array(self.list_num_states) - 1)):
+          self.np_idx_to_state = np_idx_to_state
+          logging.info("Loaded np_idx_to_state from file")
+          return
 
     # Create mapping from state index to state.
     # Mapping takes state index as input and outputs a factored state.
@@ -107,20 +157,136 @@ class MDP:
     self.np_idx_to_state = np_idx_to_state
 
     if self.cache_file_path != "":
+      os.makedirs(self.cache_file_path, exist_ok=True)
       np.save(file_i2s, self.np_idx_to_state)
       logging.info("Saved np_idx_to_state to file")
 
+  def prune_unreachable_states(self,
+                               list_init_sidx: Sequence[int],
+                               batch_size: int = 4096):
+    """Restricts the state space to the states reachable from initial states.
+
+    A breadth-first search over the transition model visits the states
+    reachable from the initial states with legal actions. Then, the state
+    indices are reassigned compactly over the reachable states, so that the
+    transition and reward models and the policies only cover them.
+    Dummy states are always kept.
+
+    After pruning, np_state_to_idx maps unreachable states to -1, on which
+    conv_state_to_idx and conv_state_to_idx_batch raise a ValueError, and
+    np_sidx_to_full_sidx / np_full_sidx_to_sidx map the new state indices
+    from / to the indices over the full factored state space.
+
+      Args:
+        list_init_sidx: Indices of the initial states.
+        batch_size: Number of (state, action) pairs passed to
+          transition_model_batch at once.
+    """
+    assert self.np_sidx_to_full_sidx is None, "The MDP is already pruned."
+    assert self._np_transition_model is None and self._np_reward_model is None
+
+    np_reached = np.zeros(self.num_states, dtype=bool)
+    np_frontier = np.unique(np.array(list_init_sidx, dtype=np.int64))
+    np_reached[np_frontier] = True
+    pbar = tqdm()
+    while len(np_frontier) > 0:
+      list_s = []
+      list_a = []
+      for state in np_frontier:
+        legal_actions = self.legal_actions(int(state))
+        list_s.append(np.full(len(legal_actions), state, dtype=np.int64))
+        list_a.append(np.array(legal_actions, dtype=np.int64))
+      np_s = np.concatenate(list_s)
+      np_a = np.concatenate(list_a)
+
+      list_next = []
+      for idx_start in range(0, len(np_s), batch_size):
+        _, np_next_s, np_next_p = self.transition_model_batch(
+            np_s[idx_start:idx_start + batch_size],
+            np_a[idx_start:idx_start + batch_size])
+        list_next.append(np_next_s[np_next_p > 0])
+
+      np_next = (np.unique(np.concatenate(list_next))
+                 if len(list_next) > 0 else np.zeros(0, dtype=np.int64))
+      np_frontier = np_next[~np_reached[np_next]]
+      np_reached[np_frontier] = True
+      pbar.update(len(np_frontier))
+      pbar.set_postfix({'reached': np_reached.sum()})
+    pbar.close()
+
+    num_full_states = self.num_actual_states
+    self.np_sidx_to_full_sidx = np.nonzero(np_reached[:num_full_states])[0]
+    self.np_full_sidx_to_sidx = np.full(num_full_states, -1, dtype=np.int32)
+    self.np_full_sidx_to_sidx[self.np_sidx_to_full_sidx] = np.arange(
+        len(self.np_sidx_to_full_sidx))
+
+    self.np_state_to_idx = self.np_full_sidx_to_sidx[self.np_state_to_idx]
+    self.np_idx_to_state = self.np_idx_to_state[self.np_sidx_to_full_sidx]
+    self.num_actual_states = len(self.np_sidx_to_full_sidx)
+    self.num_states = self.num_actual_states + self.num_dummy_states
+    self._model_fingerprint = None
+    self._np_terminal_mask = None
+    self._np_legal_action_mask = None
+    self._deterministic_transition = None
+    logging.info("Pruned the state space from %d to %d states" %
+                 (num_full_states, self.num_actual_states))
+
   def is_dummy_state(self, idx: int):
     """check if it's dummy state or not"""
     return idx >= self.num_actual_states and idx < self.num_states
 
   def conv_state_to_idx(self, tuple_state: Tuple[int, ...]):
-    return self.np_state_to_idx[tuple_state]
+    sidx = self.np_state_to_idx[tuple_state]
+    if sidx < 0:
+      raise ValueError("The state %s has been pruned as unreachable" %
+                       (tuple_state, ))
+    return sidx
 
   def conv_idx_to_state(self, idx: int):
     assert idx < self.num_actual_states, "state index is out of range"
     return self.np_idx_to_state[idx]
 
+  def conv_state_to_idx_batch(self, np_states: np.ndarray) -> np.ndarray:
+    """Converts factored states into state indices.
+
+      Args:
+        np_states: A numpy 2-d array of factored states. Each row corresponds
+          to a factored state. Dummy states are not supported.
+
+      Returns:
+        A numpy 1-d array of state indices.
+
+      Raises:
+        ValueError: if the state space is pruned and some of the states are
+          unreachable.
+    """
+    np_states = np.asarray(np_states)
+    np_full_sidx = np.ravel_multi_index(tuple(np_states.T),
+                                        self.list_num_states)
+    if self.np_full_sidx_to_sidx is not None:
+      np_sidx = self.np_full_sidx_to_sidx[np_full_sidx]
+      if np.any(np_sidx < 0):
+        raise ValueError("Some of the states have been pruned as unreachable")
+      return np_sidx
+    return np_full_sidx
+
+  def conv_idx_to_state_batch(self, np_idx: np.ndarray) -> np.ndarray:
+    """Converts state indices into factored states.
+
+      Args:
+        np_idx: A numpy 1-d array of state indices. Dummy states are not
+          supported.
+
+      Returns:
+        A numpy 2-d array of factored states. Each row corresponds to a state.
+    """
+    np_idx = np.asarray(np_idx)
+    assert np.all(np_idx < self.num_actual_states), (
+        "state index is out of range")
+    if self.np_sidx_to_full_sidx is not None:
+      np_idx = self.np_sidx_to_full_sidx[np_idx]
+    return np.stack(np.unravel_index(np_idx, self.list_num_states), axis=-1)
+
   def conv_idx_to_dummy_state(self, idx: int):
     assert (idx >= self.num_actual_states
             and idx < self.num_states), ("dummy state index is out of range")
@@ -150,6 +316,23 @@ class MDP:
   def conv_mdp_sidx_to_sim_states(self, state_idx):
     raise NotImplementedError
 
+  def conv_sim_states_to_mdp_sidx_batch(self, tup_states) -> np.ndarray:
+    '''
+    Optional. Implement if needed.
+    Batch version of conv_sim_states_to_mdp_sidx. Each element of tup_states
+    is an array whose first dimension is the batch. Simulator objects are
+    given as their integer encodings defined by each domain.
+    '''
+    raise NotImplementedError
+
+  def conv_mdp_sidx_to_sim_states_batch(self, np_state_idx: np.ndarray):
+    '''
+    Optional. Implement if needed.
+    Batch version of conv_mdp_sidx_to_sim_states. Returns the inverse of
+    conv_sim_states_to_mdp_sidx_batch.
+    '''
+    raise NotImplementedError
+
   @abc.abstractmethod
   def conv_mdp_aidx_to_sim_actions(self, action_idx):
     raise NotImplementedError
@@ -204,6 +387,136 @@ class MDP:
   def conv_idx_to_action(self, idx: int):
     return self.np_idx_to_action[idx]
 
+  def conv_action_to_idx_batch(self, np_actions: np.ndarray) -> np.ndarray:
+    """Converts factored actions (one per row) into action indices."""
+    np_actions = np.asarray(np_actions)
+    return np.ravel_multi_index(tuple(np_actions.T), self.list_num_actions)
+
+  def conv_idx_to_action_batch(self, np_idx: np.ndarray) -> np.ndarray:
+    """Converts action indices into factored actions (one per row)."""
+    return np.stack(np.unravel_index(np.asarray(np_idx),
+                                     self.list_num_actions),
+                    axis=-1)
+
+  def map_to_str(self) -> str:
+    """Returns a string that identifies the map (layout) of this MDP.
+
+    Optional. Implement if needed. The transition and reward models are cached
+    on disk only if this method is implemented.
+    """
+    raise NotImplementedError
+
+  def get_source_files(self) -> Sequence[str]:
+    """Returns the source files of the code that defines this MDP.
+
+    Starting from the modules of this MDP class and its base classes, every
+    module they refer to (imported modules, or modules of imported functions,
+    classes and objects) within the same top-level package is collected
+    recursively. For example, the transition functions that a domain imports
+    from a sibling module are covered. Modules of other top-level packages
+    (e.g., numpy) are not.
+    """
+    list_stack = [
+        cls.__module__ for cls in type(self).__mro__ if issubclass(cls, MDP)
+    ]
+    set_top_packages = set(name.split(".")[0] for name in list_stack)
+
+    def is_project_module(name):
+      return isinstance(name, str) and name.split(".")[0] in set_top_packages
+
+    dict_files = {}
+    while list_stack:
+      module_name = list_stack.pop()
+      module = sys.modules.get(module_name)
+      if module_name in dict_files or module is None:
+        continue
+      dict_files[module_name] = getattr(module, "__file__", None)
+      for value in list(vars(module).values()):
+        if isinstance(value, type(sys)):
+          dep_name = value.__name__
+          # submodules become attributes of a package whenever anything
+          # imports them. follow only what the package itself imports.
+          if dep_name.startswith(module_name + "."):
+            continue
+        else:
+          dep_name = getattr(value, "__module__", None)
+        if is_project_module(dep_name) and dep_name not in dict_files:
+          list_stack.append(dep_name)
+
+    return [
+        os.path.abspath(dict_files[name])
+        for name in sorted(dict_files)
+        if dict_files[name] is not None
+    ]
+
+  def get_model_fingerprint(self) -> str:
+    """Returns a fingerprint of the code and the configuration of this MDP.
+
+    The source files of the modules defining this MDP (see get_source_files)
+    are hashed, so that cached models are invalidated whenever the code that
+    generates them changes. The domain parameters given to the constructor
+    and the state space are hashed as well.
+    """
+    if self._model_fingerprint is not None:
+      return self._model_fingerprint
+
+    hasher = hashlib.sha1()
+    hasher.update(self._domain_config.encode())
+    hasher.update(
+        str((self.list_num_states, self.num_states,
+             self.list_num_actions)).encode())
+    if self.np_sidx_to_full_sidx is not None:
+      hasher.update(self.np_sidx_to_full_sidx.astype(np.int64).tobytes())
+    for file_name in self.get_source_files():
+      with open(file_name, "rb") as file:
+        hasher.update(file.read())
+
+    self._model_fingerprint = hasher.hexdigest()[:16]
+    return self._model_fingerprint
+
+  def get_cache_key(self) -> Optional[str]:
+    """Returns the key of the cached models of this MDP.
+
+      Returns:
+        A string composed of the class name, the map string and the model
+        fingerprint, which covers all domain parameters. None if caching is
+        disabled or not supported.
+    """
+    if self.cache_file_path == "":
+      return None
+
+    try:
+      str_map = self.map_to_str()
+    except NotImplementedError:
+      return None
+
+    return "%s_%s_%s" % (type(self).__name__, str_map,
+                         self.get_model_fingerprint())
+
+  def _load_model_artifact(self, name: str) -> Optional[Dict[str, np.ndarray]]:
+    """Loads a memory-mapped model artifact from the cache directory."""
+    cache_key = self.get_cache_key()
+    if cache_key is None:
+      return None
+
+    file_path = os.path.join(self.cache_file_path,
+                             cache_key + "_" + name + ".npz")
+    dict_arrays = load_npz_artifact(file_path)
+    if dict_arrays is not None:
+      logging.info("Loaded %s model from %s" % (name, file_path))
+    return dict_arrays
+
+  def _save_model_artifact(self, name: str, **arrays: np.ndarray) -> None:
+    """Saves a model artifact to the cache directory."""
+    cache_key = self.get_cache_key()
+    if cache_key is None:
+      return
+
+    file_path = os.path.join(self.cache_file_path,
+                             cache_key + "_" + name + ".npz")
+    save_npz_artifact(file_path, **arrays)
+    logging.info("Saved %s model to %s" % (name, file_path))
+
   @abc.abstractmethod
   def transition_model(self, state_idx: int, action_idx: int) -> np.ndarray:
     """Defines MDP transition function.
@@ -220,6 +533,232 @@ class MDP:
     raise NotImplementedError
     return np_next_p_state_idx  # noqa: F821
 
+  def transition_model_batch(
+      self, np_state_idx: np.ndarray,
+      np_action_idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Defines MDP transition function for a batch of state-action pairs.
+
+      Domains can override this method to compute the transitions of many
+      pairs at once. By default, it falls back to transition_model.
+
+      Args:
+        np_state_idx: A numpy 1-d array of MDP state indices.
+        np_action_idx: A numpy 1-d array of MDP action indices.
+          Should have the same length as np_state_idx.
+
+      Returns:
+        A tuple of three numpy 1-d arrays of the same length.
+        The first array corresponds to the position of each (state, action)
+        pair in the input arrays. The second array corresponds to the index of
+        the next state and the third one to its probability.
+    """
+    # per-pair work is kept to the call itself. the outputs are split into
+    # columns once for the whole batch.
+    list_next_p_state_idx = [
+        self.transition_model(state, action) for state, action in zip(
+            np.asarray(np_state_idx).tolist(),
+            np.asarray(np_action_idx).tolist())
+    ]
+    if len(list_next_p_state_idx) == 0:
+      return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+              np.zeros(0))
+
+    np_num_next = np.fromiter(map(len, list_next_p_state_idx),
+                              dtype=np.int64,
+                              count=len(list_next_p_state_idx))
+    np_next_p_state_idx = np.concatenate(list_next_p_state_idx)
+    return (np.repeat(np.arange(len(np_num_next)), np_num_next),
+            np_next_p_state_idx[:, 1].astype(np.int64),
+            np_next_p_state_idx[:, 0].astype(np.float64))
+
+  def _compute_transition_coords(self, batch_size: int = 4096):
+    """Computes the nonzero entries of the transition model.
+
+      For illegal actions and terminal states, the transition remains at the
+      same state.
+
+      Args:
+        batch_size: Number of (state, action) pairs passed to
+          transition_model_batch at once.
+
+      Returns:
+        A tuple of four numpy 1-d arrays: state indices, action indices,
+        next state indices and probabilities. Duplicated coordinates, if any,
+        should be summed up.
+    """
+    table = self.deterministic_transition
+    if table is not None:
+      np_rows = np.arange(self.num_states * self.num_actions)
+      return (np_rows // self.num_actions, np_rows % self.num_actions,
+              table.np_next_sidx.astype(np.int64), np.ones(len(np_rows)))
+
+    task_mdp = self._task_mdp
+    if task_mdp is None:
+      task_mdp = self.create_task_mdp()
+    if task_mdp is not None:
+      np_coo = self._compute_teammate_marginal_csr(task_mdp,
+                                                   batch_size).tocoo()
+      return (np_coo.row // self.num_actions, np_coo.row % self.num_actions,
+              np_coo.col.astype(np.int64), np_coo.data)
+
+    np_legal = self.np_legal_action_mask
+    np_illegal_s, np_illegal_a = np.nonzero(~np_legal)
+    np_legal_s, np_legal_a = np.nonzero(np_legal)
+
+    list_batch = []
+    num_legal_entries = 0
+    for idx_start in tqdm(range(0, len(np_legal_s), batch_size)):
+      np_s = np_legal_s[idx_start:idx_start + batch_size]
+      np_a = np_legal_a[idx_start:idx_start + batch_size]
+      np_pos, np_next_s, np_next_p = self.transition_model_batch(np_s, np_a)
+      list_batch.append((np_s[np_pos], np_a[np_pos], np_next_s, np_next_p))
+      num_legal_entries += len(np_pos)
+
+    # assemble all entries into preallocated buffers
+    num_illegal = len(np_illegal_s)
+    num_entries = num_illegal + num_legal_entries
+    np_coord_s = np.empty(num_entries, dtype=np.int64)
+    np_coord_a = np.empty(num_entries, dtype=np.int64)
+    np_coord_sn = np.empty(num_entries, dtype=np.int64)
+    np_data = np.empty(num_entries, dtype=np.float64)
+
+    np_coord_s[:num_illegal] = np_illegal_s
+    np_coord_a[:num_illegal] = np_illegal_a
+    np_coord_sn[:num_illegal] = np_illegal_s
+    np_data[:num_illegal] = 1
+
+    idx_start = num_illegal
+    for np_s, np_a, np_next_s, np_next_p in list_batch:
+      idx_end = idx_start + len(np_s)
+      np_coord_s[idx_start:idx_end] = np_s
+      np_coord_a[idx_start:idx_end] = np_a
+      np_coord_sn[idx_start:idx_end] = np_next_s
+      np_data[idx_start:idx_end] = np_next_p
+      idx_start = idx_end
+
+    return np_coord_s, np_coord_a, np_coord_sn, np_data
+
+  def create_task_mdp(self) -> Optional["MDP"]:
+    """Creates the task MDP whose joint actions this MDP marginalizes.
+
+      Agent MDPs of multi-agent domains can override this method so that
+      their transition models are derived from the task MDP with uniform
+      teammate policies (see set_teammate_model). By default, it returns None.
+
+      Returns:
+        An MDP over the same factored state space or None.
+    """
+    return None
+
+  def set_teammate_model(self,
+                         task_mdp: Optional["MDP"] = None,
+                         np_teammate_policy: Optional[np.ndarray] = None,
+                         agent_idx: int = 0):
+    """Derives the transition model from a task MDP and a teammate policy.
+
+      The transition of an agent marginalizes the joint actions of the task
+      MDP over the actions of its teammates:
+        T(s, a, s') = sum_m pi(m | s) T_task(s, (a, m), s'),
+      where m is the joint action of the teammates. It is computed as a single
+      sparse product of the policy and the task transitions. The previously
+      computed transition model, if any, is discarded.
+
+      Args:
+        task_mdp: Optional. An MDP over the same factored state space whose
+          action factor agent_idx is the action of this MDP. If None,
+          create_task_mdp is used.
+        np_teammate_policy: Optional. Probabilities of the joint actions of
+          the teammates as a numpy array of shape (num_states, M) or (M, ),
+          where M is the product of the numbers of actions of the teammates
+          and the joint index follows the order of the other action factors
+          of task_mdp. If None, teammates choose actions uniformly. The
+          transition model is not cached to files if given.
+        agent_idx: The action factor of task_mdp taken by this agent.
+    """
+    self._task_mdp = task_mdp
+    self._np_teammate_policy = (None if np_teammate_policy is None else
+                                np.asarray(np_teammate_policy))
+    self._teammate_agent_idx = agent_idx
+    self._np_transition_model = None
+    self._np_transition_csr = None
+    self._transition_sampler = None
+
+  def _compute_teammate_marginal_csr(self,
+                                     task_mdp: "MDP",
+                                     batch_size: int = 4096) -> csr_matrix:
+    """Computes the transition model of set_teammate_model.
+
+      For illegal actions and terminal states, the transition remains at the
+      same state as in _compute_transition_coords.
+
+      Returns:
+        A (S*A) x S csr matrix (see np_transition_csr).
+    """
+    num_actions = self.num_actions
+    agent_idx = self._teammate_agent_idx
+    assert task_mdp.list_num_actions[agent_idx] == num_actions
+
+    # joint action indices of the task MDP by (my action, teammate action)
+    np_joint_aidx = np.moveaxis(task_mdp.np_action_to_idx, agent_idx,
+                                0).reshape(num_actions, -1)
+    num_mate_actions = np_joint_aidx.shape[1]
+    if self._np_teammate_policy is None:
+      np_mate_policy = np.full(num_mate_actions, 1. / num_mate_actions)
+    else:
+      np_mate_policy = self._np_teammate_policy
+    np_mate_policy = np.broadcast_to(np_mate_policy,
+                                     (self.num_states, num_mate_actions))
+
+    # state indices are converted through the factored states, so the task
+    # MDP can be pruned differently as long as it covers the states of this
+    # MDP and their next states (see prune_unreachable_states)
+    np_task_sidx = task_mdp.np_state_to_idx[tuple(self.np_idx_to_state.T)]
+    np_my_sidx = self.np_state_to_idx[tuple(task_mdp.np_idx_to_state.T)]
+
+    np_active = self.np_legal_action_mask & ~self.np_terminal_mask[:, None]
+    np_active[self.num_actual_states:] = False
+    np_s, np_a = np.nonzero(np_active)
+    num_pairs = len(np_s)
+
+    # transitions of the task MDP for every teammate action of each pair
+    np_joint_s = np.repeat(np_task_sidx[np_s], num_mate_actions)
+    np_joint_a = np_joint_aidx[np_a].reshape(-1)
+    list_rows = []
+    list_next = []
+    list_prob = []
+    for idx_start in tqdm(range(0, len(np_joint_s), batch_size)):
+      np_pos, np_next_s, np_next_p = task_mdp.transition_model_batch(
+          np_joint_s[idx_start:idx_start + batch_size],
+          np_joint_a[idx_start:idx_start + batch_size])
+      list_rows.append(np_pos + idx_start)
+      list_next.append(np_my_sidx[np_next_s])
+      list_prob.append(np_next_p)
+    np_joint_csr = csr_matrix(
+        (np.concatenate(list_prob + [np.zeros(0)]),
+         (np.concatenate(list_rows + [np.zeros(0, dtype=np.int64)]),
+          np.concatenate(list_next + [np.zeros(0, dtype=np.int64)]))),
+        shape=(len(np_joint_s), self.num_states))
+
+    # contract the teammate actions with their policy
+    np_policy_csr = csr_matrix(
+        (np_mate_policy[np_s].reshape(-1), np.arange(len(np_joint_s)),
+         np.arange(0, len(np_joint_s) + 1, num_mate_actions)),
+        shape=(num_pairs, len(np_joint_s)))
+    np_pair_coo = (np_policy_csr @ np_joint_csr).tocoo()
+
+    # illegal actions and terminal states stay at the same state
+    np_pair_row = np.flatnonzero(np_active.reshape(-1))
+    np_inactive_row = np.flatnonzero(~np_active.reshape(-1))
+    np_csr = csr_matrix(
+        (np.concatenate([np_pair_coo.data,
+                         np.ones(len(np_inactive_row))]),
+         (np.concatenate([np_pair_row[np_pair_coo.row], np_inactive_row]),
+          np.concatenate([np_pair_coo.col,
+                          np_inactive_row // num_actions]))),
+        shape=(self.num_states * num_actions, self.num_states))
+    np_csr.sum_duplicates()
+    return np_csr
+
   @property
   def np_transition_model(self) -> np.ndarray:
     """Returns transition model as a np ndarray."""
@@ -229,63 +768,150 @@ class MDP:
     if self._np_transition_model is not None:
       return self._np_transition_model
 
+    shape = (self.num_states, self.num_actions, self.num_states)
+    # the transition model derived from a given teammate policy is not cached
+    use_cache = self._np_teammate_policy is None
+    dict_cached = self._load_model_artifact("transition") if use_cache else None
+    if dict_cached is not None and tuple(dict_cached["shape"]) == shape:
+      if self.use_sparse:
+        self._np_transition_model = sparse.COO(dict_cached["coords"],
+                                               dict_cached["data"],
+                                               shape=shape,
+                                               has_duplicates=False,
+                                               sorted=True)
+      else:
+        self._np_transition_model = np.zeros(shape, dtype=np.float32)
+        self._np_transition_model[tuple(
+            dict_cached["coords"])] = dict_cached["data"]
+      return self._np_transition_model
+
+    # Else: Compute using the transition model.
+    (np_coord_s, np_coord_a, np_coord_sn,
+     np_data) = self._compute_transition_coords()
+
     if not self.use_sparse:
       logging.debug("Transition model type: numpy array")
-      # Else: Compute using the transition model.
-      self._np_transition_model = np.zeros(
-          (self.num_states, self.num_actions, self.num_states),
-          dtype=np.float32)
-      for state in tqdm(range(self.num_states)):
-        # for illegal actions and termial states,
-        # the transition should remain at the same state
-        self._np_transition_model[state, :, state] = np.ones(
-            (self.num_actions, ))
-        for action in self.legal_actions(state):
-          self._np_transition_model[state, action, state] = 0
-          np_next_p_state_idx = self.transition_model(state, action)
-          if self.fast_cache_mode:
-            self._np_transition_model[state, action,
-                                      tuple(np_next_p_state_idx[:,
-                                                                1].astype(int)
-                                            )] = (np_next_p_state_idx[:, 0])
-          else:
-            for (next_p, next_state) in np_next_p_state_idx:
-              next_state = int(next_state)
-              self._np_transition_model[state, action, next_state] = next_p
-            npt.assert_almost_equal(
-                actual=self._np_transition_model[state, action].sum(),
-                desired=1,
-                decimal=7,
-                err_msg="Transition probabilities do not sum to one.",
-            )
+      self._np_transition_model = np.zeros(shape, dtype=np.float32)
+      np.add.at(self._np_transition_model,
+                (np_coord_s, np_coord_a, np_coord_sn), np_data)
+      if not self.fast_cache_mode:
+        npt.assert_almost_equal(
+            actual=self._np_transition_model.sum(axis=-1),
+            desired=np.ones((self.num_states, self.num_actions)),
+            decimal=7,
+            err_msg="Transition probabilities do not sum to one.",
+        )
     else:
       logging.debug("Transition model type: Sparse")
-      # coord_2_data = {
-      #     (self.num_states - 1, self.num_actions - 1, self.num_states - 1): 0
-      # }
-      coord_2_data = {}
-      for state in tqdm(range(self.num_states)):
-        # for illegal actions and termial states,
-        # the transition should remain at the same state
-        for action in range(self.num_actions):
-          coord_2_data[(state, action, state)] = 1
-
-        for action in self.legal_actions(state):
-          coord_2_data[(state, action, state)] = 0
-          np_next_p_state_idx = self.transition_model(state, action)
-
-          for (next_p, next_state) in np_next_p_state_idx:
-            next_state = int(next_state)
-            coord_2_data[(state, action, next_state)] = np.float32(next_p)
-
-      self._np_transition_model = sparse.COO.from_iter(coord_2_data,
-                                                       shape=(self.num_states,
-                                                              self.num_actions,
-                                                              self.num_states),
-                                                       dtype=np.float32)
+      self._np_transition_model = sparse.COO(
+          np.stack([np_coord_s, np_coord_a, np_coord_sn]),
+          np_data.astype(np.float32),
+          shape=shape,
+          has_duplicates=True)
+
+    if self.use_sparse:
+      np_coords = self._np_transition_model.coords
+      np_data = self._np_transition_model.data
+    else:
+      np_coords = np.array(np.nonzero(self._np_transition_model))
+      np_data = self._np_transition_model[tuple(np_coords)]
+    if use_cache:
+      self._save_model_artifact("transition",
+                                coords=np_coords,
+                                data=np_data,
+                                shape=np.array(shape))
 
     return self._np_transition_model
 
+  @property
+  def np_transition_csr(self) -> csr_matrix:
+    """Returns transition model as a (S*A) x S scipy csr matrix.
+
+    The row of a (state, action) pair is state * num_actions + action.
+    With this representation, a Bellman backup is a single sparse
+    matrix-vector product.
+    """
+    if self._np_transition_csr is not None:
+      return self._np_transition_csr
+
+    num_rows = self.num_states * self.num_actions
+    np_transition = self.np_transition_model
+    if isinstance(np_transition, sparse.COO):
+      np_coord_s, np_coord_a, np_coord_sn = np_transition.coords
+      np_data = np_transition.data
+    else:
+      np_coord_s, np_coord_a, np_coord_sn = np.nonzero(np_transition)
+      np_data = np_transition[np_coord_s, np_coord_a, np_coord_sn]
+
+    # coordinates are sorted lexicographically, so are the rows.
+    np_rows = np_coord_s * self.num_actions + np_coord_a
+    np_indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np_rows, minlength=num_rows), out=np_indptr[1:])
+    # use double precision to avoid casting at every matrix-vector product
+    self._np_transition_csr = csr_matrix(
+        (np.asarray(np_data, dtype=np.float64), np.asarray(np_coord_sn),
+         np_indptr),
+        shape=(num_rows, self.num_states))
+    return self._np_transition_csr
+
+  def compute_deterministic_next_states(self) -> Optional[np.ndarray]:
+    """Computes the next state of every (state, action) pair at once.
+
+      Domains with deterministic transitions can override this method to
+      build the next states from per-agent factors of the joint action (see
+      factored.compose_joint_next_states) without enumerating the joint
+      actions one by one. For illegal actions and terminal states, the next
+      state should be the state itself as in np_transition_model.
+      By default, it returns None. Only the rescue_v2 task MDP overrides it.
+      The table speeds up building the model and the backup product, but
+      the max of a backup still visits every joint action.
+
+      Returns:
+        A numpy 2-d array of shape (num_states, num_actions) of next state
+        indices or None.
+    """
+    return None
+
+  @property
+  def deterministic_transition(self) -> Optional[DeterministicTransition]:
+    """Returns the next-state table of a deterministic MDP or None.
+
+    See compute_deterministic_next_states.
+    """
+    if self._deterministic_transition is None:
+      np_next_sidx = self.compute_deterministic_next_states()
+      if np_next_sidx is None:
+        return None
+      self._deterministic_transition = DeterministicTransition(
+          np_next_sidx.reshape(-1), self.num_states)
+    return self._deterministic_transition
+
+  @property
+  def backup_transition_model(
+      self) -> Union[DeterministicTransition, csr_matrix]:
+    """Returns the cheapest transition model for Bellman backups.
+
+    The next-state table if the MDP is deterministic (see
+    deterministic_transition), otherwise np_transition_csr. Both can be passed
+    to algs.value_iteration and value_iteration_batched.
+    """
+    table = self.deterministic_transition
+    if table is not None:
+      return table
+    return self.np_transition_csr
+
+  @property
+  def transition_sampler(self) -> TransitionSampler:
+    """Returns a sampler of next states precompiled from np_transition_csr.
+
+    Sampling with it costs a binary search instead of evaluating
+    transition_model.
+    """
+    if self._transition_sampler is None:
+      self._transition_sampler = TransitionSampler(self.np_transition_csr,
+                                                   self.num_actions)
+    return self._transition_sampler
+
   def transition(self, state_idx: int, action_idx: int) -> int:
     """Samples next state using the MDP transition function / model.
 
@@ -322,22 +948,29 @@ class MDP:
     if self._np_reward_model is not None:
       return self._np_reward_model
 
+    dict_cached = self._load_model_artifact("reward")
+    if (dict_cached is not None and dict_cached["reward"].shape
+        == (self.num_states, self.num_actions)):
+      self._np_reward_model = dict_cached["reward"]
+      return self._np_reward_model
+
     # Else: Compute using the reward method.
     # Set -inf to unreachable states to prevent an action from falling in them
     # Perhaps, we need to switch -inf to a large negative number later
     # numpy.nan_to_num() can be an option
     self._np_reward_model = np.full((self.num_states, self.num_actions),
                                     -np.inf)
-    for state in tqdm(range(self.num_states)):
-      if self.is_terminal(state):
-        # there is no valid action at the terminal state
-        # but set them to have 0 reward
-        # in order to make planning algorithms work
-        self._np_reward_model[state, :] = 0
-      else:
-        # for action in range(self.num_actions):
-        for action in self.legal_actions(state):
-          self._np_reward_model[state, action] = self.reward(state, action)
+    # there is no valid action at the terminal state
+    # but set them to have 0 reward
+    # in order to make planning algorithms work
+    self._np_reward_model[self.np_terminal_mask, :] = 0
+    np_legal_s, np_legal_a = np.nonzero(self.np_legal_action_mask &
+                                        ~self.np_terminal_mask[:, None])
+    for state, action in tqdm(zip(np_legal_s.tolist(), np_legal_a.tolist()),
+                              total=len(np_legal_s)):
+      self._np_reward_model[state, action] = self.reward(state, action)
+
+    self._save_model_artifact("reward", reward=self._np_reward_model)
     return self._np_reward_model
 
   @abc.abstractmethod
@@ -362,6 +995,205 @@ class MDP:
     """
     return list(range(self.num_actions))
 
+  def is_terminal_batch(self, np_state_idx: np.ndarray) -> np.ndarray:
+    """Checks whether states are terminal.
+
+      Domains can override this method to decode many states at once.
+      By default, it falls back to is_terminal.
+
+      Args:
+        np_state_idx: A numpy 1-d array of MDP state indices.
+
+      Returns:
+        A numpy 1-d boolean array.
+    """
+    return np.array([self.is_terminal(int(state)) for state in np_state_idx],
+                    dtype=bool)
+
+  def legal_action_mask_batch(self, np_state_idx: np.ndarray) -> np.ndarray:
+    """Returns the legal actions of states as a boolean mask.
+
+      Domains can override this method to decode many states at once.
+      By default, it falls back to legal_actions.
+
+      Args:
+        np_state_idx: A numpy 1-d array of MDP state indices.
+
+      Returns:
+        A numpy 2-d boolean array of shape (len(np_state_idx), num_actions).
+    """
+    np_mask = np.zeros((len(np_state_idx), self.num_actions), dtype=bool)
+    for pos, state in enumerate(np_state_idx):
+      np_mask[pos, self.legal_actions(int(state))] = True
+    return np_mask
+
+  def _compute_masks(self, batch_size: int = 4096):
+    """Computes and caches the terminal state and legal action masks."""
+    dict_cached = self._load_model_artifact("masks")
+    if (dict_cached is not None
+        and dict_cached["terminal"].shape == (self.num_states, )):
+      self._np_terminal_mask = np.asarray(dict_cached["terminal"], dtype=bool)
+      self._np_legal_action_mask = np.unpackbits(
+          dict_cached["legal_packed"], axis=1,
+          count=self.num_actions).astype(bool)
+      return
+
+    np_terminal = np.zeros(self.num_states, dtype=bool)
+    np_legal = np.zeros((self.num_states, self.num_actions), dtype=bool)
+    for idx_start in tqdm(range(0, self.num_states, batch_size)):
+      np_states = np.arange(idx_start,
+                            min(idx_start + batch_size, self.num_states))
+      np_terminal[np_states] = self.is_terminal_batch(np_states)
+      np_legal[np_states] = self.legal_action_mask_batch(np_states)
+
+    self._np_terminal_mask = np_terminal
+    self._np_legal_action_mask = np_legal
+    self._save_model_artifact("masks",
+                              terminal=np_terminal,
+                              legal_packed=np.packbits(np_legal, axis=1))
+
+  @property
+  def np_terminal_mask(self) -> np.ndarray:
+    """Returns a boolean array of shape (num_states, ) of terminal states."""
+    if self._np_terminal_mask is None:
+      self._compute_masks()
+    return self._np_terminal_mask
+
+  @property
+  def np_legal_action_mask(self) -> np.ndarray:
+    """Returns a boolean array of shape (num_states, num_actions).
+
+    An entry is True if the action is in legal_actions of the state.
+    """
+    if self._np_legal_action_mask is None:
+      self._compute_masks()
+    return self._np_legal_action_mask
+
+  def get_backup_action_mask(self) -> np.ndarray:
+    """Returns the (state, action) pairs that can have finite rewards.
+
+    The Q values of the other pairs are -inf in np_reward_model, so Bellman
+    backups can skip them (see algs.value_iteration). Every state keeps at
+    least one action.
+    """
+    np_mask = self.np_legal_action_mask.copy()
+    np_mask[self.np_terminal_mask, :] = True
+    np_mask[~np_mask.any(axis=1), 0] = True
+    return np_mask
+
+
+class ActionMaskLayout:
+  """Compact layout of Q values over the allowed (state, action) pairs.
+
+  Instead of a (S, A) array with -inf at illegal actions, Q values are
+  stored as a 1-d array of the allowed pairs in the order of state and then
+  action, i.e., each state owns a contiguous segment. Maximum, argmax and
+  softmax over actions are computed per segment, and the transition model
+  restricted to the same pairs gives backups directly in this layout.
+  Leading dimensions (e.g., latent states) are broadcast.
+  """
+
+  def __init__(self, action_mask: np.ndarray):
+    """Initializes the layout.
+
+    Args:
+      action_mask: A boolean numpy 2-d array of shape (S, A) (see
+        MDP.get_backup_action_mask). Every state should have at least one
+        allowed action.
+    """
+    action_mask = np.asarray(action_mask, dtype=bool)
+    assert action_mask.any(axis=1).all(), (
+        "Every state should have at least one allowed action.")
+    self.num_states, self.num_actions = action_mask.shape
+    self.np_flat_idx = np.flatnonzero(action_mask)
+    self.num_pairs = len(self.np_flat_idx)
+    self.np_pair_state = self.np_flat_idx // self.num_actions
+    self.np_pair_action = self.np_flat_idx % self.num_actions
+    self.np_seg_start = np.concatenate(
+        ([0], np.cumsum(action_mask.sum(axis=1))[:-1]))
+
+  def get_transition_rows(
+      self, transition_model: Union[np.ndarray, sparse.COO, csr_matrix,
+                                    DeterministicTransition]):
+    """Returns the P x S transitions of the allowed pairs.
+
+    A DeterministicTransition stays a next-state table. Other models become
+    a csr matrix.
+
+    Args:
+      transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+        array, a (S*A) x S csr matrix (see MDP.np_transition_csr) or a
+        DeterministicTransition.
+    """
+    if isinstance(transition_model, DeterministicTransition):
+      return transition_model[self.np_flat_idx]
+    if not isinstance(transition_model, csr_matrix):
+      shape_2d = (self.num_states * self.num_actions, self.num_states)
+      if isinstance(transition_model, sparse.COO):
+        transition_model = transition_model.reshape(shape_2d).tocsr()
+      else:
+        transition_model = csr_matrix(np.reshape(transition_model, shape_2d))
+    return transition_model[self.np_flat_idx]
+
+  def compact(self, dense: np.ndarray) -> np.ndarray:
+    """Converts (..., S, A) values into the (..., P) layout."""
+    dense = np.asarray(dense)
+    return dense.reshape(dense.shape[:-2] + (-1, ))[..., self.np_flat_idx]
+
+  def expand(self, compact: np.ndarray, fill_value: float = -np.inf):
+    """Converts (..., P) values into (..., S, A) filling the other pairs."""
+    compact = np.asarray(compact)
+    dense = np.full(compact.shape[:-1] + (self.num_states * self.num_actions, ),
+                    fill_value,
+                    dtype=np.result_type(compact, fill_value))
+    dense[..., self.np_flat_idx] = compact
+    return dense.reshape(compact.shape[:-1] +
+                         (self.num_states, self.num_actions))
+
+  def segment_max(self, compact: np.ndarray) -> np.ndarray:
+    """Returns the (..., S) maximum over the allowed actions of each state."""
+    return np.maximum.reduceat(compact, self.np_seg_start, axis=-1)
+
+  def segment_sum(self, compact: np.ndarray) -> np.ndarray:
+    """Returns the (..., S) sum over the allowed actions of each state."""
+    return np.add.reduceat(compact, self.np_seg_start, axis=-1)
+
+  def segment_argmax(self, compact: np.ndarray) -> np.ndarray:
+    """Returns the (..., S) action indices of the maximum of each state.
+
+    Ties are broken toward the smallest action index as in np.argmax.
+    """
+    np_max = self.segment_max(compact)
+    np_pos = np.where(compact == np_max[..., self.np_pair_state],
+                      np.arange(self.num_pairs), self.num_pairs)
+    np_first = np.minimum.reduceat(np_pos, self.np_seg_start, axis=-1)
+    return self.np_pair_action[np.minimum(np_first, self.num_pairs - 1)]
+
+  def softmax(self, compact: np.ndarray, temperature: float = 1.):
+    """Returns the softmax over the allowed actions of each state.
+
+    Args:
+      compact: Q values in the (..., P) layout.
+      temperature: The temperature parameters while computing the softmax.
+        If 0, all the probability is put on the argmax.
+
+    Returns:
+      probability of each allowed pair in the (..., P) layout.
+    """
+    compact = np.asarray(compact, dtype=np.float64)
+    if temperature == 0:
+      np_argmax = self.segment_argmax(compact)
+      return (self.np_pair_action == np_argmax[..., self.np_pair_state]).astype(
+          np.float64)
+
+    np_max = self.segment_max(compact)
+    with np.errstate(invalid="ignore"):
+      np_exp = np.exp(
+          (compact - np_max[..., self.np_pair_state]) / temperature)
+    # a state whose allowed pairs are all -inf gets a uniform distribution
+    np_exp[np.isnan(np_exp)] = 1.
+    return np_exp / self.segment_sum(np_exp)[..., self.np_pair_state]
+
 
 def v_value_from_q_value(q_value: np.ndarray) -> np.ndarray:
   """Computes V values given Q values.
@@ -376,24 +1208,60 @@ def v_value_from_q_value(q_value: np.ndarray) -> np.ndarray:
   return q_value.max(axis=-1)
 
 
+def get_num_states_actions(
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix,
+                            DeterministicTransition],
+    reward_model: np.ndarray) -> Tuple[int, int]:
+  """Returns the number of states and actions of a transition model.
+
+  Args:
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array, a (S*A) x S csr matrix or a DeterministicTransition.
+    reward_model: A reward model as a numpy 2-d array.
+
+  Returns:
+    A tuple of the number of states and the number of actions.
+  """
+  if isinstance(transition_model, (csr_matrix, DeterministicTransition)):
+    num_states, num_actions = reward_model.shape
+  else:
+    num_states, num_actions, _ = transition_model.shape
+  return num_states, num_actions
+
+
 def q_value_from_v_value(
     v_value: np.ndarray,
-    transition_model: Union[np.ndarray, sparse.COO],
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix,
+                            DeterministicTransition],
     reward_model: np.ndarray,
     discount_factor: float = 0.95,
+    q_value_out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
-  """Computes V values given a policy.
+  """Computes Q values given V values.
 
   Args:
     v_value: value of a state, V(s), as a numpy 1-d array.
-    transition_model: A transition model as a numpy 3-d array.
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array, a (S*A) x S csr matrix (see MDP.np_transition_csr) or a
+      DeterministicTransition (see MDP.deterministic_transition).
     reward_model: A reward model as a numpy 2-d array.
     discount_factor: MDP discount factor to be used for policy evaluation.
-    max_iteration: Maximum number of iterations for policy evaluation.
+    q_value_out: Optional. A preallocated numpy 2-d array to store Q values.
 
   Returns:
     value of a state and action pair, Q(s,a), as a numpy 2-d array.
   """
+  if isinstance(transition_model, (csr_matrix, DeterministicTransition)):
+    if q_value_out is None:
+      q_value_out = np.empty(reward_model.shape)
+    # backup as a single sparse matrix-vector product
+    np_next_v = transition_model @ np.nan_to_num(v_value)
+    np.multiply(np_next_v.reshape(reward_model.shape),
+                discount_factor,
+                out=q_value_out)
+    np.add(q_value_out, reward_model, out=q_value_out)
+    return q_value_out
+
   if isinstance(transition_model, sparse.COO):
     q_value = reward_model + discount_factor * sparse.tensordot(
         transition_model, np.nan_to_num(v_value), axes=(2, 0))
@@ -401,33 +1269,43 @@ def q_value_from_v_value(
     q_value = reward_model + discount_factor * np.tensordot(
         transition_model, np.nan_to_num(v_value), axes=(2, 0))
 
+  if q_value_out is not None:
+    q_value_out[:] = q_value
+    return q_value_out
+
   return q_value
 
 
 def v_value_from_policy(
     policy: np.ndarray,
-    transition_model: Union[np.ndarray, sparse.COO],
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
     reward_model: np.ndarray,
     discount_factor: float = 0.95,
     max_iteration: int = 20,
     epsilon: float = 1e-6,
     v_value_initial: Optional[np.ndarray] = None,
+    action_mask: Optional[Union[np.ndarray, ActionMaskLayout]] = None,
 ) -> np.ndarray:
   """Computes V values given a policy.
 
   Args:
     policy: A policy. Coule be either deterministic or stochastic.
-    transition_model: A transition model as a numpy 3-d array.
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr).
     reward_model: A reward model as a numpy 2-d array.
     discount_factor: MDP discount factor to be used for policy evaluation.
     max_iteration: Maximum number of iterations for policy evaluation.
     epsilon: Desired v-value threshold. Used for termination condition.
     v_value_initial: Optional. Initial guess for V value.
+    action_mask: Optional. A boolean numpy 2-d array of the allowed (state,
+      action) pairs or its ActionMaskLayout. If given, Q values are computed
+      only for the allowed pairs, whose rewards should be -inf elsewhere.
 
   Returns:
     value of a state, V(s), as a numpy 1-d array.
   """
-  num_states, num_actions, _ = transition_model.shape
+  num_states, num_actions = get_num_states_actions(transition_model,
+                                                   reward_model)
 
   if policy.ndim == 1:
     stochastic_policy = np.zeros((num_states, num_actions))
@@ -444,12 +1322,19 @@ def v_value_from_policy(
   else:
     v_value = np.zeros((num_states))
 
+  if action_mask is not None:
+    return _v_value_from_policy_masked(stochastic_policy, transition_model,
+                                       reward_model, discount_factor,
+                                       max_iteration, epsilon, v_value,
+                                       action_mask)
+
   iteration_idx = 0
   delta_v = epsilon + 1.
+  q_value = np.empty((num_states, num_actions))
   progress_bar = tqdm(total=max_iteration)
   while (iteration_idx < max_iteration) and (delta_v > epsilon):
     q_value = q_value_from_v_value(v_value, transition_model, reward_model,
-                                   discount_factor)
+                                   discount_factor, q_value)
 
     # replacing -inf (i.e., illegal state-action) with 0
     q_value[np.isneginf(q_value)] = 0
@@ -466,25 +1351,69 @@ def v_value_from_policy(
   return v_value
 
 
+def _v_value_from_policy_masked(stochastic_policy: np.ndarray,
+                                transition_model: Union[np.ndarray, sparse.COO,
+                                                        csr_matrix],
+                                reward_model: np.ndarray,
+                                discount_factor: float, max_iteration: int,
+                                epsilon: float, v_value: np.ndarray,
+                                action_mask) -> np.ndarray:
+  """v_value_from_policy over the compact layout of an action mask.
+
+  Only the allowed pairs with -inf rewards (e.g., actions forbidden given a
+  latent state) need to be replaced with 0 as in v_value_from_policy, so the
+  full-array passes over Q values are avoided.
+  """
+  layout = (action_mask if isinstance(action_mask, ActionMaskLayout) else
+            ActionMaskLayout(action_mask))
+  masked_tx = layout.get_transition_rows(transition_model)
+  np_reward = layout.compact(reward_model)
+  np_policy = layout.compact(stochastic_policy)
+  np_neginf_idx = np.flatnonzero(np.isneginf(np_reward))
+  np_q_value = np.empty(layout.num_pairs)
+
+  iteration_idx = 0
+  delta_v = epsilon + 1.
+  progress_bar = tqdm(total=max_iteration)
+  while (iteration_idx < max_iteration) and (delta_v > epsilon):
+    np.multiply(masked_tx @ v_value, discount_factor, out=np_q_value)
+    np.add(np_q_value, np_reward, out=np_q_value)
+    np_q_value[np_neginf_idx] = 0
+
+    new_v_value = layout.segment_sum(np_policy * np_q_value)
+
+    delta_v = np.linalg.norm(new_v_value - v_value)
+    iteration_idx += 1
+    v_value = new_v_value
+    progress_bar.set_postfix({'delta': delta_v})
+    progress_bar.update()
+  progress_bar.close()
+
+  return v_value
+
+
 def q_value_from_policy(
     policy: np.ndarray,
-    transition_model: Union[np.ndarray, sparse.COO],
+    transition_model: Union[np.ndarray, sparse.COO, csr_matrix],
     reward_model: np.ndarray,
     discount_factor: float = 0.95,
     max_iteration: int = 20,
     epsilon: float = 1e-6,
     v_value_initial: Optional[np.ndarray] = None,
+    action_mask: Optional[Union[np.ndarray, ActionMaskLayout]] = None,
 ) -> np.ndarray:
   """Computes V values given a policy.
 
   Args:
     policy: A policy. Coule be either deterministic or stochastic.
-    transition_model: A transition model as a numpy 3-d array.
+    transition_model: A transition model as a numpy 3-d array, a sparse 3-d
+      array or a (S*A) x S csr matrix (see MDP.np_transition_csr).
     reward_model: A reward model as a numpy 2-d array.
     discount_factor: MDP discount factor to be used for policy evaluation.
     max_iteration: Maximum number of iterations for policy evaluation.
     epsilon: Desired v-value threshold. Used for termination condition.
     v_value_initial: Optional. Initial guess for V value.
+    action_mask: Optional. See v_value_from_policy.
 
   Returns:
     value of a state and action pair, Q(s,a), as a numpy 2-d array.
@@ -498,6 +1427,7 @@ def q_value_from_policy(
       max_iteration=max_iteration,
       epsilon=epsilon,
       v_value_initial=v_value_initial,
+      action_mask=action_mask,
   )
 
   q_value = q_value_from_v_value(
@@ -545,3 +1475,118 @@ def softmax_policy_from_q_value(q_value: np.ndarray,
     return stochastic_policy
   else:
     return sc.softmax(np.nan_to_num(q_value) / temperature, axis=-1)
+
+
+def softmax_rows_from_q_value(q_value: np.ndarray,
+                              temperature: float = 1.) -> np.ndarray:
+  """Computes the softmax policy of the given rows of Q values.
+
+  Unlike softmax_policy_from_q_value, the maximum of each row is subtracted
+  before scaling by the temperature, so a row is well-defined even when all
+  of its Q values are -inf.
+
+  Args:
+    q_value: A numpy array of Q values whose last dimension corresponds to
+      action, e.g., a single row or a batch of rows of a Q table.
+    temperature: The temperature parameters while computing the softmax.
+
+  Returns:
+    probability of an action in each row as a numpy array of float64 with the
+    same shape as q_value.
+  """
+  q_value = np.nan_to_num(np.asarray(q_value, dtype=np.float64))
+  if temperature == 0:
+    policy = np.zeros(q_value.shape)
+    np.put_along_axis(policy, q_value.argmax(axis=-1)[..., None], 1., axis=-1)
+    return policy
+
+  with np.errstate(over="ignore"):
+    logits = (q_value - q_value.max(axis=-1, keepdims=True)) / temperature
+  policy = np.exp(logits)
+  policy /= policy.sum(axis=-1, keepdims=True)
+  return policy
+
+
+class SoftmaxPolicyView:
+  """A softmax policy computed from a Q table on demand.
+
+  Only a reference to the Q table is kept, so views of many temperatures can
+  share one (possibly memory-mapped) Q table. The rows of the policy are
+  computed when queried and the most recently queried ones are cached.
+
+  A view can be indexed like the (S, A) policy array for the common access
+  patterns: view[s], view[s, :] and view[np_s] with an array of states.
+  """
+
+  def __init__(self,
+               q_value: np.ndarray,
+               temperature: float = 1.,
+               dtype: np.dtype = np.float64,
+               cache_size: int = 1024):
+    """Initializes the view.
+
+    Args:
+      q_value: A numpy 2-d array of Q values. First dimension should
+        correspond to state, the second to action.
+      temperature: The temperature parameters while computing the softmax.
+      dtype: dtype of the returned policy rows.
+      cache_size: the maximum number of rows cached.
+    """
+    self.q_value = q_value
+    self.temperature = temperature
+    self.dtype = dtype
+    self.cache_size = cache_size
+    self.shape = q_value.shape
+    self._row_cache = OrderedDict()
+
+  def with_temperature(self, temperature: float) -> "SoftmaxPolicyView":
+    """Returns a view of another temperature sharing the same Q table."""
+    return SoftmaxPolicyView(self.q_value, temperature, self.dtype,
+                             self.cache_size)
+
+  def get_row(self, state_idx: int) -> np.ndarray:
+    """Returns the (read-only) action distribution at a state."""
+    state_idx = int(state_idx)
+    row = self._row_cache.get(state_idx)
+    if row is not None:
+      self._row_cache.move_to_end(state_idx)
+      return row
+
+    row = softmax_rows_from_q_value(self.q_value[state_idx],
+                                    self.temperature).astype(self.dtype,
+                                                             copy=False)
+    row.flags.writeable = False
+    if self.cache_size > 0:
+      self._row_cache[state_idx] = row
+      while len(self._row_cache) > self.cache_size:
+        self._row_cache.popitem(last=False)
+    return row
+
+  def get_rows(self, state_indices: np.ndarray) -> np.ndarray:
+    """Returns the (N, A) action distributions at N states.
+
+    Rows are computed together in one vectorized pass and are not cached.
+    """
+    state_indices = np.asarray(state_indices, dtype=np.int64)
+    return softmax_rows_from_q_value(self.q_value[state_indices],
+                                     self.temperature).astype(self.dtype,
+                                                              copy=False)
+
+  def to_array(self) -> np.ndarray:
+    """Materializes the whole (S, A) policy."""
+    return self.get_rows(np.arange(self.shape[0]))
+
+  def clear_cache(self):
+    self._row_cache.clear()
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      if len(key) != 2 or key[1] != slice(None):
+        raise IndexError("Only view[s, :] is supported for tuple indices")
+      key = key[0]
+    if np.ndim(key) == 0:
+      return self.get_row(key)
+    return self.get_rows(key)
@@ -0,0 +1,200 @@
+"""Samplers over precompiled models."""
+
+from typing import Optional
+import bisect
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def sample_from_rows(np_prob: np.ndarray,
+                     rng: Optional[np.random.Generator] = None) -> np.ndarray:
+  """Draws one sample from each row of a 2-D array of distributions.
+
+  Args:
+    np_prob: (N, K) array. Rows need not be normalized.
+    rng: Optional; a numpy random generator. Uses the global numpy random
+      state if not given.
+
+  Returns:
+    a 1-D array of N indices in [0, K).
+  """
+  np_cum = np.cumsum(np_prob, axis=1)
+  num_rows = np_cum.shape[0]
+  np_rand = np.random.random(num_rows) if rng is None else rng.random(num_rows)
+  np_rand *= np_cum[:, -1]
+  np_idx = np.count_nonzero(np_cum <= np_rand[:, None], axis=1)
+  return np.minimum(np_idx, np_cum.shape[1] - 1)
+
+
+def sample_from_dist(np_prob: np.ndarray,
+                     rng: Optional[np.random.Generator] = None) -> int:
+  """Draws one sample from a 1-D distribution.
+
+  Unlike np.random.choice, the distribution is not validated, which makes
+  this much faster for a single draw.
+
+  Args:
+    np_prob: 1-D array. Need not be normalized.
+    rng: Optional; a numpy random generator. Uses the global numpy random
+      state if not given.
+
+  Returns:
+    an index in [0, len(np_prob)).
+  """
+  np_cum = np.cumsum(np_prob)
+  rand = np.random.random() if rng is None else rng.random()
+  idx = bisect.bisect_right(np_cum, rand * np_cum[-1])
+  return min(idx, len(np_cum) - 1)
+
+
+def build_alias_table(np_prob: np.ndarray):
+  """Builds Walker alias tables of the rows of a 2-D array (Vose's method).
+
+  All rows are processed together. Each iteration pairs one remaining
+  under-full entry of every row with an over-full one of the same row,
+  so at most K iterations are needed.
+
+  Args:
+    np_prob: (N, K) array. Rows need not be normalized.
+
+  Returns:
+    a tuple of (N, K) acceptance probabilities and (N, K) alias indices.
+  """
+  np_prob = np.asarray(np_prob, dtype=np.float64)
+  num_rows, num_cols = np_prob.shape
+  np_scaled = np_prob * (num_cols / np_prob.sum(axis=1, keepdims=True))
+
+  np_accept = np.ones((num_rows, num_cols))
+  np_alias = np.tile(np.arange(num_cols), (num_rows, 1))
+  np_done = np.zeros((num_rows, num_cols), dtype=bool)
+  for _ in range(num_cols):
+    np_small = ~np_done & (np_scaled < 1.)
+    np_large = ~np_done & (np_scaled >= 1.)
+    np_row = np.flatnonzero(np_small.any(axis=1) & np_large.any(axis=1))
+    if len(np_row) == 0:
+      break
+    np_s = np.argmax(np_small[np_row], axis=1)
+    np_l = np.argmax(np_large[np_row], axis=1)
+    np_accept[np_row, np_s] = np_scaled[np_row, np_s]
+    np_alias[np_row, np_s] = np_l
+    np_done[np_row, np_s] = True
+    np_scaled[np_row, np_l] -= 1. - np_scaled[np_row, np_s]
+
+  # entries left unpaired (due to round-off) are always accepted
+  return np_accept, np_alias
+
+
+class AliasSampler:
+  """Draws from many fixed discrete distributions in O(1) per draw.
+
+  The distributions are given as an array of shape (*row_shape, K) and a
+  row is selected by its index in row_shape, e.g., (latent, state) for
+  stacked policies. A single uniform sample picks both the column and the
+  acceptance test of Walker's alias method.
+  """
+
+  def __init__(self, np_prob: np.ndarray):
+    np_prob = np.asarray(np_prob)
+    self.row_shape = np_prob.shape[:-1]
+    self.num_cols = np_prob.shape[-1]
+    np_accept, np_alias = build_alias_table(
+        np_prob.reshape(-1, self.num_cols))
+    self.np_accept = np_accept.reshape(-1)
+    self.np_alias = np_alias.reshape(-1)
+
+  def sample(self, row_idx, rng: Optional[np.random.Generator] = None) -> int:
+    """row_idx: an int or a tuple of indices into row_shape."""
+    if isinstance(row_idx, tuple):
+      row_idx = np.ravel_multi_index(row_idx, self.row_shape)
+    row_idx = int(row_idx)
+    rand = (np.random.random() if rng is None else rng.random()) * self.num_cols
+    col = min(int(rand), self.num_cols - 1)
+    pos = row_idx * self.num_cols + col
+    if rand - col < self.np_accept[pos]:
+      return col
+    return int(self.np_alias[pos])
+
+  def sample_batch(self,
+                   np_row_idx,
+                   rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """np_row_idx: a 1-D array of flat row indices or a tuple of index arrays
+    into row_shape."""
+    if isinstance(np_row_idx, tuple):
+      np_row_idx = np.ravel_multi_index(np_row_idx, self.row_shape)
+    np_row_idx = np.asarray(np_row_idx, dtype=np.int64)
+    if rng is None:
+      np_rand = np.random.random(np_row_idx.shape)
+    else:
+      np_rand = rng.random(np_row_idx.shape)
+    np_rand *= self.num_cols
+    np_col = np.minimum(np_rand.astype(np.int64), self.num_cols - 1)
+    np_pos = np_row_idx * self.num_cols + np_col
+    return np.where(np_rand - np_col < self.np_accept[np_pos], np_col,
+                    self.np_alias[np_pos])
+
+
+class TransitionSampler:
+  """Samples next states from a precompiled CSR transition table.
+
+  Each row (state_idx * num_actions + action_idx) of the table stores its
+  cumulative probabilities shifted by the row index, i.e., the entries of row
+  r lie in (r, r + 1]. A uniform sample u of row r then maps to the next state
+  by a single binary search of r + u over the whole table, which also
+  vectorizes over batches of (state, action) pairs.
+  """
+
+  def __init__(self, transition_csr: csr_matrix, num_actions: int):
+    """Initializes the sampler.
+
+    Args:
+      transition_csr: a (num_states * num_actions) x num_states transition
+        matrix (see MDP.np_transition_csr). Every row should be non-empty.
+      num_actions: the number of (joint) actions.
+    """
+    self.num_actions = num_actions
+    self.num_states = transition_csr.shape[1]
+    self.np_indptr = transition_csr.indptr.astype(np.int64)
+    self.np_next_sidx = transition_csr.indices.astype(np.int64)
+
+    np_row_len = np.diff(self.np_indptr)
+    if np.any(np_row_len == 0):
+      raise ValueError("Found (state, action) pairs without next states")
+
+    np_data = transition_csr.data.astype(np.float64)
+    np_row = np.repeat(np.arange(len(np_row_len)), np_row_len)
+    np_cum = np.cumsum(np_data)
+    np_row_start = np.concatenate(([0.], np_cum[self.np_indptr[1:-1] - 1]))
+    np_row_sum = np_cum[self.np_indptr[1:] - 1] - np_row_start
+
+    # normalize each row and pin its last entry to exactly r + 1
+    np_cum = (np_cum - np_row_start[np_row]) / np_row_sum[np_row]
+    np_cum[self.np_indptr[1:] - 1] = 1.
+    self.np_cum_prob = np_cum + np_row
+
+  def sample(self,
+             state_idx: int,
+             action_idx: int,
+             rng: Optional[np.random.Generator] = None) -> int:
+    row = state_idx * self.num_actions + action_idx
+    rand = np.random.random() if rng is None else rng.random()
+    # searching only within the row is much faster than np.searchsorted
+    # for a single query. the upper bound also guards round-off of row + rand.
+    pos = bisect.bisect_right(self.np_cum_prob, row + rand,
+                              self.np_indptr[row],
+                              self.np_indptr[row + 1] - 1)
+    return int(self.np_next_sidx[pos])
+
+  def sample_batch(self,
+                   np_state_idx: np.ndarray,
+                   np_action_idx: np.ndarray,
+                   rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    np_row = (np.asarray(np_state_idx, dtype=np.int64) * self.num_actions +
+              np.asarray(np_action_idx, dtype=np.int64))
+    if rng is None:
+      np_rand = np.random.random(np_row.shape)
+    else:
+      np_rand = rng.random(np_row.shape)
+    np_pos = np.searchsorted(self.np_cum_prob, np_row + np_rand, side="right")
+    np_pos = np.minimum(np_pos, self.np_indptr[np_row + 1] - 1)
+    return self.np_next_sidx[np_pos]
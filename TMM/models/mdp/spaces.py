@@ -3,6 +3,10 @@
 from typing import Dict, Optional, Sequence
 import numpy as np
 
+# upper bound of the size of the key lookup table of DenseSpace relative to
+# the number of elements. sparser keys fall back to dictionary lookups.
+MAX_KEY_TABLE_RATIO = 64
+
 
 class StateSpace:
   """Defines a state space."""
@@ -136,3 +140,193 @@ class NpActionSpace:
     self.np_idx_to_action = np_idx_to_action
     self.np_action_to_idx = np_action_to_idx
     self.num_actions = self.np_idx_to_action.shape[0]
+
+
+class DenseSpace:
+  """Defines a space whose elements are assigned dense integer codes.
+
+  Codes are the positions of the elements in the given sequence. If every
+  element has an integer key (either the element itself is an integer or a
+  tuple of integers, or keys are given explicitly), a lookup table from keys
+  to codes is built up front so that arrays of keys can be encoded without
+  hashing any Python object.
+  """
+  __slots__ = ("elements", "num_elements", "np_decode", "np_keys", "np_encode",
+               "_np_key_offset", "_dict_encode", "_dict_key_encode")
+
+  def __init__(self,
+               elements: Optional[Sequence] = None,
+               keys: Optional[Sequence] = None):
+    """Initializes a dense space.
+
+    Args:
+      elements: Optional; a sequence of elements. Defaults to a space with one
+        element. The input sequence should not contain any duplicated element.
+      keys: Optional; a sequence of integers or integer tuples, one per
+        element. If not given, elements are used as their own keys when
+        possible.
+    """
+    self.elements = tuple(elements) if elements is not None else (0, )
+    self.num_elements = len(self.elements)
+
+    self._dict_encode = {}
+    for code, elem in enumerate(self.elements):
+      if elem in self._dict_encode:
+        raise ValueError("Found duplicates in the space")
+      self._dict_encode[elem] = code
+
+    self.np_decode = np.empty(self.num_elements, dtype=object)
+    for code, elem in enumerate(self.elements):
+      self.np_decode[code] = elem
+
+    self.np_keys = None
+    self.np_encode = None
+    self._np_key_offset = None
+    self._dict_key_encode = None
+    self._init_key_table(self.elements if keys is None else keys)
+
+  def _init_key_table(self, keys: Sequence):
+    try:
+      np_keys = np.array(keys)
+    except ValueError:
+      return
+
+    if np_keys.dtype.kind not in "biu" or len(np_keys) != self.num_elements:
+      return
+    np_keys = np_keys.astype(np.int64).reshape(self.num_elements, -1)
+
+    np_offset = np_keys.min(axis=0)
+    table_shape = tuple(np_keys.max(axis=0) - np_offset + 1)
+    if np.prod(table_shape) > MAX_KEY_TABLE_RATIO * self.num_elements + 1024:
+      return
+
+    np_encode = np.full(table_shape, -1, dtype=np.int64)
+    np_encode[tuple((np_keys - np_offset).T)] = np.arange(self.num_elements)
+    if np.count_nonzero(np_encode >= 0) != self.num_elements:
+      raise ValueError("Found duplicates in the keys")
+
+    self.np_keys = np_keys
+    self.np_encode = np_encode
+    self._np_key_offset = np_offset
+    if np_keys.shape[1] == 1:
+      list_keys = np_keys[:, 0].tolist()
+    else:
+      list_keys = [tuple(key) for key in np_keys.tolist()]
+    self._dict_key_encode = dict(zip(list_keys, range(self.num_elements)))
+
+  def encode(self, element) -> int:
+    return self._dict_encode[element]
+
+  def decode(self, code: int):
+    return self.elements[code]
+
+  def encode_batch(self, elements: Sequence) -> np.ndarray:
+    """Encodes a sequence of elements into a 1-D array of codes."""
+    return np.fromiter((self._dict_encode[elem] for elem in elements),
+                       dtype=np.int64,
+                       count=len(elements))
+
+  def decode_batch(self, np_codes: np.ndarray) -> np.ndarray:
+    """Decodes codes into an object array of elements of the same shape."""
+    return self.np_decode[np_codes]
+
+  def encode_key(self, key) -> int:
+    """Encodes a single key. Use encode_keys for arrays of keys."""
+    if self._dict_key_encode is None:
+      raise TypeError("The elements of this space do not have integer keys")
+
+    return self._dict_key_encode[key]
+
+  def encode_keys(self, np_keys: np.ndarray) -> np.ndarray:
+    """Encodes an array of keys in a vectorized manner.
+
+    Args:
+      np_keys: an integer array of shape (..., key_length). The last axis can
+        be omitted if the keys are scalars.
+
+    Returns:
+      an array of codes of shape np_keys.shape[:-1] (or np_keys.shape for
+      scalar keys).
+    """
+    if self.np_encode is None:
+      raise TypeError("The elements of this space do not have integer keys")
+
+    key_len = self.np_keys.shape[1]
+    np_keys = np.asarray(np_keys, dtype=np.int64)
+    out_shape = np_keys.shape if key_len == 1 else np_keys.shape[:-1]
+    np_keys = np_keys.reshape(-1, key_len) - self._np_key_offset
+
+    np_valid = np.all((np_keys >= 0) & (np_keys < self.np_encode.shape), axis=1)
+    np_codes = np.full(len(np_keys), -1, dtype=np.int64)
+    np_codes[np_valid] = self.np_encode[tuple(np_keys[np_valid].T)]
+    if np.any(np_codes < 0):
+      raise KeyError("Found keys that are not in the space")
+
+    return np_codes.reshape(out_shape)
+
+  def decode_keys(self, np_codes: np.ndarray) -> np.ndarray:
+    """Decodes codes into an array of keys of shape (..., key_length)."""
+    if self.np_keys is None:
+      raise TypeError("The elements of this space do not have integer keys")
+
+    return self.np_keys[np_codes]
+
+
+class DenseStateSpace(DenseSpace):
+  """Defines a state space using DenseSpace.
+
+  Exposes the same attributes as StateSpace so that it can be used in place
+  of it.
+  """
+  __slots__ = ()
+
+  def __init__(self,
+               statespace: Optional[Sequence] = None,
+               keys: Optional[Sequence] = None):
+    super().__init__(statespace, keys)
+
+  @property
+  def statespace(self):
+    return self.elements
+
+  @property
+  def num_states(self):
+    return self.num_elements
+
+  @property
+  def idx_to_state(self):
+    return self.elements
+
+  @property
+  def state_to_idx(self):
+    return self._dict_encode
+
+
+class DenseActionSpace(DenseSpace):
+  """Defines an action space using DenseSpace.
+
+  Exposes the same attributes as ActionSpace so that it can be used in place
+  of it.
+  """
+  __slots__ = ()
+
+  def __init__(self,
+               actionspace: Optional[Sequence] = None,
+               keys: Optional[Sequence] = None):
+    super().__init__(actionspace, keys)
+
+  @property
+  def actionspace(self):
+    return self.elements
+
+  @property
+  def num_actions(self):
+    return self.num_elements
+
+  @property
+  def idx_to_action(self):
+    return self.elements
+
+  @property
+  def action_to_idx(self):
+    return self._dict_encode
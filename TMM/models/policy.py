@@ -1,11 +1,13 @@
-from typing import Sequence
+from typing import Optional, Sequence, Union
 import warnings
 import abc
 import os
+from collections import OrderedDict
 import numpy as np
 import pickle
 import TMM.models.mdp as mdp_lib
-from TMM.algs import value_iteration
+from TMM.algs import (value_iteration, value_iteration_batched,
+                      value_iteration_parallel)
 
 
 class PolicyInterface:
@@ -27,10 +29,16 @@ class PolicyInterface:
 
     raise NotImplementedError
 
-  def get_action(self, obstate_idx: int, latstate_idx: int) -> Sequence[int]:
-    'most basic implementation - override if high performance is needed'
+  def get_action(self,
+                 obstate_idx: int,
+                 latstate_idx: int,
+                 rng: Optional[np.random.Generator] = None) -> Sequence[int]:
+    '''
+    most basic implementation - override if high performance is needed
+    rng: if None, the global numpy random state is used
+    '''
     np_action_dist = self.policy(obstate_idx, latstate_idx)
-    aidx = np.random.choice(range(len(np_action_dist)), p=np_action_dist)
+    aidx = mdp_lib.sample_from_dist(np_action_dist, rng)
     return (aidx, )
 
   @abc.abstractmethod
@@ -66,68 +74,258 @@ class CachedPolicyInterface(PolicyInterface):
       file_prefix: str,
       list_policy: list,
       temperature: float,
-      queried_agent_indices: Sequence[int] = (0, )) -> None:
+      queried_agent_indices: Sequence[int] = (0, ),
+      discount_factor: Union[float, Sequence[float]] = 0.95,
+      num_workers: int = 0,
+      storage_dtype: np.dtype = np.float64,
+      policy_dtype: np.dtype = np.float64,
+      max_resident_latents: Optional[int] = None,
+      policy_view: bool = False) -> None:
     '''
       queried_agent_indices: if the stored policy consists of joint actions and
                             if you want to query specific action factors
                             from the joint action, use this argument.
                             should be sorted in increasing order
+      discount_factor: discount factor used to compute the policy. can be
+                       a sequence with one factor per latent state.
+      num_workers: if larger than 1, latent states are solved in parallel
+                   with this number of processes.
+      storage_dtype: dtype of the Q-values saved as "<file_prefix><x>.npy".
+                     np.float32 or np.float16 reduce the size of the files
+                     and of the resident Q-values at the cost of precision.
+                     Q-values saved as pickle files are still loaded.
+      policy_dtype: dtype of the softmax policies kept in memory.
+      max_resident_latents: if None, the policies of all latent states are
+                            computed upfront and kept in list_policy.
+                            otherwise, the policy of a latent state is
+                            computed from its (memory-mapped) Q-values when
+                            first queried, and at most this number of
+                            them are kept, evicting the least recently used.
+      policy_view: if True, list_policy keeps the Q-values of each latent
+                   state instead of the policies and the policy is computed
+                   from them at query time (see mdp_lib.SoftmaxPolicyView).
+                   instances of different temperatures can then share one
+                   list_policy. max_resident_latents is ignored.
     '''
     super().__init__(mdp)
     self.list_policy = list_policy
     self.file_prefix = file_prefix
     self.temperature = temperature
     self.queried_agent_indices = queried_agent_indices
+    self.discount_factor = discount_factor
+    self.num_workers = num_workers
+    self.storage_dtype = storage_dtype
+    self.policy_dtype = policy_dtype
+    self.max_resident_latents = max_resident_latents
+    self.policy_view = policy_view
+
+    # Q-values kept in memory in the lazy mode if there is no file to reload
+    self._list_q_value = None
+    self._resident_policy = OrderedDict()
+    self._dict_policy_sampler = {}
+    self._dict_policy_view = {}
 
     # for type hinting
     self.mdp = self.mdp  # type: mdp_lib.LatentMDP
 
+  def _get_q_value_file_name(self, latent_idx: int, ext: str = "npy"):
+    return self.file_prefix + "%d.%s" % (latent_idx, ext)
+
+  def _save_q_value(self, latent_idx: int, np_q_value: np.ndarray):
+    str_q_val = self._get_q_value_file_name(latent_idx)
+    dir_name = os.path.dirname(str_q_val)
+    if dir_name != "" and not os.path.exists(dir_name):
+      os.makedirs(dir_name, exist_ok=True)
+
+    # write to a temporary file first so that readers never see a partial file
+    str_tmp = str_q_val + ".%d.tmp" % (os.getpid(), )
+    with open(str_tmp, "wb") as f:
+      np.save(f, np.asarray(np_q_value, dtype=self.storage_dtype))
+    os.replace(str_tmp, str_q_val)
+
+  def _load_q_value(self, latent_idx: int) -> Optional[np.ndarray]:
+    '''
+    returns the saved Q-values of a latent state (memory-mapped if saved as
+    .npy) or None if they are not saved or do not match the MDP.
+    '''
+    if self.file_prefix == "":
+      return None
+
+    str_q_val = self._get_q_value_file_name(latent_idx)
+    if os.path.exists(str_q_val):
+      np_q_value = np.load(str_q_val, mmap_mode="r")
+    else:
+      # saved by an older version
+      str_q_val = self._get_q_value_file_name(latent_idx, "pickle")
+      if not os.path.exists(str_q_val):
+        return None
+      with open(str_q_val, "rb") as f:
+        np_q_value = pickle.load(f)
+
+    # e.g., saved before the state space of the MDP has been pruned
+    if np_q_value.shape != (self.mdp.num_states, self.mdp.num_actions):
+      warnings.warn(
+          "The Q-values loaded from a file ({}) do not match the MDP. "
+          "They will be recomputed.".format(str_q_val),
+          stacklevel=3)
+      return None
+
+    return np_q_value
+
+  def _is_lazy(self):
+    return self.max_resident_latents is not None and not self.policy_view
+
   def prepare_policy(self):
-    if (self.list_policy is None) or len(self.list_policy) == 0:
-      for idx in range(self.get_num_latent_states()):
-        str_q_val = self.file_prefix + "%d.pickle" % (idx, )
-        np_q_value = None
-        GAMMA = 0.95
-        if self.file_prefix == "" or (not os.path.exists(str_q_val)):
-          _, _, np_q_value = value_iteration(self.mdp.np_transition_model,
-                                             self.mdp.np_reward_model[idx],
-                                             discount_factor=GAMMA,
-                                             max_iteration=500,
-                                             epsilon=0.01)
-
-          if self.file_prefix != "":
-            dir_name = os.path.dirname(str_q_val)
-            if not os.path.exists(dir_name):
-              os.makedirs(dir_name)
-            with open(str_q_val, "wb") as f:
-              pickle.dump(np_q_value, f, pickle.HIGHEST_PROTOCOL)
-        else:
-          with open(str_q_val, "rb") as f:
-            np_q_value = pickle.load(f)
-
-          warnings.warn(
-              "The Q-values for the policy has been loaded from a file ({}). "
-              "If any related implementation is changed, "
-              "be sure to delete the saved file and regenerate it.".format(
-                  "prefix: " + os.path.basename(self.file_prefix)),
-              stacklevel=2)
-
-        self.list_policy.append(
-            mdp_lib.softmax_policy_from_q_value(np_q_value, self.temperature))
-
-  # TODO: not tested yet
+    if self._is_lazy():
+      if self._list_q_value is not None:
+        return
+    elif len(self.list_policy) > 0:
+      return
+
+    MAX_ITERATION = 500
+    EPSILON = 0.01
+    num_latents = self.get_num_latent_states()
+    if np.ndim(self.discount_factor) == 0:
+      list_gamma = [self.discount_factor] * num_latents
+    else:
+      list_gamma = list(self.discount_factor)
+
+    list_q_value = [None] * num_latents
+    list_to_solve = []
+    for idx in range(num_latents):
+      np_q_value = self._load_q_value(idx)
+      if np_q_value is None:
+        list_to_solve.append(idx)
+      elif not self._is_lazy():
+        list_q_value[idx] = np_q_value
+
+    if len(list_to_solve) < num_latents:
+      warnings.warn(
+          "The Q-values for the policy has been loaded from a file ({}). "
+          "If any related implementation is changed, "
+          "be sure to delete the saved file and regenerate it.".format(
+              "prefix: " + os.path.basename(self.file_prefix)),
+          stacklevel=2)
+
+    def store_q_value(pos, np_q_value):
+      idx = list_to_solve[pos]
+      if self.file_prefix != "":
+        self._save_q_value(idx, np_q_value)
+      # in the lazy mode, saved Q-values are reloaded when queried
+      if not self._is_lazy() or self.file_prefix == "":
+        list_q_value[idx] = np_q_value
+
+    list_gamma_to_solve = [list_gamma[idx] for idx in list_to_solve]
+    np_action_mask = None
+    if len(list_to_solve) > 0:
+      # Q-values of latents solved together are kept only for legal pairs
+      np_action_mask = self.mdp.get_backup_action_mask()
+      layout = mdp_lib.ActionMaskLayout(np_action_mask)
+    if len(list_to_solve) == 0:
+      pass
+    elif self.num_workers > 1:
+      # latents are solved in parallel and saved as soon as each finishes
+      value_iteration_parallel(self.mdp.np_transition_csr,
+                               self.mdp.np_reward_model[list_to_solve],
+                               discount_factor=list_gamma_to_solve,
+                               max_iteration=MAX_ITERATION,
+                               epsilon=EPSILON,
+                               num_workers=self.num_workers,
+                               callback=store_q_value,
+                               action_mask=np_action_mask)
+    elif len(set(list_gamma_to_solve)) == 1:
+      # solve all latents sharing the transition model at once
+      _, _, np_q_values = value_iteration_batched(
+          self.mdp.backup_transition_model,
+          self.mdp.np_reward_model[list_to_solve],
+          discount_factor=list_gamma_to_solve[0],
+          max_iteration=MAX_ITERATION,
+          epsilon=EPSILON,
+          action_mask=layout,
+          compact_q_value=True)
+      for pos in range(len(list_to_solve)):
+        store_q_value(pos, layout.expand(np_q_values[pos]))
+    else:
+      for pos, idx in enumerate(list_to_solve):
+        _, _, np_q_value = value_iteration(self.mdp.backup_transition_model,
+                                           self.mdp.np_reward_model[idx],
+                                           discount_factor=list_gamma[idx],
+                                           max_iteration=MAX_ITERATION,
+                                           epsilon=EPSILON,
+                                           action_mask=layout)
+        store_q_value(pos, np_q_value)
+
+    if self._is_lazy():
+      if self.file_prefix == "":
+        self._list_q_value = [
+            np.asarray(np_q_value, dtype=self.storage_dtype)
+            for np_q_value in list_q_value
+        ]
+      else:
+        self._list_q_value = [None] * num_latents
+    elif self.policy_view:
+      for np_q_value in list_q_value:
+        if not isinstance(np_q_value, np.memmap):
+          np_q_value = np.asarray(np_q_value, dtype=self.storage_dtype)
+        self.list_policy.append(np_q_value)
+    else:
+      for np_q_value in list_q_value:
+        self.list_policy.append(self._compute_policy(np_q_value))
+
+  def _compute_policy(self, np_q_value: np.ndarray) -> np.ndarray:
+    np_policy = mdp_lib.softmax_policy_from_q_value(
+        np.asarray(np_q_value, dtype=np.float64), self.temperature)
+    return np_policy.astype(self.policy_dtype, copy=False)
+
+  def get_latent_policy(
+      self, latstate_idx: int
+  ) -> Union[np.ndarray, mdp_lib.SoftmaxPolicyView]:
+    '''
+    returns (S, A) distributions of the joint action given a latent state.
+    a SoftmaxPolicyView of the Q-values in the policy view mode.
+    '''
+    if self.policy_view:
+      self.prepare_policy()
+      view = self._dict_policy_view.get(latstate_idx)
+      if view is None:
+        view = mdp_lib.SoftmaxPolicyView(self.list_policy[latstate_idx],
+                                         self.temperature, self.policy_dtype)
+        self._dict_policy_view[latstate_idx] = view
+      return view
+
+    if not self._is_lazy():
+      self.prepare_policy()
+      return self.list_policy[latstate_idx]
+
+    np_policy = self._resident_policy.get(latstate_idx)
+    if np_policy is not None:
+      self._resident_policy.move_to_end(latstate_idx)
+      return np_policy
+
+    self.prepare_policy()
+    np_q_value = self._list_q_value[latstate_idx]
+    if np_q_value is None:
+      np_q_value = self._load_q_value(latstate_idx)
+    np_policy = self._compute_policy(np_q_value)
+
+    self._resident_policy[latstate_idx] = np_policy
+    while len(self._resident_policy) > max(self.max_resident_latents, 1):
+      evicted, _ = self._resident_policy.popitem(last=False)
+      self._dict_policy_sampler.pop(evicted, None)
+    return np_policy
+
   def policy(self, obstate_idx: int, latstate_idx: int) -> np.ndarray:
     '''
     return: 1-D distribution of the joint action
     NOTE: can be slow if the joint action consists of multiple factors
     '''
-    self.prepare_policy()
+    np_policy = self.get_latent_policy(latstate_idx)
 
     # if the entire joint actions are queried, marginalization is not needed
     if len(self.mdp.list_num_actions) == len(self.queried_agent_indices):
-      return self.list_policy[latstate_idx][obstate_idx, :]
+      return np_policy[obstate_idx, :]
 
-    np_action_dist = np.reshape(self.list_policy[latstate_idx][obstate_idx, :],
+    np_action_dist = np.reshape(np_policy[obstate_idx, :],
                                 self.mdp.list_num_actions)
 
     # marginalize out residual actions
@@ -139,17 +337,58 @@ class CachedPolicyInterface(PolicyInterface):
         axis=tuple(axis2sum))  # type: np.ndarray
     return np_action_dist.ravel()
 
-  def get_action(self, obstate_idx: int, latstate_idx: int):
-    self.prepare_policy()
-
-    joint_aidx = np.random.choice(
-        range(self.mdp.num_actions),
-        size=1,
-        replace=False,
-        p=self.list_policy[latstate_idx][obstate_idx, :])[0]
+  def get_policy_sampler(self, latstate_idx: int) -> mdp_lib.AliasSampler:
+    '''
+    alias tables of the joint action distributions of every state given
+    a latent state. evicted together with the policy in the lazy mode.
+    '''
+    np_policy = self.get_latent_policy(latstate_idx)
+    sampler = self._dict_policy_sampler.get(latstate_idx)
+    if sampler is None:
+      if isinstance(np_policy, mdp_lib.SoftmaxPolicyView):
+        np_policy = np_policy.to_array()
+      sampler = mdp_lib.AliasSampler(np_policy)
+      self._dict_policy_sampler[latstate_idx] = sampler
+    return sampler
+
+  def get_action(self,
+                 obstate_idx: int,
+                 latstate_idx: int,
+                 rng: Optional[np.random.Generator] = None):
+    'rng: if None, the global numpy random state is used'
+    if self.policy_view:
+      joint_aidx = mdp_lib.sample_from_dist(
+          self.get_latent_policy(latstate_idx).get_row(obstate_idx), rng)
+    else:
+      joint_aidx = self.get_policy_sampler(latstate_idx).sample(
+          obstate_idx, rng)
     vector_indv_aidx = self.mdp.conv_idx_to_action(joint_aidx)
     return vector_indv_aidx[list(self.queried_agent_indices)]
 
+  def get_action_batch(
+      self,
+      np_obstate_idx: np.ndarray,
+      np_latstate_idx: np.ndarray,
+      rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    '''
+    draws actions of many (state, latent) pairs at once.
+    return: (N, num_queried_agents) action indices
+    '''
+    np_obstate_idx = np.asarray(np_obstate_idx)
+    np_latstate_idx = np.asarray(np_latstate_idx)
+    np_joint_aidx = np.zeros(len(np_obstate_idx), dtype=np.int64)
+    for xidx in np.unique(np_latstate_idx).tolist():
+      np_mask = np_latstate_idx == xidx
+      if self.policy_view:
+        np_joint_aidx[np_mask] = mdp_lib.sample_from_rows(
+            self.get_latent_policy(xidx).get_rows(np_obstate_idx[np_mask]),
+            rng)
+      else:
+        np_joint_aidx[np_mask] = self.get_policy_sampler(xidx).sample_batch(
+            np_obstate_idx[np_mask], rng)
+    np_indv_aidx = self.mdp.conv_idx_to_action_batch(np_joint_aidx)
+    return np_indv_aidx[:, list(self.queried_agent_indices)]
+
   def conv_idx_to_action(self, tuple_aidx: Sequence[int]):
     list_actions = []
     for idx, fidx in enumerate(self.queried_agent_indices):
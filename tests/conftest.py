@@ -0,0 +1,160 @@
+import inspect
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from TMM.algs import value_iteration
+from TMM.domains.rescue_v2 import (Route, Location, E_Type, Work, Place,
+                                   PlaceName)
+
+DISCOUNT = 0.9
+
+# box push map small enough to build every model in a fraction of a second
+SMALL_BOX_PUSH_MAP = {
+    "x_grid": 4,
+    "y_grid": 3,
+    "a1_init": (3, 0),
+    "a2_init": (3, 2),
+    "boxes": [(0, 0), (0, 2)],
+    "goals": [(3, 1)],
+    "walls": [(1, 1)],
+    "wall_dir": [0],
+    "drops": [],
+    "box_types": [2, 1],
+}
+
+SMALL_CLEANUP_MAP = {
+    "x_grid": 4,
+    "y_grid": 3,
+    "init_pos": (3, 1),
+    "boxes": [(0, 0), (0, 2)],
+    "goals": [(3, 0)],
+    "walls": [(1, 1)],
+    "wall_dir": [0],
+    "drops": [],
+}
+
+
+def get_small_rescue_map():
+  'returns the keyword arguments of a rescue_v2 map with three agents'
+  return {
+      "places": [
+          Place(PlaceName.Fire_stateion, (0.1, 0.1)),
+          Place(PlaceName.City_hall, (0.2, 0.2), helps=1),
+          Place(PlaceName.Mall, (0.3, 0.3), helps=2),
+          Place(PlaceName.Intersection1, (0.4, 0.4), visible=False),
+      ],
+      "routes": [
+          Route(start=0, end=1, length=2),
+          Route(start=3, end=2, length=1),
+      ],
+      "connections": {
+          0: [(E_Type.Route, 0), (E_Type.Place, 3)],
+          1: [(E_Type.Route, 0)],
+          2: [(E_Type.Route, 1)],
+          3: [(E_Type.Place, 0), (E_Type.Route, 1)],
+      },
+      "work_locations": [
+          Location(E_Type.Place, id=1),
+          Location(E_Type.Place, id=2)
+      ],
+      "work_info": [
+          Work(workload=1, rescue_place=1),
+          Work(workload=2, rescue_place=2)
+      ],
+      "a1_init": Location(E_Type.Place, 0),
+      "a2_init": Location(E_Type.Place, 0),
+      "a3_init": Location(E_Type.Place, 3),
+  }
+
+
+class RandomMDP:
+  '''
+  a small random MDP.
+    np_tx: (S, A, S) dense transition model. every pair moves to at least
+           one state and some move to themselves.
+    np_reward: (S, A) reward model, or (num_rewards, S, A) reward models.
+    np_mask: (S, A) legal pairs. if masked, rewards of the others are -inf.
+             otherwise, every pair is legal.
+  '''
+
+  def __init__(self,
+               seed: int = 0,
+               num_rewards=None,
+               masked: bool = False,
+               num_states: int = 15,
+               num_actions: int = 3) -> None:
+    rng = np.random.default_rng(seed)
+    self.num_states = num_states
+    self.num_actions = num_actions
+    np_tx = rng.random((num_states, num_actions, num_states))
+    np_tx[np_tx < 0.7] = 0
+    np_next = rng.integers(num_states, size=(num_states, num_actions))
+    np_tx[np.arange(num_states)[:, None], np.arange(num_actions), np_next] += 1
+    self.np_tx = np_tx / np_tx.sum(axis=-1, keepdims=True)
+
+    shape = (num_states, num_actions)
+    if num_rewards is not None:
+      shape = (num_rewards, ) + shape
+    self.np_reward = rng.normal(size=shape)
+
+    self.np_mask = np.ones((num_states, num_actions), dtype=bool)
+    if masked:
+      self.np_mask = rng.random((num_states, num_actions)) < 0.6
+      self.np_mask[np.arange(num_states),
+                   rng.integers(num_actions, size=num_states)] = True
+      self.np_mask[0] = True  # a state with every action allowed
+      self.np_mask[1] = np.arange(num_actions) == 1  # and one with a single
+      self.np_reward[..., ~self.np_mask] = -np.inf
+
+  def get_csr(self) -> csr_matrix:
+    'returns the (S*A) x S transition matrix (see MDP.np_transition_csr)'
+    return csr_matrix(
+        self.np_tx.reshape(self.num_states * self.num_actions,
+                           self.num_states))
+
+
+@pytest.fixture
+def random_mdp():
+  'returns the RandomMDP class to build MDPs of different seeds'
+  return RandomMDP
+
+
+@pytest.fixture
+def solve():
+  '''
+  returns a function that runs a value iteration solver until convergence,
+  i.e., solve(np_tx, np_reward, solver=value_iteration, **kwargs).
+  options the solver does not take are left out.
+  '''
+
+  def solve_impl(transition_model,
+                 reward_model,
+                 solver=value_iteration,
+                 **kwargs):
+    options = dict(discount_factor=DISCOUNT,
+                   max_iteration=1000,
+                   epsilon=1e-10)
+    params = inspect.signature(solver).parameters
+    options = {key: val for key, val in options.items() if key in params}
+    options.update(kwargs)
+    return solver(transition_model, reward_model, **options)
+
+  return solve_impl
+
+
+@pytest.fixture
+def small_map():
+  'returns the keyword arguments of a small box push map'
+  return dict(SMALL_BOX_PUSH_MAP)
+
+
+@pytest.fixture
+def cleanup_map():
+  'returns the keyword arguments of a small single-agent cleanup map'
+  return dict(SMALL_CLEANUP_MAP)
+
+
+@pytest.fixture
+def rescue_map():
+  'returns the keyword arguments of a small rescue_v2 map'
+  return get_small_rescue_map()
@@ -0,0 +1,35 @@
+import numpy as np
+import scipy.special as sc
+from TMM.domains.box_push.mdp import BoxPushTeamMDP_AlwaysTogether
+from TMM.models.mdp import ActionMaskLayout
+
+
+def test_cached_masks_match_scalar_queries(small_map):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+  for sidx in range(mdp.num_states):
+    assert mdp.np_terminal_mask[sidx] == mdp.is_terminal(sidx)
+    if not mdp.is_terminal(sidx):
+      assert (set(np.flatnonzero(mdp.np_legal_action_mask[sidx]).tolist()) ==
+              set(mdp.legal_actions(sidx)))
+
+
+def test_layout_matches_dense(random_mdp):
+  mdp = random_mdp(seed=2, num_rewards=2, masked=True)
+  np_reward = mdp.np_reward
+  layout = ActionMaskLayout(mdp.np_mask)
+  np_compact = layout.compact(np_reward)
+  assert np_compact.shape == (2, mdp.np_mask.sum())
+  assert np.array_equal(layout.expand(np_compact), np_reward)
+  assert np.allclose(layout.segment_max(np_compact), np_reward.max(axis=-1))
+  assert np.array_equal(layout.segment_argmax(np_compact),
+                        np_reward.argmax(axis=-1))
+  for temperature in (0.3, 1.):
+    np_prob = layout.expand(layout.softmax(np_compact, temperature), 0.)
+    assert np.allclose(np_prob, sc.softmax(np_reward / temperature, axis=-1))
+
+
+def test_layout_argmax_breaks_ties_toward_first_action():
+  np_mask = np.array([[True, True, True], [False, True, True]])
+  layout = ActionMaskLayout(np_mask)
+  np_q = np.array([[1., 2., 2.], [-np.inf, 0., 0.]])
+  assert np.array_equal(layout.segment_argmax(layout.compact(np_q)), [1, 1])
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from TMM.domains.box_push.mdp import (BoxPushAgentMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysTogether)
+from TMM.domains.cleanup_single.mdp import MDPCleanupSingle
+from TMM.domains.rescue import (Route, Location, E_Type, Work, Place,
+                                PlaceName)
+from TMM.domains.rescue.mdp import (MDP_Rescue_Agent as MDP_RescueV1_Agent,
+                                    MDP_Rescue_Task as MDP_RescueV1_Task)
+from TMM.domains.rescue_v2.mdp import MDP_Rescue_Agent, MDP_Rescue_Task
+
+
+def get_small_rescue_v1_map():
+  'returns the keyword arguments of a rescue map with two agents'
+  return {
+      "places": [
+          Place(PlaceName.Fire_stateion, (0.1, 0.1)),
+          Place(PlaceName.City_hall, (0.2, 0.2), helps=1),
+          Place(PlaceName.Mall, (0.3, 0.3), helps=2),
+      ],
+      "routes": [
+          Route(start=0, end=1, length=2),
+          Route(start=0, end=2, length=1),
+      ],
+      "connections": {
+          0: [(E_Type.Route, 0), (E_Type.Route, 1)],
+          1: [(E_Type.Route, 0)],
+          2: [(E_Type.Route, 1)],
+      },
+      "work_locations": [
+          Location(E_Type.Place, id=1),
+          Location(E_Type.Place, id=2)
+      ],
+      "work_info": [
+          Work(workload=1, rescue_place=1),
+          Work(workload=2, rescue_place=2)
+      ],
+  }
+
+
+def create_mdp(name, small_map, cleanup_map, rescue_map):
+  'returns an MDP of a small map that overrides some batch hooks'
+  if name == "cleanup_single":
+    return MDPCleanupSingle(**cleanup_map)
+  if name == "rescue_v1_agent":
+    return MDP_RescueV1_Agent(**get_small_rescue_v1_map())
+  if name == "rescue_v1_task":
+    return MDP_RescueV1_Task(**get_small_rescue_v1_map())
+  if name == "rescue_agent":
+    return MDP_Rescue_Agent(**rescue_map)
+  if name == "rescue_task":
+    return MDP_Rescue_Task(**rescue_map)
+
+  mdp_class = {
+      "box_push_together": BoxPushTeamMDP_AlwaysTogether,
+      "box_push_alone": BoxPushTeamMDP_AlwaysAlone,
+      "box_push_alone_agent": BoxPushAgentMDP_AlwaysAlone,
+  }[name]
+  return mdp_class(**small_map)
+
+
+DOMAINS = [
+    "box_push_together", "box_push_alone", "box_push_alone_agent",
+    "cleanup_single", "rescue_v1_agent", "rescue_v1_task", "rescue_agent",
+    "rescue_task"
+]
+
+
+@pytest.fixture(params=DOMAINS)
+def mdp(request, small_map, cleanup_map, rescue_map):
+  return create_mdp(request.param, small_map, cleanup_map, rescue_map)
+
+
+def test_transition_batch_matches_scalar(mdp):
+  num_pairs = mdp.num_states * mdp.num_actions
+  np_state_idx = np.arange(num_pairs) // mdp.num_actions
+  np_action_idx = np.arange(num_pairs) % mdp.num_actions
+  np_pair_pos, np_next_sidx, np_next_p = mdp.transition_model_batch(
+      np_state_idx, np_action_idx)
+
+  list_batch = [{} for _ in range(num_pairs)]
+  for pos, sidx_n, p in zip(np_pair_pos.tolist(), np_next_sidx.tolist(),
+                            np_next_p.tolist()):
+    list_batch[pos][sidx_n] = list_batch[pos].get(sidx_n, 0) + p
+
+  for pos in range(num_pairs):
+    np_next_p_state = mdp.transition_model(int(np_state_idx[pos]),
+                                           int(np_action_idx[pos]))
+    dict_scalar = {}
+    for p, sidx_n in np_next_p_state:
+      dict_scalar[int(sidx_n)] = dict_scalar.get(int(sidx_n), 0) + p
+    assert list_batch[pos].keys() == dict_scalar.keys()
+    for sidx_n, p in dict_scalar.items():
+      assert list_batch[pos][sidx_n] == pytest.approx(p)
+
+
+def test_masks_batch_match_scalar(mdp):
+  np_state_idx = np.arange(mdp.num_states)
+  np_terminal = mdp.is_terminal_batch(np_state_idx)
+  np_legal_mask = mdp.legal_action_mask_batch(np_state_idx)
+  for state in range(mdp.num_states):
+    assert np_terminal[state] == mdp.is_terminal(state)
+    np_legal = np.zeros(mdp.num_actions, dtype=bool)
+    np_legal[mdp.legal_actions(state)] = True
+    assert np.array_equal(np_legal_mask[state], np_legal)
+
+
+def test_conv_sim_states_batch_matches_scalar(mdp):
+  np_state_idx = np.arange(mdp.num_states)
+  tup_states = mdp.conv_mdp_sidx_to_sim_states_batch(np_state_idx)
+  assert np.array_equal(mdp.conv_sim_states_to_mdp_sidx_batch(tup_states),
+                        np_state_idx)
+
+  # batch hooks take position codes instead of locations in rescue domains
+  list_to_scalar = [lambda x: x] * len(tup_states)
+  if hasattr(mdp, "conv_pos_codes_to_locations"):
+    list_to_scalar[1:] = ([mdp.conv_pos_codes_to_locations] *
+                          (len(tup_states) - 1))
+  list_columns = [
+      to_scalar(np.asarray(column))
+      for to_scalar, column in zip(list_to_scalar, tup_states)
+  ]
+  for state in range(mdp.num_states):
+    tup_scalar = mdp.conv_mdp_sidx_to_sim_states(state)
+    tup_batch = tuple(column[state] for column in list_columns)
+    for item_scalar, item_batch in zip(tup_scalar, tup_batch):
+      assert np.array_equal(np.asarray(item_scalar, dtype=object),
+                            np.asarray(item_batch, dtype=object))
+    assert mdp.conv_sim_states_to_mdp_sidx(tup_scalar) == state
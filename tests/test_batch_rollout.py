@@ -0,0 +1,127 @@
+import functools
+import numpy as np
+import pytest
+from TMM.domains.batch_simulator import run_simulation_parallel
+from TMM.domains.box_push.agent import (BoxPushAIAgent_Indv1,
+                                        BoxPushAIAgent_Indv2,
+                                        BoxPushAIAgent_Team1,
+                                        BoxPushAIAgent_Team2)
+from TMM.domains.box_push.mdp import (BoxPushTeamMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysTogether)
+from TMM.domains.box_push.simulator import (BoxPushSimulator_AlwaysAlone,
+                                            BoxPushSimulator_AlwaysTogether)
+from TMM.models.policy import PolicyInterface
+
+
+class RandomLatentPolicy(PolicyInterface):
+  'random policy of one action factor of a latent task MDP'
+
+  def __init__(self, mdp, agent_idx, seed) -> None:
+    super().__init__(mdp)
+    self.act_space = mdp.dict_factored_actionspace[agent_idx]
+    self.np_policy = np.random.default_rng(seed).dirichlet(
+        np.ones(self.act_space.num_actions),
+        size=(mdp.num_latents, mdp.num_states))
+
+  def policy(self, obstate_idx, latstate_idx):
+    return self.np_policy[latstate_idx, obstate_idx]
+
+  def conv_idx_to_action(self, tuple_aidx):
+    return tuple(self.act_space.idx_to_action[aidx] for aidx in tuple_aidx)
+
+  def conv_action_to_idx(self, tuple_actions):
+    return tuple(self.act_space.action_to_idx[act] for act in tuple_actions)
+
+  def get_num_actions(self):
+    return self.act_space.num_actions
+
+  def get_num_latent_states(self):
+    return self.mdp.num_latents
+
+  def conv_idx_to_latent(self, latent_idx):
+    return self.mdp.latent_space.idx_to_state[latent_idx]
+
+  def conv_latent_to_idx(self, latent_state):
+    return self.mdp.latent_space.state_to_idx[latent_state]
+
+
+def create_simulator(map_info, together=True, max_steps=30):
+  'returns a box push simulator with two AI agents and its task MDP'
+  if together:
+    mdp = BoxPushTeamMDP_AlwaysTogether(**map_info)
+    simulator = BoxPushSimulator_AlwaysTogether(0)
+    agent1 = BoxPushAIAgent_Team1(RandomLatentPolicy(mdp, 0, seed=0))
+    agent2 = BoxPushAIAgent_Team2(RandomLatentPolicy(mdp, 1, seed=1))
+  else:
+    mdp = BoxPushTeamMDP_AlwaysAlone(**map_info)
+    simulator = BoxPushSimulator_AlwaysAlone(0)
+    agent1 = BoxPushAIAgent_Indv1(RandomLatentPolicy(mdp, 0, seed=0))
+    agent2 = BoxPushAIAgent_Indv2(RandomLatentPolicy(mdp, 1, seed=1))
+  simulator.init_game(**map_info)
+  simulator.set_autonomous_agent(agent1, agent2)
+  simulator.max_steps = max_steps
+  return simulator, mdp
+
+
+@pytest.mark.parametrize("together", [True, False])
+def test_latent_transitions_match_agents(together, small_map, monkeypatch):
+  simulator, mdp = create_simulator(small_map, together)
+  trajs = simulator.run_simulation_batch(100,
+                                         mdp,
+                                         rng=np.random.default_rng(0))
+  assert trajs.np_lengths.sum() > 0
+
+  # latent distributions the agents sample from in update_mental_state
+  list_rows = []
+  for agent in simulator.agents:
+
+    def record_row(*args, cb_tx=agent.agent_model.transition_mental_state):
+      list_rows.append(np.asarray(cb_tx(*args)))
+      return list_rows[-1]
+
+    monkeypatch.setattr(agent.agent_model, "transition_mental_state",
+                        record_row)
+
+  np_expected = np.zeros(mdp.num_latents)
+  np_observed = np.zeros(mdp.num_latents)
+  for env_idx in range(trajs.get_num_trajectories()):
+    list_sax = trajs.get_trajectory(env_idx)
+    for t in range(len(list_sax) - 1):
+      sidx, tup_aidx, tup_latents = list_sax[t]
+      sidx_n, _, tup_latents_n = list_sax[t + 1]
+      tup_cur_state = mdp.conv_mdp_sidx_to_sim_states(sidx)
+      tup_nxt_state = mdp.conv_mdp_sidx_to_sim_states(sidx_n)
+      tup_actions = mdp.conv_mdp_aidx_to_sim_actions(
+          mdp.conv_action_to_idx(tup_aidx))
+      for idx, agent in enumerate(simulator.agents):
+        agent.agent_model.current_latent = tup_latents[idx]
+        agent.update_mental_state(tup_cur_state, tup_actions, tup_nxt_state)
+        np_row = list_rows[-1] / list_rows[-1].sum()
+        # the batched latent is drawn from the same distribution
+        assert np_row[tup_latents_n[idx]] > 0
+        np_expected += np_row
+        np_observed[tup_latents_n[idx]] += 1
+
+  np_var = np.maximum(np_expected * (1 - np_expected / np_observed.sum()), 1)
+  assert np.all(np.abs(np_observed - np_expected) < 5 * np.sqrt(np_var))
+
+
+def test_parallel_rollouts_do_not_depend_on_num_workers(small_map):
+  # module-level function so that worker processes can unpickle it
+  cb_create = functools.partial(create_simulator, small_map, False)
+  list_trajs = [
+      run_simulation_parallel(cb_create,
+                              50,
+                              seed=7,
+                              num_workers=num_workers,
+                              shard_size=20) for num_workers in (1, 2)
+  ]
+  assert list_trajs[0].get_num_trajectories() == 50
+  for name in ("np_states", "np_actions", "np_latents", "np_lengths"):
+    assert np.array_equal(getattr(list_trajs[0], name),
+                          getattr(list_trajs[1], name))
+
+  # another seed gives other games
+  trajs = run_simulation_parallel(cb_create, 50, seed=8, num_workers=1,
+                                  shard_size=20)
+  assert not np.array_equal(trajs.np_states, list_trajs[0].np_states)
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from TMM.domains.agent import compile_agent_model
+from TMM.domains.box_push.agent_model import (BoxPushAM_Alone,
+                                              BoxPushAM_Together)
+from TMM.domains.box_push.mdp import (BoxPushAgentMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysTogether)
+from TMM.domains.cleanup_single.agent import AM_CleanupSingle
+from TMM.domains.cleanup_single.mdp import MDPCleanupSingle
+from TMM.domains.rescue_v2.agent import RescueAM
+from TMM.domains.rescue_v2.mdp import MDP_Rescue_Agent
+from TMM.models.policy import PolicyInterface
+
+
+class UniformPolicy(PolicyInterface):
+  'uniform policy over the latent states of a latent MDP'
+
+  def policy(self, obstate_idx, latstate_idx):
+    return np.full(self.mdp.num_actions, 1 / self.mdp.num_actions)
+
+  def get_num_latent_states(self):
+    return self.mdp.num_latents
+
+  def conv_idx_to_latent(self, latent_idx):
+    return self.mdp.latent_space.idx_to_state[latent_idx]
+
+  def conv_latent_to_idx(self, latent_state):
+    return self.mdp.latent_space.state_to_idx[latent_state]
+
+
+def create_agent_model(name, small_map, cleanup_map, rescue_map):
+  'returns a rule-based agent model of a small map'
+  if name == "box_push_together":
+    mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+    return BoxPushAM_Together(agent_idx=1, policy_model=UniformPolicy(mdp))
+  if name == "box_push_alone":
+    mdp = BoxPushAgentMDP_AlwaysAlone(**small_map)
+    return BoxPushAM_Alone(agent_idx=0, policy_model=UniformPolicy(mdp))
+  if name == "cleanup_single":
+    return AM_CleanupSingle(UniformPolicy(MDPCleanupSingle(**cleanup_map)))
+
+  mdp = MDP_Rescue_Agent(**rescue_map)
+  return RescueAM(agent_idx=0, policy_model=UniformPolicy(mdp))
+
+
+# mask_sas of None means (s, s')
+CASES = [("box_push_together", None),
+         ("box_push_together", (True, True, False, True)),
+         ("box_push_alone", None), ("cleanup_single", None),
+         ("rescue_agent", None)]
+
+
+@pytest.fixture(params=CASES, ids=lambda case: "%s-%s" % case)
+def models(request, small_map, cleanup_map, rescue_map):
+  name, mask_sas = request.param
+  agent_model = create_agent_model(name, small_map, cleanup_map, rescue_map)
+  return agent_model, compile_agent_model(agent_model, mask_sas)
+
+
+@pytest.mark.filterwarnings("ignore:invalid value")
+def test_compiled_model_matches_original(models):
+  agent_model, compiled_model = models
+  mdp = agent_model.get_reference_mdp()
+  num_latents = agent_model.policy_model.get_num_latent_states()
+
+  for sidx in range(mdp.num_states):
+    # rescue models give nan when every work is done
+    assert np.array_equal(compiled_model.initial_mental_distribution(sidx),
+                          agent_model.initial_mental_distribution(sidx),
+                          equal_nan=True)
+
+  np_coo = mdp.np_transition_csr.tocoo()
+  num_mats = len(compiled_model.np_tx.list_tx_mats)
+  for row, sidx_n in zip(np_coo.row.tolist(), np_coo.col.tolist()):
+    sidx = row // mdp.num_actions
+    tuple_aidx = tuple(mdp.conv_idx_to_action(row % mdp.num_actions))
+    for xidx in range(num_latents):
+      assert np.array_equal(
+          compiled_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                                 sidx_n),
+          agent_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                              sidx_n),
+          equal_nan=True)
+  # every input in the support is precomputed
+  assert len(compiled_model.np_tx.list_tx_mats) == num_mats
+
+
+@pytest.mark.filterwarnings("ignore:invalid value")
+def test_inputs_out_of_support_fall_back(models):
+  agent_model, compiled_model = models
+  mdp = agent_model.get_reference_mdp()
+  num_latents = agent_model.policy_model.get_num_latent_states()
+  np_tx = compiled_model.np_tx
+
+  # pairs of states that no action connects
+  np_reachable = np.zeros((mdp.num_states, mdp.num_states), dtype=bool)
+  np_coo = mdp.np_transition_csr.tocoo()
+  np_reachable[np_coo.row // mdp.num_actions, np_coo.col] = True
+  list_sidx, list_sidx_n = np.nonzero(~np_reachable)
+  rng = np.random.default_rng(0)
+  np_pick = rng.choice(len(list_sidx), size=21, replace=False)
+  tuple_aidx = (0, ) * mdp.num_action_factors
+
+  for sidx, sidx_n in zip(list_sidx[np_pick[:-1]].tolist(),
+                          list_sidx_n[np_pick[:-1]].tolist()):
+    for xidx in range(num_latents):
+      assert np.array_equal(
+          compiled_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                                 sidx_n),
+          agent_model.transition_mental_state(xidx, sidx, tuple_aidx,
+                                              sidx_n),
+          equal_nan=True)
+
+  # the fallback results are cached
+  num_mats = len(np_tx.list_tx_mats)
+  sidx, sidx_n = int(list_sidx[np_pick[0]]), int(list_sidx_n[np_pick[0]])
+  compiled_model.transition_mental_state(0, sidx, tuple_aidx, sidx_n)
+  assert len(np_tx.list_tx_mats) == num_mats
+
+  # without cb_tx, inputs out of the support are not evaluated
+  np_tx.cb_tx = None
+  sidx, sidx_n = int(list_sidx[np_pick[-1]]), int(list_sidx_n[np_pick[-1]])
+  with pytest.raises(KeyError):
+    compiled_model.transition_mental_state(0, sidx, tuple_aidx, sidx_n)
@@ -0,0 +1,131 @@
+import itertools
+import numpy as np
+from TMM.domains.batch_simulator import BatchTrajectories
+from TMM.domains.box_push.mdp import BoxPushTeamMDP_AlwaysTogether
+from TMM.domains.latent_inference import LatentInference
+from TMM.models.agent_model import AgentModel
+from TMM.models.policy import PolicyInterface
+
+NUM_LATENTS = 3
+
+
+class TablePolicy(PolicyInterface):
+  'random policy of one action factor of the task MDP'
+
+  def __init__(self, mdp, agent_idx, rng) -> None:
+    super().__init__(mdp)
+    self.act_space = mdp.dict_factored_actionspace[agent_idx]
+    self.np_policy = rng.dirichlet(
+        np.ones(self.act_space.num_actions),
+        size=(NUM_LATENTS, mdp.num_states))
+
+  def policy(self, obstate_idx, latstate_idx):
+    return self.np_policy[latstate_idx, obstate_idx]
+
+  def conv_idx_to_action(self, tuple_aidx):
+    return tuple(self.act_space.idx_to_action[aidx] for aidx in tuple_aidx)
+
+  def conv_action_to_idx(self, tuple_actions):
+    return tuple(self.act_space.action_to_idx[act] for act in tuple_actions)
+
+  def get_num_actions(self):
+    return self.act_space.num_actions
+
+  def get_num_latent_states(self):
+    return NUM_LATENTS
+
+  def conv_idx_to_latent(self, latent_idx):
+    return latent_idx
+
+  def conv_latent_to_idx(self, latent_state):
+    return latent_state
+
+
+class TableAgentModel(AgentModel):
+  'latent transitions that depend on the state and the joint action'
+
+  def __init__(self, policy_model, rng) -> None:
+    super().__init__(policy_model)
+    mdp = policy_model.mdp
+    self.np_init = rng.dirichlet(np.ones(NUM_LATENTS), size=mdp.num_states)
+    list_num_actions = [
+        mdp.dict_factored_actionspace[idx].num_actions
+        for idx in range(mdp.num_action_factors)
+    ]
+    self.np_tx = rng.dirichlet(np.ones(NUM_LATENTS),
+                               size=list_num_actions + [2, NUM_LATENTS])
+
+  def initial_mental_distribution(self, obstate_idx):
+    return self.np_init[obstate_idx]
+
+  def transition_mental_state(self, latstate_idx, obstate_idx,
+                              tuple_action_idx, obstate_next_idx):
+    return self.np_tx[tuple(tuple_action_idx) +
+                      ((obstate_idx + obstate_next_idx) % 2, latstate_idx)]
+
+
+def create_problem(map_info, list_lengths, seed=0):
+  rng = np.random.default_rng(seed)
+  mdp = BoxPushTeamMDP_AlwaysTogether(**map_info)
+  agent_models = [
+      TableAgentModel(TablePolicy(mdp, idx, rng), rng) for idx in range(2)
+  ]
+  trajs = BatchTrajectories(len(list_lengths), max(list_lengths), 2)
+  for idx, length in enumerate(list_lengths):
+    trajs.np_states[idx, :length + 1] = rng.integers(mdp.num_states,
+                                                     size=length + 1)
+    for i_a in range(2):
+      trajs.np_actions[idx, :length, i_a] = rng.integers(
+          mdp.dict_factored_actionspace[i_a].num_actions, size=length)
+    trajs.np_lengths[idx] = length
+  return LatentInference(mdp, agent_models), agent_models, trajs
+
+
+def enumerate_joint_probs(agent_model, agent_idx, trajs, env_idx):
+  'returns all latent sequences and their joint probabilities with actions'
+  length = trajs.np_lengths[env_idx]
+  np_states = trajs.np_states[env_idx]
+  np_actions = trajs.np_actions[env_idx]
+  list_seqs = list(itertools.product(range(NUM_LATENTS), repeat=length + 1))
+  list_probs = []
+  for seq in list_seqs:
+    prob = agent_model.initial_mental_distribution(np_states[0])[seq[0]]
+    for t in range(length):
+      prob *= agent_model.policy_model.policy(
+          np_states[t], seq[t])[np_actions[t, agent_idx]]
+      prob *= agent_model.transition_mental_state(
+          seq[t], np_states[t], tuple(np_actions[t]),
+          np_states[t + 1])[seq[t + 1]]
+    list_probs.append(prob)
+  return np.array(list_seqs), np.array(list_probs)
+
+
+def test_forward_backward_matches_enumeration(small_map):
+  inference, agent_models, trajs = create_problem(small_map, [4, 0, 2, 3])
+  for agent_idx, agent_model in enumerate(agent_models):
+    np_posterior, np_log_lik = inference.forward_backward(trajs, agent_idx)
+    for env_idx, length in enumerate(trajs.np_lengths):
+      np_seqs, np_probs = enumerate_joint_probs(agent_model, agent_idx, trajs,
+                                                env_idx)
+      assert np.isclose(np_log_lik[env_idx], np.log(np_probs.sum()))
+      for t in range(length + 1):
+        np_marginal = np.bincount(np_seqs[:, t],
+                                  weights=np_probs,
+                                  minlength=NUM_LATENTS)
+        assert np.allclose(np_posterior[env_idx, t],
+                           np_marginal / np_probs.sum())
+      assert np.all(np_posterior[env_idx, length + 1:] == 0)
+
+
+def test_viterbi_matches_enumeration(small_map):
+  inference, agent_models, trajs = create_problem(small_map, [4, 0, 2, 3],
+                                                  seed=1)
+  for agent_idx, agent_model in enumerate(agent_models):
+    np_latents, np_log_prob = inference.viterbi(trajs, agent_idx)
+    for env_idx, length in enumerate(trajs.np_lengths):
+      np_seqs, np_probs = enumerate_joint_probs(agent_model, agent_idx, trajs,
+                                                env_idx)
+      best = np.argmax(np_probs)
+      assert np.array_equal(np_latents[env_idx, :length + 1], np_seqs[best])
+      assert np.all(np_latents[env_idx, length + 1:] == -1)
+      assert np.isclose(np_log_prob[env_idx], np.log(np_probs[best]))
@@ -0,0 +1,125 @@
+import os
+import sys
+import textwrap
+import numpy as np
+import pytest
+from TMM.domains.box_push.mdp import (BoxPushAgentMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysTogether)
+
+TINY_MDP_SOURCE = '''
+import numpy as np
+from TMM.models.mdp import MDP, StateSpace, ActionSpace
+from tiny_domain.transition import next_state
+
+
+class TinyMDP(MDP):
+  num_transition_calls = 0
+
+  def __init__(self, num_cells, cache_file_path):
+    self.num_cells = num_cells
+    super().__init__(cache_file_path=cache_file_path)
+
+  def init_statespace(self):
+    self.dict_factored_statespace = {0: StateSpace(list(range(self.num_cells)))}
+    self.dummy_states = None
+
+  def init_actionspace(self):
+    self.dict_factored_actionspace = {0: ActionSpace([-1, 0, 1])}
+
+  def map_to_str(self):
+    return "line%d" % (self.num_cells, )
+
+  def transition_model(self, state_idx, action_idx):
+    TinyMDP.num_transition_calls += 1
+    move = self.conv_idx_to_action(action_idx)[0] - 1
+    return np.array([[1.0, next_state(state_idx, move, self.num_cells)]])
+
+  def legal_actions(self, state_idx):
+    return [0, 1, 2]
+
+  def reward(self, state_idx, action_idx):
+    return float(state_idx == self.num_cells - 1)
+'''
+
+TRANSITION_SOURCE = '''
+def next_state(state, move, num_cells):
+  return min(max(state + move, 0), num_cells - 1)
+'''
+
+# wraps around instead of stopping at both ends
+TRANSITION_SOURCE_CHANGED = '''
+def next_state(state, move, num_cells):
+  return (state + move) % num_cells
+'''
+
+
+@pytest.fixture
+def tiny_domain(tmp_path, monkeypatch):
+  '''
+  returns a function that (re)writes the tiny_domain package with the given
+  transition source and imports its MDP class anew
+  '''
+  # as in box_push, the transition code is outside the MDP's directory
+  package_dir = os.path.join(tmp_path, "src", "tiny_domain")
+  os.makedirs(os.path.join(package_dir, "mdp"))
+  monkeypatch.syspath_prepend(os.path.join(tmp_path, "src"))
+
+  def write_and_import(transition_source):
+    for file_name, source in (("__init__.py", ""), ("mdp/__init__.py", ""),
+                              ("mdp/tiny_mdp.py", TINY_MDP_SOURCE),
+                              ("transition.py", transition_source)):
+      with open(os.path.join(package_dir, file_name), "w") as file:
+        file.write(textwrap.dedent(source))
+    for name in list(sys.modules):
+      if name.split(".")[0] == "tiny_domain":
+        monkeypatch.delitem(sys.modules, name)
+    # sources are rewritten within the same second. skip stale bytecode.
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    from tiny_domain.mdp.tiny_mdp import TinyMDP
+    return TinyMDP
+
+  return write_and_import
+
+
+@pytest.mark.parametrize("mdp_class",
+                         [BoxPushTeamMDP_AlwaysTogether,
+                          BoxPushAgentMDP_AlwaysAlone])
+def test_source_files_cover_transition_code(small_map, mdp_class):
+  mdp = mdp_class(**small_map)
+  list_files = [
+      os.path.relpath(file_name, os.path.dirname(os.path.dirname(__file__)))
+      for file_name in mdp.get_source_files()
+  ]
+  for file_name in ("TMM/domains/box_push/transition.py",
+                    "TMM/domains/box_push/define.py",
+                    "TMM/models/mdp/mdp.py"):
+    assert file_name in list_files
+
+
+def test_cached_models_round_trip(tiny_domain, tmp_path):
+  cache_dir = os.path.join(tmp_path, "cache")
+  TinyMDP = tiny_domain(TRANSITION_SOURCE)
+  mdp = TinyMDP(5, cache_dir)
+  np_tx = mdp.np_transition_model
+  np_reward = mdp.np_reward_model
+  assert TinyMDP.num_transition_calls > 0
+  assert len(os.listdir(cache_dir)) > 0
+
+  # the same code and configuration loads the saved models
+  TinyMDP.num_transition_calls = 0
+  mdp_loaded = TinyMDP(5, cache_dir)
+  assert mdp_loaded.get_cache_key() == mdp.get_cache_key()
+  assert np.array_equal(np.asarray(mdp_loaded.np_transition_model),
+                        np.asarray(np_tx))
+  assert np.array_equal(mdp_loaded.np_reward_model, np_reward)
+  assert TinyMDP.num_transition_calls == 0
+
+  # a change of the imported transition code invalidates them
+  TinyMDP = tiny_domain(TRANSITION_SOURCE_CHANGED)
+  mdp_changed = TinyMDP(5, cache_dir)
+  assert mdp_changed.get_cache_key() != mdp.get_cache_key()
+  np_tx_changed = np.asarray(mdp_changed.np_transition_model)
+  assert TinyMDP.num_transition_calls > 0
+  assert not np.array_equal(np_tx_changed, np.asarray(np_tx))
+  # moving right from the last cell wraps around to the first
+  assert np_tx_changed[4, 2, 0] == 1
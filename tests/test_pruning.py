@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from TMM.domains.box_push.mdp import (BoxPushAgentMDP_AlwaysAlone,
+                                      BoxPushTeamMDP_AlwaysTogether)
+from TMM.domains.box_push_truck.mdp import MDP_Movers_Agent
+from TMM.domains.cleanup_single.mdp import MDPCleanupSingle
+from TMM.domains.rescue_v2.mdp import MDP_Rescue_Agent
+
+
+def create_mdp(name, small_map, cleanup_map, rescue_map, **kwargs):
+  'returns an MDP of a small map and its initial simulator states'
+  if name == "cleanup_single":
+    init_states = [([0] * len(cleanup_map["boxes"]), cleanup_map["init_pos"])]
+    return MDPCleanupSingle(**cleanup_map, **kwargs), init_states
+  if name == "rescue_agent":
+    init_states = [([1] * len(rescue_map["work_locations"]),
+                    rescue_map["a1_init"], rescue_map["a2_init"],
+                    rescue_map["a3_init"])]
+    return MDP_Rescue_Agent(**rescue_map, **kwargs), init_states
+
+  mdp_class = {
+      "box_push_together": BoxPushTeamMDP_AlwaysTogether,
+      "box_push_alone_agent": BoxPushAgentMDP_AlwaysAlone,
+      "movers_agent": MDP_Movers_Agent,
+  }[name]
+  if name == "movers_agent":
+    small_map = dict(small_map, box_types=[2, 2])
+  init_states = [([0] * len(small_map["boxes"]), small_map["a1_init"],
+                  small_map["a2_init"])]
+  return mdp_class(**small_map, **kwargs), init_states
+
+
+DOMAINS = [
+    "box_push_together", "box_push_alone_agent", "movers_agent",
+    "cleanup_single", "rescue_agent"
+]
+
+
+@pytest.fixture(params=DOMAINS)
+def full_and_pruned(request, small_map, cleanup_map, rescue_map):
+  full_mdp, init_states = create_mdp(request.param, small_map, cleanup_map,
+                                     rescue_map)
+  pruned_mdp, _ = create_mdp(request.param,
+                             small_map,
+                             cleanup_map,
+                             rescue_map,
+                             initial_sim_states=init_states)
+  return full_mdp, pruned_mdp
+
+
+def test_pruned_models_match_restricted_full_models(full_and_pruned):
+  full_mdp, pruned_mdp = full_and_pruned
+  np_full_sidx = pruned_mdp.np_sidx_to_full_sidx
+  assert pruned_mdp.num_states == len(np_full_sidx) < full_mdp.num_states
+
+  num_actions = full_mdp.num_actions
+  np_rows = (np_full_sidx[:, None] * num_actions +
+             np.arange(num_actions)).reshape(-1)
+  np_tx_full = full_mdp.np_transition_csr[np_rows][:, np_full_sidx]
+  assert (abs(np_tx_full - pruned_mdp.np_transition_csr)).max() == 0
+  # no probability leaks to unreachable states
+  assert np.allclose(np_tx_full.sum(axis=1), 1)
+
+  assert np.array_equal(full_mdp.np_reward_model[..., np_full_sidx, :],
+                        pruned_mdp.np_reward_model)
+  assert np.array_equal(full_mdp.np_terminal_mask[np_full_sidx],
+                        pruned_mdp.np_terminal_mask)
+  assert np.array_equal(full_mdp.np_legal_action_mask[np_full_sidx],
+                        pruned_mdp.np_legal_action_mask)
+
+
+def test_unreachable_states_are_not_converted(full_and_pruned):
+  full_mdp, pruned_mdp = full_and_pruned
+  np_reached = np.zeros(full_mdp.num_states, dtype=bool)
+  np_reached[pruned_mdp.np_sidx_to_full_sidx] = True
+  unreachable = int(np.flatnonzero(~np_reached)[0])
+  reachable = int(pruned_mdp.np_sidx_to_full_sidx[-1])
+
+  tup_states = full_mdp.conv_mdp_sidx_to_sim_states(unreachable)
+  with pytest.raises(ValueError):
+    pruned_mdp.conv_sim_states_to_mdp_sidx(tup_states)
+  with pytest.raises(ValueError):
+    pruned_mdp.conv_state_to_idx(tuple(full_mdp.conv_idx_to_state(unreachable)))
+  with pytest.raises(ValueError):
+    pruned_mdp.conv_state_to_idx_batch(
+        full_mdp.np_idx_to_state[[reachable, unreachable]])
+
+  assert pruned_mdp.conv_sim_states_to_mdp_sidx(
+      full_mdp.conv_mdp_sidx_to_sim_states(reachable)) == (
+          pruned_mdp.num_states - 1)
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from TMM.domains.box_push.mdp import BoxPushTeamMDP_AlwaysTogether
+
+
+@pytest.mark.parametrize("drops", [[], [(2, 1)]])
+def test_reward_batch_always_together(small_map, drops):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**dict(small_map, drops=drops))
+  mdp.validate_reward_batch(num_samples=5000, rng=np.random.default_rng(0))
+
+
+def test_reward_batch_terminal_states(small_map):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+  np_state = np.nonzero(mdp.np_terminal_mask)[0]
+  assert len(np_state) > 0
+  np_action = np.zeros_like(np_state)
+  for latent_idx in range(mdp.num_latents):
+    np_expected = [
+        mdp.reward(latent_idx, state, 0) for state in np_state.tolist()
+    ]
+    assert np.allclose(mdp.reward_batch(latent_idx, np_state, np_action),
+                       np_expected)
@@ -0,0 +1,88 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from TMM.models.mdp import (AliasSampler, TransitionSampler, build_alias_table,
+                            sample_from_dist, sample_from_rows)
+
+NUM_DRAWS = 100000
+
+
+def create_distributions(seed=0, num_rows=4, num_cols=6):
+  'unnormalized rows with some zero entries'
+  rng = np.random.default_rng(seed)
+  np_prob = rng.random((num_rows, num_cols)) * 3
+  np_prob[rng.random((num_rows, num_cols)) < 0.3] = 0
+  np_prob[:, 0] += 0.1
+  np_prob[-1] = 0
+  np_prob[-1, 2] = 5  # a deterministic row
+  return np_prob
+
+
+def assert_frequencies(np_samples, np_prob):
+  'checks the frequencies of samples drawn from one distribution'
+  np_prob = np_prob / np_prob.sum()
+  np_freq = np.bincount(np_samples, minlength=len(np_prob)) / len(np_samples)
+  np_std = np.sqrt(np_prob * (1 - np_prob) / len(np_samples))
+  assert np.all(np.abs(np_freq - np_prob) <= 5 * np_std + 1e-12)
+  assert np.all(np_freq[np_prob == 0] == 0)
+
+
+def test_alias_table_is_exact():
+  np_prob = create_distributions()
+  np_accept, np_alias = build_alias_table(np_prob)
+  num_rows, num_cols = np_prob.shape
+  for row in range(num_rows):
+    np_implied = np_accept[row].copy()
+    np.add.at(np_implied, np_alias[row], 1 - np_accept[row])
+    assert np.allclose(np_implied / num_cols,
+                       np_prob[row] / np_prob[row].sum())
+
+
+def test_alias_sampler_batch():
+  np_prob = create_distributions(seed=1).reshape(2, 2, -1)
+  sampler = AliasSampler(np_prob)
+  rng = np.random.default_rng(0)
+  for idx in np.ndindex(2, 2):
+    np_samples = sampler.sample_batch(
+        (np.full(NUM_DRAWS, idx[0]), np.full(NUM_DRAWS, idx[1])), rng)
+    assert_frequencies(np_samples, np_prob[idx])
+
+
+def test_alias_sampler_single():
+  np_prob = create_distributions(seed=2)
+  sampler = AliasSampler(np_prob)
+  rng = np.random.default_rng(1)
+  np_samples = np.array([sampler.sample(1, rng) for _ in range(NUM_DRAWS)])
+  assert_frequencies(np_samples, np_prob[1])
+
+
+def test_sample_from_rows():
+  np_prob = create_distributions(seed=3)
+  rng = np.random.default_rng(2)
+  np_samples = sample_from_rows(np.repeat(np_prob, NUM_DRAWS, axis=0), rng)
+  for row, np_row_samples in enumerate(np_samples.reshape(len(np_prob), -1)):
+    assert_frequencies(np_row_samples, np_prob[row])
+
+
+def test_sample_from_dist():
+  np_prob = create_distributions(seed=4)[0]
+  rng = np.random.default_rng(3)
+  np_samples = np.array(
+      [sample_from_dist(np_prob, rng) for _ in range(NUM_DRAWS)])
+  assert_frequencies(np_samples, np_prob)
+
+
+def test_transition_sampler():
+  num_states, num_actions = 6, 2
+  np_prob = create_distributions(seed=5, num_rows=num_states * num_actions,
+                                 num_cols=num_states)
+  np_prob /= np_prob.sum(axis=1, keepdims=True)
+  sampler = TransitionSampler(csr_matrix(np_prob), num_actions)
+  rng = np.random.default_rng(4)
+  for state, action in [(0, 0), (2, 1), (5, 1)]:
+    row = state * num_actions + action
+    np_samples = sampler.sample_batch(np.full(NUM_DRAWS, state),
+                                      np.full(NUM_DRAWS, action), rng)
+    assert_frequencies(np_samples, np_prob[row])
+    np_samples = np.array(
+        [sampler.sample(state, action, rng) for _ in range(NUM_DRAWS // 10)])
+    assert_frequencies(np_samples, np_prob[row])
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from TMM.domains.box_push.mdp import BoxPushAgentMDP_AlwaysAlone
+from TMM.domains.rescue_v2.mdp import MDP_Rescue_Agent
+
+
+def compute_scalar_csr(mdp, cb_next_p_state):
+  '''
+  builds the transition csr of mdp with illegal actions and terminal states
+  staying at the same state.
+    cb_next_p_state: (state_idx, action_idx) -> iterable of (p, next_sidx)
+  '''
+  np_active = mdp.np_legal_action_mask & ~mdp.np_terminal_mask[:, None]
+  list_rows = []
+  list_next = []
+  list_prob = []
+  for state in range(mdp.num_states):
+    for action in range(mdp.num_actions):
+      row = state * mdp.num_actions + action
+      if not np_active[state, action]:
+        list_next_p_state = [(1, state)]
+      else:
+        list_next_p_state = cb_next_p_state(state, action)
+      for p, sidx_n in list_next_p_state:
+        list_rows.append(row)
+        list_next.append(int(sidx_n))
+        list_prob.append(p)
+  # duplicated entries are summed up
+  return csr_matrix((list_prob, (list_rows, list_next)),
+                    shape=(mdp.num_states * mdp.num_actions, mdp.num_states))
+
+
+@pytest.mark.parametrize("mdp_class", ["box_push", "rescue"])
+def test_uniform_teammates_match_scalar_model(mdp_class, small_map,
+                                              rescue_map):
+  if mdp_class == "box_push":
+    mdp = BoxPushAgentMDP_AlwaysAlone(**small_map)
+  else:
+    mdp = MDP_Rescue_Agent(**rescue_map)
+  assert mdp.create_task_mdp() is not None
+
+  np_tx_scalar = compute_scalar_csr(mdp, mdp.transition_model)
+  # transition models are stored in float32
+  assert abs(mdp.np_transition_csr - np_tx_scalar).max() < 1e-6
+
+
+@pytest.mark.parametrize("agent_idx", [0, 1])
+def test_teammate_policy_matches_marginalized_task(agent_idx, small_map):
+  mdp = BoxPushAgentMDP_AlwaysAlone(**small_map)
+  task_mdp = mdp.create_task_mdp()
+  num_mate_actions = task_mdp.list_num_actions[1 - agent_idx]
+
+  rng = np.random.default_rng(0)
+  np_policy = rng.random((mdp.num_states, num_mate_actions))
+  np_policy[:, 0] = 0  # some teammate actions are never taken
+  np_policy /= np_policy.sum(axis=1, keepdims=True)
+  mdp.set_teammate_model(task_mdp, np_policy, agent_idx=agent_idx)
+
+  def marginalize_task(state, action):
+    list_next_p_state = []
+    for mate_action in range(num_mate_actions):
+      tup_aidx = ((action, mate_action) if agent_idx == 0 else
+                  (mate_action, action))
+      joint_action = task_mdp.conv_action_to_idx(tup_aidx)
+      for p, sidx_n in task_mdp.transition_model(state, joint_action):
+        list_next_p_state.append((np_policy[state, mate_action] * p, sidx_n))
+    return list_next_p_state
+
+  np_tx_scalar = compute_scalar_csr(mdp, marginalize_task)
+  assert abs(mdp.np_transition_csr - np_tx_scalar).max() < 1e-6
+
+  # a uniform teammate differs from the given policy
+  mdp.set_teammate_model()
+  assert abs(mdp.np_transition_csr - np_tx_scalar).max() > 1e-3
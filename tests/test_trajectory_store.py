@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from TMM.domains.batch_simulator import BatchTrajectories
+from TMM.domains.box_push.mdp import BoxPushTeamMDP_AlwaysTogether
+from TMM.domains.box_push.simulator import BoxPushSimulator_AlwaysTogether
+from TMM.domains.trajectory_loader import get_episode_file_names
+from TMM.domains.trajectory_store import (TrajectoryStore,
+                                          conv_store_to_text_files,
+                                          conv_text_files_to_store,
+                                          save_batch_trajectories,
+                                          save_episodes)
+
+
+def create_random_episodes(mdp, list_lengths, seed=0):
+  'returns (states, joint actions, latents) of episodes of random indices'
+  rng = np.random.default_rng(seed)
+  episodes = []
+  for length in list_lengths:
+    np_latents = rng.integers(-1, mdp.num_latents, size=(length + 1, 2))
+    episodes.append((rng.integers(mdp.num_states, size=length + 1),
+                     rng.integers(mdp.num_actions, size=length), np_latents))
+  return episodes
+
+
+def assert_same_episodes(store, episodes):
+  assert store.get_num_episodes() == len(episodes)
+  assert np.array_equal(store.get_lengths(),
+                        [len(np_actions) for _, np_actions, _ in episodes])
+  for idx, episode in enumerate(episodes):
+    for np_col, np_expected in zip(store.get_episode(idx), episode):
+      assert np.array_equal(np_col, np_expected)
+
+
+def test_save_episodes_round_trip(tmp_path, small_map):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+  episodes = create_random_episodes(mdp, [5, 0, 12, 1])
+  dir_path = os.path.join(tmp_path, "store")
+  save_episodes(dir_path, *zip(*episodes))
+  store = TrajectoryStore(dir_path)
+  assert_same_episodes(store, episodes)
+  # the action column is -1 at the last state of each episode
+  assert np.all(store.np_actions[store.np_offsets[1:] - 1] == -1)
+
+  # an existing store is replaced
+  episodes = create_random_episodes(mdp, [3, 7], seed=1)
+  save_episodes(dir_path, *zip(*episodes))
+  assert_same_episodes(TrajectoryStore(dir_path), episodes)
+
+
+def test_batch_trajectories_round_trip(tmp_path, small_map):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+  episodes = create_random_episodes(mdp, [4, 0, 9], seed=2)
+  trajs = BatchTrajectories.from_episodes(episodes, mdp)
+  dir_path = os.path.join(tmp_path, "store")
+  save_batch_trajectories(dir_path, trajs, mdp)
+  store = TrajectoryStore(dir_path)
+  assert_same_episodes(store, episodes)
+
+  trajs_loaded = BatchTrajectories.from_episodes(
+      [store.get_episode(idx) for idx in range(store.get_num_episodes())],
+      mdp)
+  for name in ("np_states", "np_actions", "np_latents", "np_lengths"):
+    assert np.array_equal(getattr(trajs_loaded, name), getattr(trajs, name))
+
+
+def test_text_files_round_trip(tmp_path, small_map):
+  mdp = BoxPushTeamMDP_AlwaysTogether(**small_map)
+  episodes = create_random_episodes(mdp, [3, 12, 1], seed=3)
+  for _, _, np_latents in episodes:
+    np_latents[np_latents < 0] = 0
+  dir_path = os.path.join(tmp_path, "store")
+  save_episodes(dir_path, *zip(*episodes))
+
+  simulator = BoxPushSimulator_AlwaysTogether(0)
+  simulator.init_game(**small_map)
+  text_dir = os.path.join(tmp_path, "text")
+  conv_store_to_text_files(TrajectoryStore(dir_path), simulator, mdp,
+                           os.path.join(text_dir, "episode"), "header")
+  list_file_names = get_episode_file_names(text_dir)
+  conv_text_files_to_store(list_file_names, BoxPushSimulator_AlwaysTogether,
+                           mdp, os.path.join(tmp_path, "store_text"))
+
+  # history files do not record the latents of the last state
+  for _, _, np_latents in episodes:
+    np_latents[-1] = -1
+  assert_same_episodes(TrajectoryStore(os.path.join(tmp_path, "store_text")),
+                       episodes)
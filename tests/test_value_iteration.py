@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from TMM.algs import (value_iteration, value_iteration_batched,
+                      value_iteration_gauss_seidel,
+                      value_iteration_parallel, value_iteration_prioritized)
+from TMM.models.mdp import ActionMaskLayout
+
+
+@pytest.mark.parametrize("mask_type", [None, "array", "layout"])
+def test_csr_matches_dense(random_mdp, solve, mask_type):
+  mdp = random_mdp(masked=mask_type is not None)
+  policy, v_value, q_value = solve(mdp.np_tx, mdp.np_reward)
+  assert np.all(np.isfinite(v_value))
+
+  kwargs = {}
+  if mask_type == "array":
+    kwargs = dict(action_mask=mdp.np_mask)
+  elif mask_type == "layout":
+    layout = ActionMaskLayout(mdp.np_mask)
+    kwargs = dict(action_mask=layout, compact_q_value=True)
+  policy_csr, v_csr, q_csr = solve(mdp.get_csr(), mdp.np_reward, **kwargs)
+  if mask_type == "layout":
+    assert q_csr.shape == (layout.num_pairs, )
+    q_csr = layout.expand(q_csr)
+  assert np.allclose(v_csr, v_value)
+  assert np.allclose(q_csr, q_value)
+  assert np.array_equal(np.isneginf(q_csr), ~mdp.np_mask)
+  assert np.array_equal(policy_csr, policy)
+
+
+@pytest.mark.parametrize("masked", [False, True])
+@pytest.mark.parametrize("max_iteration", [1000, 1, 3])
+def test_batched_matches_separate(random_mdp, solve, masked, max_iteration):
+  mdp = random_mdp(seed=1, num_rewards=4, masked=masked)
+  # the first reward converges at the first iteration. with a small
+  # max_iteration, the others are cut off right after it converges.
+  mdp.np_reward[0][mdp.np_mask] = 0
+
+  kwargs = dict(action_mask=mdp.np_mask) if masked else {}
+  policy, v_value, q_value = solve(mdp.get_csr(),
+                                   mdp.np_reward,
+                                   solver=value_iteration_batched,
+                                   max_iteration=max_iteration,
+                                   **kwargs)
+  assert v_value.shape == (mdp.num_states, len(mdp.np_reward))
+  for idx, np_reward_x in enumerate(mdp.np_reward):
+    policy_x, v_x, q_x = solve(mdp.np_tx,
+                               np_reward_x,
+                               max_iteration=max_iteration)
+    assert np.allclose(v_value[:, idx], v_x)
+    assert np.allclose(q_value[idx], q_x)
+    assert np.array_equal(policy[idx], policy_x)
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 256])
+def test_gauss_seidel_matches_dense(random_mdp, solve, block_size):
+  mdp = random_mdp(seed=2)
+  policy, v_value, _ = solve(mdp.np_tx, mdp.np_reward)
+  policy_gs, v_gs, _ = solve(mdp.get_csr(),
+                             mdp.np_reward,
+                             solver=value_iteration_gauss_seidel,
+                             block_size=block_size)
+  assert np.allclose(v_gs, v_value)
+  assert np.array_equal(policy_gs, policy)
+
+
+def test_prioritized_matches_dense(random_mdp, solve):
+  mdp = random_mdp(seed=3)
+  policy, v_value, _ = solve(mdp.np_tx, mdp.np_reward)
+  policy_ps, v_ps, _ = solve(mdp.get_csr(),
+                             mdp.np_reward,
+                             solver=value_iteration_prioritized)
+  assert np.allclose(v_ps, v_value)
+  assert np.array_equal(policy_ps, policy)
+
+
+@pytest.mark.parametrize("dense", [False, True])
+@pytest.mark.parametrize("masked", [False, True])
+def test_parallel_matches_serial(random_mdp, solve, dense, masked):
+  mdp = random_mdp(seed=5, num_rewards=3, masked=masked)
+  list_discount = [0.9, 0.8, 0.95]
+  transition_model = mdp.np_tx if dense else mdp.get_csr()
+  list_callback = []
+  list_q_value = value_iteration_parallel(
+      transition_model,
+      mdp.np_reward,
+      discount_factor=list_discount,
+      max_iteration=1000,
+      epsilon=1e-10,
+      num_workers=2,
+      callback=lambda idx, q_value: list_callback.append(idx),
+      action_mask=mdp.np_mask if masked else None)
+  assert sorted(list_callback) == [0, 1, 2]
+  for idx, np_reward_x in enumerate(mdp.np_reward):
+    _, _, q_x = solve(mdp.np_tx,
+                      np_reward_x,
+                      discount_factor=list_discount[idx])
+    assert np.allclose(list_q_value[idx], q_x, rtol=0, atol=1e-12)